@@ -1,13 +1,59 @@
 import streamlit as st
-from main import InventorySystem
-import pandas as pd
+from datetime import date, datetime, time, timedelta
+from main import InventorySystem, BULK_CHUNK_SIZE, LOW_STOCK_THRESHOLD, SEARCH_PAGE_SIZE
+from importer import import_products, PRODUCT_FIELDS
+
+# Seconds read pages may show results cached before another process changed products;
+# writes made through this app clear the caches right away
+READ_CACHE_TTL = 30
+
+
+@st.cache_resource(show_spinner=False)
+def get_inventory() -> InventorySystem:
+    """One InventorySystem per process, shared by every session and rerun; databases are connected on first use."""
+    return InventorySystem(lazy_connections=True)
+
+
+@st.cache_data(ttl=READ_CACHE_TTL, show_spinner=False)
+def load_products_page(page_size: int, after, order_by: str):
+    return get_inventory().list_products_page(page_size, after, order_by)
+
+
+@st.cache_data(ttl=READ_CACHE_TTL, show_spinner=False)
+def load_price_range(min_price: float, max_price: float):
+    return get_inventory().get_products_by_price_range(min_price, max_price, result_format='dataframe')
+
+
+@st.cache_data(ttl=READ_CACHE_TTL, show_spinner=False)
+def load_search(query: str, category_id, supplier_id, mode: str, page: int):
+    return get_inventory().search_products(
+        query, category_id=category_id, supplier_id=supplier_id, mode=mode, page=page, page_size=SEARCH_PAGE_SIZE
+    )
+
+
+@st.cache_data(ttl=READ_CACHE_TTL, show_spinner=False)
+def load_shard_stats():
+    inventory = get_inventory()
+    return inventory.get_shard_counts(), inventory.get_shard_stats()
+
+
+@st.cache_data(ttl=READ_CACHE_TTL, show_spinner=False)
+def load_dashboard(group_by: str, low_stock_threshold: int):
+    return get_inventory().aggregate_products(group_by, low_stock_threshold, result_format='dataframe')
+
+
+def invalidate_product_reads():
+    """Drop the cached read pages after a write (categories and suppliers are cached by InventorySystem itself)."""
+    for cached in (load_products_page, load_price_range, load_search, load_shard_stats, load_dashboard):
+        cached.clear()
+
 
 # Initialize Streamlit app
 st.title("Mini Inventory Management System")
 
 # Initialize InventorySystem
 try:
-    inventory = InventorySystem()
+    inventory = get_inventory()
 except Exception as e:
     st.error(f"Failed to connect to databases: {str(e)}")
     st.stop()
@@ -22,13 +68,18 @@ operation = st.sidebar.selectbox(
         "View Categories",
         "View Suppliers",
         "Add Product",
+        "Bulk Import Products",
         "Retrieve Product by ID",
+        "Search Products",
+        "Product History",
         "Retrieve by Price Range",
         "List All Products",
         "Update Product Price",
         "Update Stock Quantity",
         "Delete Product",
-        "View Shard Counts"
+        "View Shard Counts",
+        "Performance",
+        "Inventory Dashboard"
     ]
 )
 
@@ -44,6 +95,7 @@ if operation == "Add Category":
             if category_id > 0 and category_name:
                 try:
                     success = inventory.add_category(category_id, category_name)
+                    invalidate_product_reads()
                     if success:
                         st.success(f"Category '{category_name}' added successfully with ID: {category_id}")
                 except Exception as e:
@@ -64,6 +116,7 @@ elif operation == "Add Supplier":
             if supplier_id > 0 and supplier_name:
                 try:
                     success = inventory.add_supplier(supplier_id, supplier_name, contact_info)
+                    invalidate_product_reads()
                     if success:
                         st.success(f"Supplier '{supplier_name}' added successfully with ID: {supplier_id}")
                 except Exception as e:
@@ -78,9 +131,8 @@ elif operation == "View Categories":
         try:
             categories = inventory.get_all_categories()
             if categories:
-                df = pd.DataFrame(categories)
                 st.write("**Categories:**")
-                st.dataframe(df)
+                st.dataframe(categories)
             else:
                 st.warning("No categories found.")
         except Exception as e:
@@ -93,9 +145,8 @@ elif operation == "View Suppliers":
         try:
             suppliers = inventory.get_all_suppliers()
             if suppliers:
-                df = pd.DataFrame(suppliers)
                 st.write("**Suppliers:**")
-                st.dataframe(df)
+                st.dataframe(suppliers)
             else:
                 st.warning("No suppliers found.")
         except Exception as e:
@@ -130,12 +181,39 @@ elif operation == "Add Product":
                         product_id = inventory.add_product(
                             name, description, price, stock_quantity, category_id, supplier_id
                         )
+                        invalidate_product_reads()
                         st.success(f"Product added successfully with ID: {product_id}")
                     except Exception as e:
                         st.error(f"Error adding product: {str(e)}")
                 else:
                     st.error("Please fill in all required fields with valid values.")
 
+# Bulk Import Products
+elif operation == "Bulk Import Products":
+    st.header("Bulk Import Products")
+    st.write(f"Upload a CSV file with the columns `{', '.join(PRODUCT_FIELDS)}`, or a JSONL file with one object per line using the same keys.")
+    uploaded_file = st.file_uploader("Product File", type=["csv", "jsonl"])
+    chunk_size = st.number_input("Rows per Insert", min_value=1, value=BULK_CHUNK_SIZE, step=100)
+    commit_every = st.number_input("Commit Every N Chunks", min_value=1, value=1, step=1)
+    if st.button("Import"):
+        if uploaded_file is not None:
+            file_format = "jsonl" if uploaded_file.name.lower().endswith(".jsonl") else "csv"
+            try:
+                with st.spinner("Importing products..."):
+                    try:
+                        added = import_products(
+                            inventory, uploaded_file, file_format,
+                            chunk_size=int(chunk_size), commit_every=int(commit_every)
+                        )
+                    finally:
+                        # A failed import may still have committed earlier chunks
+                        invalidate_product_reads()
+                st.success(f"Imported {added} products.")
+            except Exception as e:
+                st.error(f"Error importing products: {str(e)}")
+        else:
+            st.error("Please upload a CSV or JSONL file.")
+
 # Retrieve Product by ID
 elif operation == "Retrieve Product by ID":
     st.header("Retrieve Product by ID")
@@ -154,6 +232,64 @@ elif operation == "Retrieve Product by ID":
         else:
             st.error("Please enter a valid Product ID.")
 
+# Search Products
+elif operation == "Search Products":
+    st.header("Search Products")
+    query = st.text_input("Search", placeholder="Words from the name or description, e.g. 'cotton shirt'")
+    mode_labels = {"Keywords (name or description)": "keywords", "Name starts with": "name_prefix"}
+    mode_label = st.radio("Match", list(mode_labels.keys()), horizontal=True)
+    try:
+        categories = {c['CategoryName']: c['CategoryID'] for c in inventory.get_all_categories()}
+        suppliers = {s['SupplierName']: s['SupplierID'] for s in inventory.get_all_suppliers()}
+    except Exception as e:
+        st.error(f"Error loading filters: {str(e)}")
+        categories, suppliers = {}, {}
+    col_category, col_supplier, col_page = st.columns(3)
+    category_name = col_category.selectbox("Category", ["Any"] + list(categories.keys()))
+    supplier_name = col_supplier.selectbox("Supplier", ["Any"] + list(suppliers.keys()))
+    page = col_page.number_input("Page", min_value=1, value=1, step=1)
+    if st.button("Search"):
+        try:
+            found = load_search(
+                query, categories.get(category_name), suppliers.get(supplier_name), mode_labels[mode_label], int(page)
+            )
+            if found['results']:
+                st.write(f"**Results (page {found['page']}):**")
+                st.dataframe(found['results'])
+                if found['has_more']:
+                    st.info("More results on the next page.")
+            else:
+                st.info("No products match the search.")
+        except Exception as e:
+            st.error(f"Error searching products: {str(e)}")
+
+# Product History
+elif operation == "Product History":
+    st.header("Product History")
+    product_id = st.text_input("Enter Product ID (UUID)")
+    col_since, col_until = st.columns(2)
+    since = col_since.date_input("From", value=date.today() - timedelta(days=30))
+    until = col_until.date_input("To (inclusive)", value=date.today())
+    if st.button("Show History"):
+        if product_id:
+            try:
+                history = inventory.get_product_history(
+                    product_id, since=datetime.combine(since, time.min),
+                    until=datetime.combine(until + timedelta(days=1), time.min)
+                )
+                if history['events']:
+                    st.write("**Changes:**")
+                    st.dataframe(history['events'])
+                if history['daily']:
+                    st.write("**Daily totals of compacted days:**")
+                    st.dataframe(history['daily'])
+                if not history['events'] and not history['daily']:
+                    st.info("No inventory changes in this period.")
+            except Exception as e:
+                st.error(f"Error retrieving history: {str(e)}")
+        else:
+            st.error("Please enter a valid Product ID.")
+
 # Retrieve by Price Range
 elif operation == "Retrieve by Price Range":
     st.header("Retrieve Products by Price Range")
@@ -162,9 +298,8 @@ elif operation == "Retrieve by Price Range":
     if st.button("Retrieve"):
         if min_price <= max_price:
             try:
-                products = inventory.get_products_by_price_range(min_price, max_price)
-                if products:
-                    df = pd.DataFrame(products)
+                df = load_price_range(min_price, max_price)
+                if not df.empty:
                     st.write("**Products Found:**")
                     st.dataframe(df)
                 else:
@@ -177,17 +312,34 @@ elif operation == "Retrieve by Price Range":
 # List All Products
 elif operation == "List All Products":
     st.header("List All Products")
-    if st.button("Load Products"):
-        try:
-            products = inventory.list_all_products()
-            if products:
-                df = pd.DataFrame(products)
-                st.write("**All Products:**")
-                st.dataframe(df)
-            else:
-                st.warning("No products found across all shards.")
-        except Exception as e:
-            st.error(f"Error listing products: {str(e)}")
+    order_by = st.selectbox("Order By", ["ProductID", "Price"])
+    page_size = st.number_input("Products per Page", min_value=1, max_value=1000, value=50, step=10)
+
+    # Pages are addressed by keyset cursors; keep the stack of cursors for the pages visited so far
+    if st.session_state.get("product_page_order") != (order_by, page_size):
+        st.session_state.product_page_order = (order_by, page_size)
+        st.session_state.product_page_cursors = [None]
+        st.session_state.product_page_next = None
+    cursors = st.session_state.product_page_cursors
+
+    col_prev, col_next = st.columns(2)
+    if col_prev.button("Previous Page") and len(cursors) > 1:
+        cursors.pop()
+    if col_next.button("Next Page") and st.session_state.product_page_next is not None:
+        cursors.append(st.session_state.product_page_next)
+
+    try:
+        products, next_cursor = load_products_page(int(page_size), cursors[-1], order_by)
+        st.session_state.product_page_next = next_cursor
+        if products:
+            st.write(f"**All Products (page {len(cursors)}):**")
+            st.dataframe(products)
+            if next_cursor is None:
+                st.caption("Last page reached.")
+        else:
+            st.warning("No products found across all shards.")
+    except Exception as e:
+        st.error(f"Error listing products: {str(e)}")
 
 # Update Product Price
 elif operation == "Update Product Price":
@@ -201,6 +353,7 @@ elif operation == "Update Product Price":
             if product_id and new_price > 0:
                 try:
                     success = inventory.update_product_price(product_id, new_price)
+                    invalidate_product_reads()
                     if success:
                         st.success("Price updated successfully.")
                     else:
@@ -222,6 +375,7 @@ elif operation == "Update Stock Quantity":
             if product_id:
                 try:
                     success = inventory.update_stock_quantity(product_id, quantity_change)
+                    invalidate_product_reads()
                     if success:
                         st.success("Stock quantity updated successfully.")
                     else:
@@ -239,6 +393,7 @@ elif operation == "Delete Product":
         if product_id:
             try:
                 success = inventory.delete_product(product_id)
+                invalidate_product_reads()
                 if success:
                     st.success("Product deleted successfully.")
                 else:
@@ -253,9 +408,82 @@ elif operation == "View Shard Counts":
     st.header("Shard Product Counts")
     if st.button("Load Shard Counts"):
         try:
-            counts = inventory.get_shard_counts()
+            import pandas as pd  # Loaded only by the pages that build DataFrames themselves
+            counts, shard_stats = load_shard_stats()
             df = pd.DataFrame.from_dict(counts, orient='index', columns=['Product Count'])
             st.write("**Products per Shard:**")
             st.dataframe(df)
+            stats = {shard: values for shard, values in shard_stats.items() if values is not None}
+            if stats:
+                st.write("**Shard Statistics:**")
+                st.dataframe(pd.DataFrame.from_dict(stats, orient='index'))
+        except Exception as e:
+            st.error(f"Error retrieving shard counts: {str(e)}")
+    if st.button("Reconcile Statistics"):
+        try:
+            drift = inventory.reconcile_shard_stats()
+            invalidate_product_reads()
+            st.success("Shard statistics recomputed from the Products tables.")
+            st.write("**Drift Corrected:**")
+            st.dataframe([{'Shard': shard, **corrected} for shard, corrected in drift.items()])
+        except Exception as e:
+            st.error(f"Error reconciling shard statistics: {str(e)}")
+
+# Performance
+elif operation == "Performance":
+    st.header("Query Performance")
+    st.write("Latency, rows and errors of every database query since the process started, per method and shard.")
+    slow_query_ms = st.number_input(
+        "Slow Query Threshold (ms)", min_value=1.0, value=float(inventory.instrumentation.slow_query_ms), step=10.0
+    )
+    inventory.instrumentation.slow_query_ms = slow_query_ms
+    col_refresh, col_reset = st.columns(2)
+    col_refresh.button("Refresh")
+    if col_reset.button("Reset Metrics"):
+        inventory.instrumentation.reset()
+
+    metrics = inventory.get_query_metrics()
+    if metrics:
+        import pandas as pd  # Loaded only by the pages that build DataFrames themselves
+        df = pd.DataFrame(metrics)
+        st.write("**Time per Shard (ms):**")
+        st.bar_chart(df.groupby('Shard')['TotalMs'].sum())
+        st.write("**Time per Method (ms):**")
+        st.bar_chart(df.groupby('Method')['TotalMs'].sum())
+        st.write("**Queries by Method and Shard:**")
+        st.dataframe(df.sort_values('TotalMs', ascending=False))
+    else:
+        st.info("No queries recorded yet.")
+
+    slow_queries = inventory.get_slow_queries()
+    st.write(f"**Slow Queries (>= {slow_query_ms:g} ms):**")
+    if slow_queries:
+        st.dataframe(slow_queries)
+    else:
+        st.info("No slow queries recorded.")
+
+# Inventory Dashboard
+elif operation == "Inventory Dashboard":
+    st.header("Inventory Dashboard")
+    group_labels = {"Category": "category", "Supplier": "supplier", "Shard": "shard"}
+    group_label = st.selectbox("Group By", list(group_labels.keys()))
+    low_stock_threshold = st.number_input("Low Stock Threshold (units)", min_value=0, value=LOW_STOCK_THRESHOLD, step=1)
+    if st.button("Load Dashboard"):
+        try:
+            # Aggregates are computed on the shards; only one row per group is transferred
+            df = load_dashboard(group_labels[group_label], int(low_stock_threshold))
+            if not df.empty:
+                col_products, col_units, col_value, col_low = st.columns(4)
+                col_products.metric("Products", int(df['ProductCount'].sum()))
+                col_units.metric("Units in Stock", int(df['TotalUnits'].sum()))
+                col_value.metric("Stock Value", f"{df['StockValue'].sum():,.2f}")
+                col_low.metric("Low Stock Products", int(df['LowStockCount'].sum()))
+                st.write(f"**Inventory by {group_label}:**")
+                st.dataframe(df)
+                label_column = 'Name' if 'Name' in df else 'Shard'
+                chart = df.assign(Group=df[label_column].fillna('(none)').astype(str))
+                st.bar_chart(chart.set_index('Group')['StockValue'])
+            else:
+                st.warning("No products found across all shards.")
         except Exception as e:
-            st.error(f"Error retrieving shard counts: {str(e)}")
\ No newline at end of file
+            st.error(f"Error loading dashboard: {str(e)}")
\ No newline at end of file
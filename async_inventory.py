@@ -0,0 +1,216 @@
+import asyncio
+import contextvars
+import functools
+import inspect
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+from instrumentation import operation
+from main import InventorySystem, DB_CONFIG, PRODUCT_SHARDS, PRODUCT_COLUMNS, POOL_SIZE, SCATTER_TIMEOUT
+
+# Seconds an AsyncInventorySystem call may run before it is cancelled (None: no limit)
+ASYNC_OPERATION_TIMEOUT = 30.0
+
+# InventorySystem methods without a coroutine counterpart: in-memory routing helpers,
+# a blocking generator and a feed object that manages its own reads
+NOT_DELEGATED = {'get_shard_for_price', 'shard_for_product', 'iter_products', 'change_feed', 'close'}
+
+_shard_errors = contextvars.ContextVar('async_shard_errors', default=None)
+
+
+class AsyncInventorySystem:
+    """Coroutine front end to an InventorySystem for asyncio services.
+
+    The database drivers block, so queries still run on threads, but only on
+    as many as there are pooled connections. Each database has an
+    asyncio.Semaphore with one slot per connection, and requests beyond that
+    wait as suspended coroutines rather than parked threads, so thousands of
+    requests in flight cost little memory each. Point lookups, price-range
+    reads, full listings and shard counts fan out per shard with
+    asyncio.gather; every other public InventorySystem method is available
+    as a coroutine of the same name that runs the blocking method on the
+    worker pool.
+
+    Every call takes a timeout keyword (default ASYNC_OPERATION_TIMEOUT). On
+    timeout or cancellation the caller is released at once; a query that is
+    already running finishes on its thread before its slot goes to the next
+    waiter, so the connection pools are never oversubscribed.
+    """
+
+    def __init__(self, inventory: Optional[InventorySystem] = None, pool_size: int = POOL_SIZE,
+                 timeout: Optional[float] = ASYNC_OPERATION_TIMEOUT, **options):
+        self.inventory = inventory or InventorySystem(pool_size=pool_size, **options)
+        self._owns_inventory = inventory is None
+        self.timeout = timeout
+        self._slots = {shard: asyncio.Semaphore(pool.size) for shard, pool in self.inventory.pools.items()}
+        # Blocking operations may each hold a connection on several databases at once
+        self._operation_slots = asyncio.Semaphore(pool_size)
+        self._executor = ThreadPoolExecutor(max_workers=pool_size * (len(DB_CONFIG) + 1),
+                                            thread_name_prefix='async-inventory')
+
+    @property
+    def last_shard_errors(self) -> Dict[str, str]:
+        """Shards that failed or timed out during this task's most recent partial read."""
+        return _shard_errors.get() or {}
+
+    @staticmethod
+    def _attributed(name: str, call: Callable, *args, **kwargs):
+        with operation(name):
+            return call(*args, **kwargs)
+
+    async def _submit(self, slots: Optional[asyncio.Semaphore], name: str, call: Callable, *args, **kwargs):
+        """Run a blocking call on the worker pool, holding a slot of slots until the thread is done with it."""
+        return await (await self._start(slots, name, call, *args, **kwargs))
+
+    async def _start(self, slots: Optional[asyncio.Semaphore], name: str, call: Callable, *args,
+                     **kwargs) -> asyncio.Future:
+        """Wait for a slot of slots, then start a blocking call on the worker pool and return its future."""
+        loop = asyncio.get_running_loop()
+        if slots is not None:
+            await slots.acquire()
+        try:
+            future = self._executor.submit(contextvars.copy_context().run, self._attributed, name, call, *args, **kwargs)
+        except BaseException:
+            if slots is not None:
+                slots.release()
+            raise
+        if slots is not None:
+            # Released when the thread finishes (or the queued call is cancelled), not when the caller gives up
+            future.add_done_callback(lambda _: loop.call_soon_threadsafe(slots.release))
+        return asyncio.wrap_future(future)
+
+    async def _with_timeout(self, awaitable, timeout: Optional[float]):
+        return await asyncio.wait_for(awaitable, self.timeout if timeout is None else timeout)
+
+    async def _on_shard(self, name: str, shard: str, query: Callable, *args, timeout: Optional[float] = None):
+        """Run query(conn, shard, *args) with a pooled connection once one of the shard's slots is free.
+
+        timeout counts from when the slot is acquired, not while the query waits
+        for one, and the server is asked to abort its statements at the same limit.
+        """
+        def run():
+            with self.inventory.pools[shard].connection(statement_timeout=timeout) as conn:
+                return query(conn, shard, *args)
+        future = await self._start(self._slots[shard], name, run)
+        return await (future if timeout is None else asyncio.wait_for(future, timeout))
+
+    async def _gather(self, name: str, shards: List[str], query: Callable, args: Optional[Dict[str, tuple]] = None,
+                      partial: bool = False) -> Dict[str, Any]:
+        """Query several shards concurrently; like ScatterGatherExecutor.run, each shard gets SCATTER_TIMEOUT."""
+        args = args or {}
+
+        async def on_shard(shard: str):
+            return await self._on_shard(name, shard, query, *args.get(shard, ()), timeout=SCATTER_TIMEOUT)
+
+        # Cancelling the gather (timeout or caller cancellation) cancels every shard still waiting
+        outcomes = await asyncio.gather(*(on_shard(shard) for shard in shards), return_exceptions=True)
+        results, errors = {}, {}
+        for shard, outcome in zip(shards, outcomes):
+            if isinstance(outcome, asyncio.TimeoutError):
+                errors[shard] = f"timed out after {SCATTER_TIMEOUT}s"
+            elif isinstance(outcome, BaseException):
+                errors[shard] = str(outcome)
+            else:
+                results[shard] = outcome
+        if errors and not partial:
+            shard, message = next(iter(errors.items()))
+            raise Exception(f"Query failed on shard {shard}: {message}")
+        holder = _shard_errors.get()
+        if holder is not None:
+            holder.clear()
+            holder.update(errors)
+        return results
+
+    async def _read(self, coroutine, timeout: Optional[float]):
+        # The errors dict is shared with the timeout task's copied context, so the caller sees what it records
+        _shard_errors.set({})
+        return await self._with_timeout(coroutine, timeout)
+
+    async def get_product_by_id(self, product_id: str, timeout: Optional[float] = None) -> Optional[Dict]:
+        """Retrieve a product by its globally unique ID."""
+        return await self._with_timeout(self._get_product_by_id(product_id), timeout)
+
+    async def _get_product_by_id(self, product_id: str) -> Optional[Dict]:
+        # The same steps as InventorySystem._find_product, each on one connection slot
+        inventory = self.inventory
+        shard = inventory.directory_cache.get(product_id)
+        if shard is None:
+            shard = await self._on_shard('get_product_by_id', 'central', inventory._select_directory_shard, product_id)
+            if shard is not None:
+                inventory.directory_cache.put(product_id, shard)
+        if shard is not None:
+            product = await self._on_shard('get_product_by_id', shard, inventory._select_product, product_id)
+            if product:
+                return product
+            inventory.directory_cache.invalidate(product_id)
+
+        # Directory miss or stale entry: probe the remaining shards and repair the entry
+        shards = [other for other in PRODUCT_SHARDS if other != shard]
+        results = await self._gather('get_product_by_id', shards, inventory._select_product,
+                                     {other: (product_id,) for other in shards})
+        found = next((other for other in shards if results.get(other)), None)
+        if found != shard:
+            await self._submit(self._slots['central'], 'get_product_by_id', inventory._record_product_shard,
+                               product_id, found)
+        return results[found] if found is not None else None
+
+    async def get_products_by_price_range(self, min_price: float, max_price: float, partial: bool = False,
+                                          result_format: str = 'rows', timeout: Optional[float] = None):
+        """Retrieve products within a specified price range (see InventorySystem.get_products_by_price_range)."""
+        return await self._read(self._get_products_by_price_range(min_price, max_price, partial, result_format), timeout)
+
+    async def _get_products_by_price_range(self, min_price: float, max_price: float, partial: bool, result_format: str):
+        # Reads the shard map and ShardStats price bounds to prune shards
+        bounds = await self._submit(None, 'get_products_by_price_range', self.inventory._shards_for_price_range,
+                                    min_price, max_price)
+        args = {shard: ("p.Price >= %s AND p.Price < %s", shard_bounds) for shard, shard_bounds in bounds.items()}
+        return await self._products(list(args), args, partial, result_format, 'get_products_by_price_range')
+
+    async def list_all_products(self, partial: bool = False, result_format: str = 'rows',
+                                timeout: Optional[float] = None):
+        """Retrieve all products from all shards, as dicts or columnar (see get_products_by_price_range)."""
+        return await self._read(self._products(PRODUCT_SHARDS, None, partial, result_format, 'list_all_products'), timeout)
+
+    async def _products(self, shards: List[str], args: Optional[Dict[str, tuple]], partial: bool,
+                        result_format: str, name: str):
+        if result_format == 'rows':
+            results = await self._gather(name, shards, self.inventory._select_products, args, partial)
+            return [row for shard in shards if shard in results for row in results[shard]]
+        self.inventory._check_result_format(result_format)
+        from columnar import concat_columns, format_columns
+        results = await self._gather(name, shards, self.inventory._select_product_columns, args, partial)
+        parts = [results[shard] for shard in shards if shard in results]
+        names = list(parts[0]) if parts else PRODUCT_COLUMNS + ['CategoryName', 'SupplierName']
+        return format_columns(concat_columns(parts, names), result_format)
+
+    async def get_shard_counts(self, partial: bool = False, timeout: Optional[float] = None) -> Dict[str, int]:
+        """Get the total number of products in each shard (from ShardStats, without scanning Products)."""
+        results = await self._read(self._gather('get_shard_counts', PRODUCT_SHARDS, self.inventory._count_products,
+                                                partial=partial), timeout)
+        return {shard: results[shard] for shard in PRODUCT_SHARDS if shard in results}
+
+    async def close(self):
+        """Wait for running queries, then close the InventorySystem if this front end created it."""
+        await asyncio.get_running_loop().run_in_executor(None, functools.partial(self._executor.shutdown, wait=True))
+        if self._owns_inventory:
+            self.inventory.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+
+def _delegated(name: str, method: Callable) -> Callable:
+    @functools.wraps(method)
+    async def coroutine(self, *args, timeout: Optional[float] = None, **kwargs):
+        call = getattr(self.inventory, name)
+        return await self._with_timeout(self._submit(self._operation_slots, name, call, *args, **kwargs), timeout)
+    return coroutine
+
+
+# Coroutine versions of the remaining public methods (add_product, update_stock_quantity, ...)
+for _name, _method in list(vars(InventorySystem).items()):
+    if (inspect.isfunction(_method) and not _name.startswith('_') and _name not in NOT_DELEGATED
+            and _name not in vars(AsyncInventorySystem)):
+        setattr(AsyncInventorySystem, _name, _delegated(_name, _method))
\ No newline at end of file
@@ -0,0 +1,750 @@
+import contextlib
+import functools
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Schema the SQLite backend derives its tables from
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'database.sql')
+
+# Applied to every SQLite connection: WAL lets readers run alongside the single writer,
+# NORMAL sync is durable across application crashes, and the page cache (in KiB when
+# negative) and memory map keep hot pages out of the file system
+SQLITE_PRAGMAS = [
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA cache_size = -65536",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA temp_store = MEMORY"
+]
+
+# Seconds a SQLite connection waits for another writer before failing
+SQLITE_BUSY_TIMEOUT = 5.0
+
+# Statements that write; on SQLite they first take their file's process-wide write lock
+SQLITE_WRITE_STATEMENT = re.compile(r"\s*(INSERT|UPDATE|DELETE|REPLACE)\b", re.I)
+
+# Compiled statements kept per SQLite connection, so repeated queries skip parsing
+SQLITE_STATEMENT_CACHE = 512
+
+# Virtual machine instructions between checks of a SQLite connection's statement time limit
+SQLITE_PROGRESS_STEPS = 10000
+
+sqlite3.register_adapter(Decimal, float)
+# Same text format as NOW(), so timestamps compare correctly as strings
+sqlite3.register_adapter(datetime, lambda value: value.strftime('%Y-%m-%d %H:%M:%S'))
+sqlite3.register_adapter(date, lambda value: value.isoformat())
+sqlite3.register_converter('DATETIME', lambda value: datetime.fromisoformat(value.decode()))
+sqlite3.register_converter('DATE', lambda value: date.fromisoformat(value.decode()))
+
+
+class StorageBackend:
+    """Opens database connections for the shards in DB_CONFIG and covers the few engine-specific operations."""
+
+    name = None
+
+    def connect(self, shard: str):
+        raise NotImplementedError
+
+    def database_name(self, shard: str) -> str:
+        """Name under which another shard's connection can qualify this shard's tables."""
+        raise NotImplementedError
+
+    def shares_instance(self, shards: List[str]) -> bool:
+        """Whether one connection can read and write the tables of all the given shards."""
+        raise NotImplementedError
+
+    def drop_check_constraints(self, conn, table: str, prefix: str) -> List[str]:
+        """Drop the CHECK constraints of table whose names start with prefix, returning their names."""
+        raise NotImplementedError
+
+    def cross_shard_write(self, conn=None):
+        """Context manager held around a transaction that writes to more than one product shard.
+
+        conn is given when one connection makes all the writes (set-based reprices).
+        """
+        return contextlib.nullcontext()
+
+    def set_statement_timeout(self, conn, seconds: Optional[float]):
+        """Have conn's statements aborted once they run longer than seconds (None: no limit)."""
+        raise NotImplementedError
+
+    def fulltext_match(self, alias: str, index: str, columns: List[str], terms: List[str]) -> Tuple[str, str, str, tuple]:
+        """SQL matching rows whose indexed columns have a word starting with every term.
+
+        Returns (join, relevance expression, condition, params): join is added
+        after the FROM clause, and params belong to the relevance expression
+        and then the condition, in that order.
+        """
+        raise NotImplementedError
+
+    def migrate(self, schema_path: str = SCHEMA_PATH) -> List[str]:
+        """Bring existing databases up to database.sql (missing tables, indexes and partitioning); returns what was changed."""
+        raise NotImplementedError
+
+    def begin_snapshot(self, conn):
+        """Start a read-only transaction on conn whose reads all see one point-in-time state of its database."""
+        raise NotImplementedError
+
+    def rotate_partitions(self, conn, table: str, before: datetime, months_ahead: int) -> List[str]:
+        """Drop the empty time partitions of table that end before before and add monthly ones months_ahead.
+
+        Returns what was changed. Engines without table partitioning have nothing to rotate.
+        """
+        return []
+
+
+class MySQLBackend(StorageBackend):
+    """One MySQL/MariaDB database per shard, as laid out in database.sql."""
+
+    name = 'mysql'
+
+    def __init__(self, db_config: Dict[str, Dict]):
+        self.db_config = db_config
+
+    def connect(self, shard: str):
+        # Imported here so embedded deployments do not need mysql-connector installed
+        import mysql.connector
+        from mysql.connector.constants import ClientFlag
+        # FOUND_ROWS makes UPDATE rowcounts report matched rather than changed rows
+        return mysql.connector.connect(client_flags=[ClientFlag.FOUND_ROWS], **self.db_config[shard])
+
+    def database_name(self, shard: str) -> str:
+        return self.db_config[shard]['database']
+
+    def shares_instance(self, shards: List[str]) -> bool:
+        return len({(self.db_config[shard]['host'], self.db_config[shard]['port']) for shard in shards}) == 1
+
+    def drop_check_constraints(self, conn, table: str, prefix: str) -> List[str]:
+        with conn.cursor() as cur:
+            cur.execute(
+                """SELECT CONSTRAINT_NAME FROM information_schema.TABLE_CONSTRAINTS
+                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND CONSTRAINT_TYPE = 'CHECK'""",
+                (table,)
+            )
+            names = [name for (name,) in cur.fetchall() if name.startswith(prefix)]
+            for name in names:
+                cur.execute(f"ALTER TABLE {table} DROP CONSTRAINT {name}")
+        return names
+
+    def begin_snapshot(self, conn):
+        with conn.cursor() as cur:
+            cur.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT, READ ONLY")
+
+    def set_statement_timeout(self, conn, seconds: Optional[float]):
+        with conn.cursor() as cur:
+            if 'MariaDB' in conn.get_server_info():
+                # MariaDB limits every statement, in seconds
+                cur.execute("SET SESSION max_statement_time = %s", (seconds or 0,))
+            else:
+                # MySQL limits read-only SELECTs, in milliseconds
+                cur.execute("SET SESSION MAX_EXECUTION_TIME = %s", (int((seconds or 0) * 1000),))
+
+    def fulltext_match(self, alias: str, index: str, columns: List[str], terms: List[str]) -> Tuple[str, str, str, tuple]:
+        match = f"MATCH ({', '.join(f'{alias}.{column}' for column in columns)}) AGAINST (%s IN BOOLEAN MODE)"
+        # +term* requires a word starting with the term; terms shorter than innodb_ft_min_token_size never match
+        query = " ".join(f"+{term}*" for term in terms)
+        return "", match, match, (query, query)
+
+    def migrate(self, schema_path: str = SCHEMA_PATH) -> List[str]:
+        shards = {config['database']: shard for shard, config in self.db_config.items()}
+        with open(schema_path, 'r', encoding='utf-8') as f:
+            script = f.read()
+        changes, conns = [], {}
+        try:
+            for database, statement in schema_statements(script):
+                if database not in shards or not statement.upper().startswith('CREATE TABLE'):
+                    continue
+                if database not in conns:
+                    conns[database] = self.connect(shards[database])
+                definition, partitioning = _split_partitioning(statement)
+                table, body = re.match(r"CREATE\s+TABLE\s+IF\s+NOT\s+EXISTS\s+(\w+)\s*\((.*)\)", definition, re.S | re.I).groups()
+                with conns[database].cursor() as cur:
+                    cur.execute(
+                        "SELECT COUNT(*) FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+                        (table,)
+                    )
+                    if not cur.fetchone()[0]:
+                        cur.execute(statement)
+                        changes.append(f"{database}: created table {table}")
+                        continue
+                    for item in _split_top_level(body):
+                        index = re.match(r"(?:(?:FULLTEXT|UNIQUE)\s+)?(?:INDEX|KEY)\s+(\w+)", item, re.I)
+                        if not index:
+                            continue
+                        cur.execute(
+                            """SELECT COUNT(*) FROM information_schema.STATISTICS
+                            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s""",
+                            (table, index.group(1))
+                        )
+                        if not cur.fetchone()[0]:
+                            # Built online by InnoDB; large tables take a while but stay readable and writable
+                            cur.execute(f"ALTER TABLE {table} ADD {item}")
+                            changes.append(f"{database}: added index {index.group(1)} on {table}")
+                    if partitioning and not self._partitions(cur, table):
+                        changes.append(f"{database}: {self._partition_table(cur, table, body, partitioning)}")
+        finally:
+            for conn in conns.values():
+                conn.close()
+        return changes
+
+    @staticmethod
+    def _partitions(cur, table: str) -> List[Tuple[str, Optional[datetime]]]:
+        """(name, upper bound) of each partition of a RANGE COLUMNS table, in order; None bounds MAXVALUE."""
+        cur.execute(
+            """SELECT PARTITION_NAME, PARTITION_DESCRIPTION FROM information_schema.PARTITIONS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL
+            ORDER BY PARTITION_ORDINAL_POSITION""",
+            (table,)
+        )
+        return [
+            (name, None if bound == 'MAXVALUE' else datetime.fromisoformat(bound.strip("'")))
+            for name, bound in cur.fetchall()
+        ]
+
+    @staticmethod
+    def _partition_table(cur, table: str, body: str, partitioning: str) -> str:
+        # The partitioning column must be part of the primary key, so the key and its
+        # columns take their database.sql definitions in the same (copying) rebuild
+        items = _split_top_level(body)
+        primary = next(item for item in items if re.match(r"PRIMARY\s+KEY", item, re.I))
+        key_columns = [column.strip() for column in re.search(r"\((.*)\)", primary).group(1).split(',')]
+        alterations = [f"MODIFY {item}" for item in items if item.split(None, 1)[0] in key_columns]
+        alterations += ["DROP PRIMARY KEY", f"ADD {primary}"]
+        cur.execute(f"ALTER TABLE {table} {', '.join(alterations)} {partitioning}")
+        return f"partitioned {table}"
+
+    def rotate_partitions(self, conn, table: str, before: datetime, months_ahead: int) -> List[str]:
+        changes = []
+        with conn.cursor() as cur:
+            partitions = self._partitions(cur, table)
+            if not partitions:
+                return changes  # Not partitioned yet: see migrate.py
+            # Every row of a partition lies below its bound; the open-ended last partition always stays
+            expired = []
+            for name, bound in partitions[:-1]:
+                if bound <= before:
+                    cur.execute(f"SELECT 1 FROM {table} PARTITION ({name}) LIMIT 1")
+                    if cur.fetchone() is None:
+                        expired.append(name)
+            if expired:
+                cur.execute(f"ALTER TABLE {table} DROP PARTITION {', '.join(expired)}")
+                changes.append(f"dropped partitions {', '.join(expired)} of {table}")
+            last_name, last_bound = partitions[-1]
+            highest = max((bound for _, bound in partitions if bound is not None), default=None)
+            this_month = _add_months(datetime.now(), 0)
+            added = []
+            for offset in range(months_ahead + 1):
+                start, end = _add_months(this_month, offset), _add_months(this_month, offset + 1)
+                if highest is None or end > highest:
+                    added.append(f"PARTITION p{start:%Y%m} VALUES LESS THAN ('{end:%Y-%m-%d}')")
+            if added:
+                if last_bound is None:
+                    # Splitting the catch-all partition only copies its rows, which are few while months are added ahead
+                    added.append(f"PARTITION {last_name} VALUES LESS THAN (MAXVALUE)")
+                    cur.execute(f"ALTER TABLE {table} REORGANIZE PARTITION {last_name} INTO ({', '.join(added)})")
+                else:
+                    cur.execute(f"ALTER TABLE {table} ADD PARTITION ({', '.join(added)})")
+                changes.append(f"added {len(added) - (last_bound is None)} monthly partitions to {table}")
+        return changes
+
+
+def _add_months(moment: datetime, months: int) -> datetime:
+    """Start of the month months after the one moment falls in."""
+    index = moment.year * 12 + moment.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def _split_partitioning(statement: str) -> Tuple[str, Optional[str]]:
+    """Separate the PARTITION BY clause, if any, from the end of a CREATE TABLE statement."""
+    match = re.search(r"\)\s*(PARTITION\s+BY\b.*)$", statement, re.S | re.I)
+    if not match:
+        return statement, None
+    return statement[:match.start() + 1], match.group(1)
+
+
+def _split_top_level(body: str) -> List[str]:
+    """Split a column list on the commas that are not inside parentheses."""
+    items, depth, start = [], 0, 0
+    for i, char in enumerate(body):
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            items.append(body[start:i].strip())
+            start = i + 1
+    items.append(body[start:].strip())
+    return [item for item in items if item]
+
+
+def _sqlite_column(definition: str) -> str:
+    definition = re.sub(r"\bINT\s+AUTO_INCREMENT\s+PRIMARY\s+KEY\b", "INTEGER PRIMARY KEY AUTOINCREMENT", definition, flags=re.I)
+    # SQLite only auto-increments a rowid primary key, which replaces a composite one (see _sqlite_create_table)
+    definition = re.sub(r"\b(?:BIG)?INT\s+AUTO_INCREMENT\b(?!\s+PRIMARY)", "INTEGER PRIMARY KEY AUTOINCREMENT", definition, flags=re.I)
+    definition = re.sub(r"\s+ON\s+UPDATE\s+(NOW\(\)|CURRENT_TIMESTAMP)", "", definition, flags=re.I)
+    definition = re.sub(r"DEFAULT\s+(NOW\(\)|CURRENT_TIMESTAMP)", "DEFAULT (datetime('now', 'localtime'))", definition, flags=re.I)
+    definition = re.sub(r"\bENUM\s*\([^)]*\)", "TEXT", definition, flags=re.I)
+    return re.sub(r"\s+UNSIGNED\b", "", definition, flags=re.I)
+
+
+def _sqlite_fulltext(table: str, item: str) -> List[str]:
+    """An FTS5 index over a table's columns, kept in step with the table by triggers."""
+    name, columns = re.match(r"FULLTEXT\s+(?:INDEX|KEY)\s+(\w+)\s*\((.*)\)", item, re.S | re.I).groups()
+    columns = [column.strip() for column in columns.split(',')]
+    names = ", ".join(columns)
+    new = ", ".join(f"new.{column}" for column in columns)
+    old = ", ".join(f"old.{column}" for column in columns)
+    delete = f"INSERT INTO {name} ({name}, rowid, {names}) VALUES ('delete', old.rowid, {old});"
+    insert = f"INSERT INTO {name} (rowid, {names}) VALUES (new.rowid, {new});"
+    return [
+        # External content: the index stores only tokens; prefix= speeds up short prefix queries
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {name} USING fts5({names}, content='{table}', content_rowid='rowid', prefix='2 3')",
+        f"CREATE TRIGGER IF NOT EXISTS {name}_insert AFTER INSERT ON {table} BEGIN {insert} END",
+        f"CREATE TRIGGER IF NOT EXISTS {name}_delete AFTER DELETE ON {table} BEGIN {delete} END",
+        f"CREATE TRIGGER IF NOT EXISTS {name}_update AFTER UPDATE OF {names} ON {table} BEGIN {delete} {insert} END"
+    ]
+
+
+def _sqlite_create_table(statement: str) -> List[str]:
+    """Rewrite a MySQL CREATE TABLE for SQLite: table constraints last, inline indexes as CREATE INDEX.
+
+    Partitioning is dropped; SQLite tables rely on their indexes instead.
+    """
+    match = re.match(r"CREATE\s+TABLE\s+IF\s+NOT\s+EXISTS\s+(\w+)\s*\((.*)\)", _split_partitioning(statement)[0], re.S | re.I)
+    table, body = match.group(1), match.group(2)
+    columns, constraints, indexes = [], [], []
+    items = _split_top_level(body)
+    auto_increment = any(re.search(r"\bAUTO_INCREMENT\b", item, re.I) for item in items)
+    for item in items:
+        keyword = item.split(None, 1)[0].upper()
+        if keyword == 'PRIMARY' and auto_increment:
+            continue  # The AUTO_INCREMENT column becomes the primary key
+        if keyword in ('CONSTRAINT', 'FOREIGN', 'PRIMARY', 'UNIQUE', 'CHECK'):
+            constraints.append(item)
+        elif keyword in ('INDEX', 'KEY'):
+            name, index_columns = re.match(r"\w+\s+(\w+)\s*(\(.*\))", item, re.S).groups()
+            indexes.append(f"CREATE INDEX IF NOT EXISTS {name} ON {table} {index_columns}")
+        elif keyword == 'FULLTEXT':
+            indexes.extend(_sqlite_fulltext(table, item))
+        elif keyword == 'SPATIAL':
+            continue  # No SQLite equivalent; the query paths do not depend on them
+        else:
+            columns.append(_sqlite_column(item))
+    definitions = ",\n    ".join(columns + constraints)
+    return [f"CREATE TABLE IF NOT EXISTS {table} (\n    {definitions}\n)"] + indexes
+
+
+def schema_statements(script: str) -> Iterator[Tuple[Optional[str], str]]:
+    """Yield (current database, statement) for each statement of database.sql, without comments."""
+    database = None
+    for statement in script.split(';'):
+        statement = "\n".join(line for line in statement.splitlines() if not line.strip().startswith('--')).strip()
+        if statement.upper().startswith('USE '):
+            database = statement.split()[1]
+        elif statement:
+            yield database, statement
+
+
+def sqlite_schema(script: str) -> Dict[str, List[str]]:
+    """Translate database.sql into SQLite DDL and seed statements per database name.
+
+    Statements without an equivalent are skipped.
+    """
+    schema = {}
+    for database, statement in schema_statements(script):
+        upper = statement.upper()
+        if database:
+            schema.setdefault(database, [])
+        if upper.startswith('CREATE TABLE') and database:
+            schema[database].extend(_sqlite_create_table(statement))
+        elif upper.startswith('CREATE INDEX') and database:
+            schema[database].append(re.sub(r"CREATE\s+INDEX", "CREATE INDEX IF NOT EXISTS", statement, count=1, flags=re.I))
+        elif upper.startswith('INSERT') and database:
+            # Seeds are written to be repeatable (e.g. only into an empty table), like CREATE ... IF NOT EXISTS
+            schema[database].append(_sqlite_statement(statement)[0])
+    return schema
+
+
+@functools.lru_cache(maxsize=1024)
+def _sqlite_statement(statement: str):
+    """Translate one statement of the MySQL dialect used by main.py; returns (sql, table to write-lock or None)."""
+    sql = statement
+    locking = None
+    if re.search(r"\s+FOR\s+UPDATE\s*$", sql, re.I):
+        sql = re.sub(r"\s+FOR\s+UPDATE\s*$", "", sql, flags=re.I)
+        locking = re.search(r"\bFROM\s+(\w+)", sql, re.I).group(1)
+
+    match = re.match(r"\s*UPDATE\s+(\w+)\s+(\w+)\s+JOIN\s+(\w+)\s+(\w+)\s+ON\s+(.+?)\s+SET\s+(.+?)\s+WHERE\s+(.+)$", sql, re.S | re.I)
+    if match:
+        table, alias, other, other_alias, on, assignments, where = match.groups()
+        assignments = re.sub(rf"\b{alias}\.(\w+)\s*=", r"\1 =", assignments)
+        sql = f"UPDATE {table} AS {alias} SET {assignments} FROM {other} AS {other_alias} WHERE ({on}) AND ({where})"
+    match = re.match(r"\s*DELETE\s+(\w+)\s+FROM\s+(\w+)\s+\1\s+JOIN\s+(\w+)\s+(\w+)\s+ON\s+(.+?)\s+WHERE\s+(.+)$", sql, re.S | re.I)
+    if match:
+        alias, table, other, other_alias, on, where = match.groups()
+        sql = f"DELETE FROM {table} AS {alias} WHERE EXISTS (SELECT 1 FROM {other} AS {other_alias} WHERE ({on}) AND ({where}))"
+
+    # ISNULL is an operator keyword in SQLite, so MySQL's function is registered under another name
+    sql = re.sub(r"\bISNULL\(", "MYSQL_ISNULL(", sql, flags=re.I)
+    # SQLite's multi-argument MIN/MAX are scalar and, like LEAST/GREATEST, return NULL for any NULL argument
+    sql = re.sub(r"\bLEAST\(", "MIN(", sql, flags=re.I)
+    sql = re.sub(r"\bGREATEST\(", "MAX(", sql, flags=re.I)
+
+    parts = re.split(r"\s+ON\s+DUPLICATE\s+KEY\s+UPDATE\s+", sql, maxsplit=1, flags=re.I)
+    if len(parts) == 2:
+        sql = parts[0] + " ON CONFLICT DO UPDATE SET " + re.sub(r"\bVALUES\((\w+)\)", r"excluded.\1", parts[1])
+    return sql.replace('%s', '?'), locking
+
+
+def _sqlite_now() -> str:
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+class _BitXor:
+    def __init__(self):
+        self.value = None
+
+    def step(self, value):
+        if value is not None:
+            self.value = (self.value or 0) ^ int(value)
+
+    def finalize(self):
+        return self.value
+
+
+class SQLiteCursor:
+    """mysql.connector-style cursor (dictionary rows, context manager) over a sqlite3 cursor."""
+
+    def __init__(self, connection: 'SQLiteConnection', dictionary: bool = False):
+        self._connection = connection
+        self._cursor = connection.raw.cursor()
+        self._dictionary = dictionary
+
+    @property
+    def rowcount(self) -> int:
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def column_names(self) -> tuple:
+        return tuple(column[0] for column in self._cursor.description or ())
+
+    def execute(self, statement: str, params=None):
+        xa = re.match(r"\s*XA\s+(\w+)", statement, re.I)
+        if xa:
+            # One file per shard: a prepared branch is just the open local transaction
+            action = xa.group(1).upper()
+            if action == 'COMMIT':
+                self._connection.commit()
+            elif action == 'ROLLBACK':
+                self._connection.rollback()
+            return
+        sql, locking = _sqlite_statement(statement)
+        self._connection.statement_started = time.monotonic()
+        if locking and not self._connection.raw.in_transaction:
+            # SELECT ... FOR UPDATE: take the write lock up front so the rows cannot change before the update.
+            # A no-op write locks only this shard's file; BEGIN IMMEDIATE would also lock every attached shard.
+            self._connection.begin()
+            self._cursor.execute(f"UPDATE main.{locking} SET rowid = rowid WHERE 0")
+        elif SQLITE_WRITE_STATEMENT.match(sql) and not self._connection.raw.in_transaction:
+            self._connection.begin()
+        self._cursor.execute(sql, params or ())
+
+    def executemany(self, statement: str, seq_params):
+        sql = _sqlite_statement(statement)[0]
+        self._connection.statement_started = time.monotonic()
+        if SQLITE_WRITE_STATEMENT.match(sql) and not self._connection.raw.in_transaction:
+            self._connection.begin()
+        self._cursor.executemany(sql, seq_params)
+
+    def _rows(self, rows: List[tuple]) -> List:
+        if not self._dictionary:
+            return rows
+        names = self.column_names
+        return [dict(zip(names, row)) for row in rows]
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        return row if row is None or not self._dictionary else dict(zip(self.column_names, row))
+
+    def fetchmany(self, size: int = 1) -> List:
+        return self._rows(self._cursor.fetchmany(size))
+
+    def fetchall(self) -> List:
+        return self._rows(self._cursor.fetchall())
+
+    def __iter__(self):
+        while True:
+            row = self.fetchone()
+            if row is None:
+                return
+            yield row
+
+    def close(self):
+        self._cursor.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class SQLiteConnection:
+    """The subset of the mysql.connector connection interface InventorySystem relies on.
+
+    write_locks holds the process-wide write lock of this connection's file and
+    of its attached shards, in DB_CONFIG order; database names its own file.
+    """
+
+    def __init__(self, raw: sqlite3.Connection, database: Optional[str] = None,
+                 write_locks: Optional[Dict[str, threading.Lock]] = None):
+        self.raw = raw
+        self.database = database
+        self.statement_started = time.monotonic()
+        self._write_locks = write_locks or {}
+        self._held = []
+        self._closed = False
+
+    @property
+    def in_transaction(self) -> bool:
+        return self.raw.in_transaction
+
+    def cursor(self, dictionary: bool = False, **kwargs) -> SQLiteCursor:
+        return SQLiteCursor(self, dictionary)
+
+    def begin(self, immediate: bool = False):
+        """Start a write transaction on this file, or with immediate on it and every attached shard.
+
+        The files' process-wide locks are taken first, in DB_CONFIG order, so
+        threads queue on them and resume as soon as the writer ahead of them
+        ends, instead of sleeping in SQLite's busy handler (up to 100 ms per
+        retry), which a steady stream of other writers can starve.
+        """
+        names = list(self._write_locks) if immediate else [self.database]
+        deadline = time.monotonic() + SQLITE_BUSY_TIMEOUT
+        try:
+            for name in names:
+                lock = self._write_locks.get(name)
+                if lock is None:
+                    continue
+                if not lock.acquire(timeout=max(0.0, deadline - time.monotonic())):
+                    raise sqlite3.OperationalError("database is locked")
+                self._held.append(lock)
+            # BEGIN IMMEDIATE write-locks the file and all attached ones; a plain BEGIN locks on first write
+            self.raw.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+        except Exception:
+            self._release_write_locks()
+            raise
+
+    def _release_write_locks(self):
+        while self._held:
+            self._held.pop().release()
+
+    def commit(self):
+        try:
+            self.raw.commit()
+        finally:
+            if not self.raw.in_transaction:
+                self._release_write_locks()
+
+    def rollback(self):
+        try:
+            self.raw.rollback()
+        finally:
+            self._release_write_locks()
+
+    def is_connected(self) -> bool:
+        return not self._closed
+
+    def set_statement_timeout(self, seconds: Optional[float]):
+        """Interrupt statements that run longer than seconds (None: no limit), like MySQL's MAX_EXECUTION_TIME."""
+        if seconds is None:
+            self.raw.set_progress_handler(None, SQLITE_PROGRESS_STEPS)
+        else:
+            self.raw.set_progress_handler(lambda: time.monotonic() - self.statement_started > seconds,
+                                          SQLITE_PROGRESS_STEPS)
+
+    def ping(self, reconnect: bool = False, attempts: int = 1):
+        self.raw.execute("SELECT 1")
+
+    def close(self):
+        self._closed = True
+        try:
+            self.raw.close()
+        finally:
+            self._release_write_locks()
+
+
+class SQLiteBackend(StorageBackend):
+    """Embedded storage: one SQLite file per shard in a directory, in WAL mode.
+
+    The tables come from database.sql (see sqlite_schema) and are created on
+    startup. Connections to product shards attach the other product shards
+    under their database names, so set-based moves such as
+    INSERT INTO inventory_mid.Products ... SELECT keep working. XA
+    statements map to local transactions: replicated writes are made on every
+    shard and then committed shard by shard, and verify/repair_reference_data
+    fixes the rare commit that fails halfway.
+
+    SQLite locks whole files, so two transactions moving rows between the
+    same shards in opposite directions would wait on each other until the
+    busy timeout; cross_shard_write serializes them within the process.
+    Within a process, writers also queue on a lock per file before SQLite's
+    own lock (see SQLiteConnection.begin); other processes still meet only
+    SQLite's busy timeout.
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, directory: str, db_config: Dict[str, Dict], linked_shards: Optional[List[str]] = None,
+                 schema_path: str = SCHEMA_PATH):
+        self.directory = directory
+        self.db_config = db_config
+        self.linked_shards = list(linked_shards or [])
+        self._lock = threading.Lock()
+        self._cross_shard_lock = threading.Lock()
+        # One write lock per database file, shared by every connection this backend opens
+        self._write_locks = {self.database_name(shard): threading.Lock() for shard in db_config}
+        os.makedirs(directory, exist_ok=True)
+        with open(schema_path, 'r', encoding='utf-8') as f:
+            schema = sqlite_schema(f.read())
+        for shard in db_config:
+            conn = sqlite3.connect(self.path(shard))
+            try:
+                conn.create_function('NOW', 0, _sqlite_now)
+                conn.execute("PRAGMA journal_mode = WAL")  # Persistent: stored in the file itself
+                existing = {name for (name,) in conn.execute("SELECT name FROM sqlite_master")}
+                for statement in schema.get(self.database_name(shard), []):
+                    conn.execute(statement)
+                    created = re.match(r"CREATE\s+VIRTUAL\s+TABLE\s+IF\s+NOT\s+EXISTS\s+(\w+)", statement, re.I)
+                    if created and created.group(1) not in existing:
+                        # A full-text index added to an existing file starts empty: index the current rows once
+                        conn.execute(f"INSERT INTO {created.group(1)} ({created.group(1)}) VALUES ('rebuild')")
+                conn.commit()
+            finally:
+                conn.close()
+
+    def path(self, shard: str) -> str:
+        return os.path.join(self.directory, f"{self.database_name(shard)}.db")
+
+    def database_name(self, shard: str) -> str:
+        return self.db_config[shard]['database']
+
+    def shares_instance(self, shards: List[str]) -> bool:
+        return all(shard in self.linked_shards for shard in shards)
+
+    def connect(self, shard: str) -> SQLiteConnection:
+        raw = sqlite3.connect(
+            self.path(shard), timeout=SQLITE_BUSY_TIMEOUT, detect_types=sqlite3.PARSE_DECLTYPES,
+            check_same_thread=False, cached_statements=SQLITE_STATEMENT_CACHE
+        )
+        for pragma in SQLITE_PRAGMAS:
+            raw.execute(pragma)
+        raw.create_function('NOW', 0, _sqlite_now)
+        raw.create_function('CRC32', 1, lambda value: None if value is None else zlib.crc32(str(value).encode()),
+                            deterministic=True)
+        raw.create_function('MYSQL_ISNULL', 1, lambda value: int(value is None), deterministic=True)
+        raw.create_function('CONCAT_WS', -1, lambda separator, *values: separator.join(
+            str(value) for value in values if value is not None), deterministic=True)
+        raw.create_aggregate('BIT_XOR', 1, _BitXor)
+        reachable = {shard}
+        if shard in self.linked_shards:
+            for other in self.linked_shards:
+                if other != shard:
+                    raw.execute("ATTACH DATABASE ? AS " + self.database_name(other), (self.path(other),))
+                    reachable.add(other)
+        write_locks = {self.database_name(name): self._write_locks[self.database_name(name)]
+                       for name in self.db_config if name in reachable}
+        return SQLiteConnection(raw, self.database_name(shard), write_locks)
+
+    @contextlib.contextmanager
+    def cross_shard_write(self, conn=None):
+        # Multi-file writers are serialized within the process, so two of them never hold one shard
+        # file each while waiting for the other's. A single connection writing into its attached
+        # shards locks its own file and every attached one up front (see SQLiteConnection.begin):
+        # a later statement on an attached shard would otherwise fail at once with
+        # "database is locked" if that shard changed since the transaction first read it.
+        with self._cross_shard_lock:
+            if conn is not None and not conn.in_transaction:
+                conn.begin(immediate=True)
+            yield
+
+    def set_statement_timeout(self, conn, seconds: Optional[float]):
+        conn.set_statement_timeout(seconds)
+
+    def begin_snapshot(self, conn):
+        with conn.cursor() as cur:
+            cur.execute("BEGIN")
+            # In WAL mode the snapshot is taken by the transaction's first read
+            cur.execute("SELECT COUNT(*) FROM sqlite_master")
+            cur.fetchall()
+
+    def fulltext_match(self, alias: str, index: str, columns: List[str], terms: List[str]) -> Tuple[str, str, str, tuple]:
+        # Quoted so words such as AND/NOT stay terms; bm25() is lower for better matches
+        query = " ".join(f'"{term}"*' for term in terms)
+        return f"JOIN {index} ON {index}.rowid = {alias}.rowid", f"-bm25({index})", f"{index} MATCH %s", (query,)
+
+    def migrate(self, schema_path: str = SCHEMA_PATH) -> List[str]:
+        # Missing tables and indexes are already created whenever the backend starts
+        return []
+
+    def drop_check_constraints(self, conn, table: str, prefix: str) -> List[str]:
+        # SQLite cannot drop a constraint in place, so the table is rebuilt without it
+        with conn.cursor() as cur:
+            cur.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,))
+            ddl = cur.fetchone()[0]
+            names = re.findall(rf"CONSTRAINT\s+({prefix}\w*)\s+CHECK", ddl)
+            if not names:
+                return []
+            rebuilt = re.sub(rf",\s*CONSTRAINT\s+{prefix}\w*\s+CHECK\s*\([^()]*\)", "", ddl)
+            rebuilt = re.sub(rf"\b{table}\b", f"{table}_rebuild", rebuilt, count=1)
+            cur.execute(
+                "SELECT sql FROM sqlite_master WHERE type IN ('index', 'trigger') AND tbl_name = ? AND sql IS NOT NULL",
+                (table,)
+            )
+            indexes = [row[0] for row in cur.fetchall()]
+            cur.execute(f"PRAGMA table_info({table})")
+            columns = ", ".join(row[1] for row in cur.fetchall())
+            conn.commit()
+            cur.execute("PRAGMA foreign_keys = OFF")
+            try:
+                cur.execute("BEGIN IMMEDIATE")
+                cur.execute(rebuilt)
+                # rowids are kept: full-text indexes refer to rows by rowid
+                cur.execute(f"INSERT INTO {table}_rebuild (rowid, {columns}) SELECT rowid, {columns} FROM {table}")
+                cur.execute(f"DROP TABLE {table}")
+                cur.execute(f"ALTER TABLE {table}_rebuild RENAME TO {table}")
+                for index in indexes:
+                    cur.execute(index)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cur.execute("PRAGMA foreign_keys = ON")
+        return names
+
+
+def build_backend(name: str, db_config: Dict[str, Dict], sqlite_dir: Optional[str] = None,
+                  linked_shards: Optional[List[str]] = None) -> StorageBackend:
+    """Create a storage backend by name: 'mysql' or 'sqlite'."""
+    if name == 'mysql':
+        return MySQLBackend(db_config)
+    if name == 'sqlite':
+        return SQLiteBackend(sqlite_dir, db_config, linked_shards)
+    raise ValueError(f"Unknown storage backend: {name}")
\ No newline at end of file
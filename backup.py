@@ -0,0 +1,351 @@
+import argparse
+import csv
+import gzip
+import importlib.util
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from datetime import datetime
+from typing import Dict, Iterator, List, Tuple
+from instrumentation import operation
+from main import InventorySystem, PRODUCT_SHARDS, REFERENCE_TABLES, BULK_CHUNK_SIZE, SHARDING_STRATEGY
+
+# Tables exported from the central database and from every product shard, in restore order.
+# ProductDirectory and ShardStats are derived data and are rebuilt by the restore.
+CENTRAL_EXPORT_TABLES = ['InventoryLogs', 'InventoryLogDaily']
+SHARD_EXPORT_TABLES = ['Categories', 'Suppliers', 'Products']
+
+# Key columns the restore upserts on, so a restore can be re-run after a failure
+RESTORE_KEYS = {
+    'Products': ['ProductID'],
+    'ProductDirectory': ['ProductID'],
+    'InventoryLogs': ['LogID', 'LogTimestamp'],
+    'InventoryLogDaily': ['ProductID', 'LogDate', 'ChangeType']
+}
+
+# Export file formats; 'parquet' needs pyarrow
+EXPORT_FORMATS = ('csv', 'jsonl', 'parquet')
+
+# Rows per export file, and rows fetched from the server per round trip
+EXPORT_CHUNK_ROWS = 100000
+EXPORT_FETCH_SIZE = 5000
+
+# gzip level of CSV/JSONL files (lower is faster) and the Parquet column codec
+EXPORT_GZIP_LEVEL = 6
+EXPORT_PARQUET_COMPRESSION = 'zstd'
+
+# How NULL is written in CSV files, as in MySQL's LOAD DATA, so it differs from an empty string
+EXPORT_CSV_NULL = '\\N'
+
+# Files restored concurrently
+RESTORE_WORKERS = 4
+
+MANIFEST_NAME = 'manifest.json'
+
+FILE_EXTENSIONS = {'csv': 'csv.gz', 'jsonl': 'jsonl.gz', 'parquet': 'parquet'}
+
+
+def _check_format(file_format: str):
+    if file_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {file_format}")
+    if file_format == 'parquet' and importlib.util.find_spec('pyarrow') is None:
+        raise ValueError("Parquet export needs pyarrow; use 'csv' or 'jsonl' instead")
+
+
+class _ChunkWriter:
+    """Writes rows of one table to numbered files of at most chunk_rows rows each."""
+
+    def __init__(self, directory: str, prefix: str, file_format: str, columns: List[str], chunk_rows: int):
+        self.directory = directory
+        self.prefix = prefix
+        self.file_format = file_format
+        self.columns = columns
+        self.chunk_rows = chunk_rows
+        self.files = []
+        self.rows = 0
+        self._file = None
+        self._writer = None
+        self._file_rows = 0
+        self._parquet_rows = []
+
+    def _path(self) -> str:
+        return os.path.join(self.directory, f"{self.prefix}.{len(self.files):05d}.{FILE_EXTENSIONS[self.file_format]}")
+
+    def _start_file(self):
+        path = self._path()
+        self.files.append(os.path.basename(path))
+        self._file_rows = 0
+        if self.file_format == 'parquet':
+            return
+        self._file = gzip.open(path, 'wt', encoding='utf-8', newline='', compresslevel=EXPORT_GZIP_LEVEL)
+        if self.file_format == 'csv':
+            self._writer = csv.writer(self._file)
+            self._writer.writerow(self.columns)
+
+    def _finish_file(self):
+        if self.file_format == 'parquet':
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.Table.from_pydict({
+                name: [row[i] for row in self._parquet_rows] for i, name in enumerate(self.columns)
+            })
+            pq.write_table(table, os.path.join(self.directory, self.files[-1]), compression=EXPORT_PARQUET_COMPRESSION)
+            self._parquet_rows = []
+        elif self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def write(self, rows: List[tuple]):
+        for row in rows:
+            if not self.files or self._file_rows >= self.chunk_rows:
+                if self.files:
+                    self._finish_file()
+                self._start_file()
+            if self.file_format == 'parquet':
+                self._parquet_rows.append(row)
+            elif self.file_format == 'csv':
+                self._writer.writerow([EXPORT_CSV_NULL if value is None else value for value in row])
+            else:
+                self._file.write(json.dumps(dict(zip(self.columns, row)), default=str) + '\n')
+            self._file_rows += 1
+        self.rows += len(rows)
+
+    def close(self):
+        if not self.files:
+            self._start_file()  # An empty table still gets a file, so the export lists every table
+        self._finish_file()
+
+
+def _export_database(conn, database: str, tables: List[str], directory: str, file_format: str,
+                     chunk_rows: int, fetch_size: int) -> List[Dict]:
+    """Stream the given tables of one database into chunk files, one table after another on conn."""
+    entries = []
+    with operation('export_catalog'):
+        for table in tables:
+            with conn.cursor() as cur:
+                # The default (unbuffered) cursor streams rows as they are fetched
+                cur.execute(f"SELECT * FROM {table}")
+                columns = list(cur.column_names)
+                writer = _ChunkWriter(directory, f"{database}.{table}", file_format, columns, chunk_rows)
+                try:
+                    while True:
+                        rows = cur.fetchmany(fetch_size)
+                        if not rows:
+                            break
+                        writer.write(rows)
+                finally:
+                    writer.close()
+            entries.append({'database': database, 'table': table, 'columns': columns,
+                            'rows': writer.rows, 'files': writer.files})
+    return entries
+
+
+def export_catalog(inventory: InventorySystem, directory: str, file_format: str = 'csv',
+                   consistent_snapshot: bool = True, chunk_rows: int = EXPORT_CHUNK_ROWS,
+                   fetch_size: int = EXPORT_FETCH_SIZE) -> Dict:
+    """Export the catalog and inventory logs to chunked, compressed files plus a manifest.
+
+    Every database is streamed on its own connection in parallel, with
+    memory bounded by fetch_size rows (a file's chunk_rows for Parquet).
+    With consistent_snapshot each database is read from a snapshot taken
+    before any table is read. The snapshots of different databases are
+    moments apart, so a product moved between shards in that window can
+    appear twice or not at all; the restore's upserts absorb duplicates.
+    The manifest is written last, so an interrupted export has none.
+    """
+    _check_format(file_format)
+    os.makedirs(directory, exist_ok=True)
+    plan = [('central', CENTRAL_EXPORT_TABLES)] + [(shard, SHARD_EXPORT_TABLES) for shard in PRODUCT_SHARDS]
+    started = datetime.now()
+    with ExitStack() as stack:
+        conns = {database: stack.enter_context(inventory.pools[database].connection()) for database, _ in plan}
+        if consistent_snapshot:
+            for database, _ in plan:
+                inventory.backend.begin_snapshot(conns[database])
+        with ThreadPoolExecutor(max_workers=len(plan)) as executor:
+            futures = [
+                executor.submit(_export_database, conns[database], database, tables, directory,
+                                file_format, chunk_rows, fetch_size)
+                for database, tables in plan
+            ]
+            try:
+                tables = [entry for future in futures for entry in future.result()]
+            except Exception as e:
+                raise Exception(f"Failed to export catalog: {str(e)}")
+    manifest = {
+        'created_at': started.isoformat(timespec='seconds'),
+        'format': file_format,
+        'consistent_snapshot': consistent_snapshot,
+        'storage_backend': inventory.backend.name,
+        'sharding_strategy': SHARDING_STRATEGY,
+        'tables': tables
+    }
+    path = os.path.join(directory, MANIFEST_NAME)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + '.tmp', path)
+    return manifest
+
+
+def iter_export_rows(path: str, file_format: str) -> Iterator[Dict]:
+    """Yield the rows of one export file as dicts, one at a time."""
+    if file_format == 'parquet':
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=EXPORT_FETCH_SIZE):
+            yield from batch.to_pylist()
+        return
+    with gzip.open(path, 'rt', encoding='utf-8', newline='') as f:
+        if file_format == 'csv':
+            for record in csv.DictReader(f):
+                yield {name: None if value == EXPORT_CSV_NULL else value for name, value in record.items()}
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def _upsert_sql(table: str, columns: List[str]) -> str:
+    keys = RESTORE_KEYS[table]
+    updates = ", ".join(f"{column} = VALUES({column})" for column in columns if column not in keys)
+    return (f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))}) "
+            f"ON DUPLICATE KEY UPDATE {updates}")
+
+
+def _write_rows(inventory: InventorySystem, database: str, table: str, columns: List[str], rows: List[tuple]):
+    with operation('restore_catalog'), inventory.pools[database].connection() as conn:
+        try:
+            with conn.cursor() as cur:
+                cur.executemany(_upsert_sql(table, columns), rows)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+
+def _restore_products_file(inventory: InventorySystem, path: str, file_format: str, columns: List[str],
+                           chunk_size: int) -> int:
+    """Upsert one Products file onto the shards the current shard map assigns, with their directory entries."""
+    buffers = {shard: [] for shard in PRODUCT_SHARDS}
+    restored = 0
+    id_index = columns.index('ProductID')
+
+    def flush(shard: str):
+        rows = buffers[shard]
+        _write_rows(inventory, shard, 'Products', columns, rows)
+        _write_rows(inventory, 'central', 'ProductDirectory', ['ProductID', 'Shard'],
+                    [(row[id_index], shard) for row in rows])
+        buffers[shard] = []
+
+    for record in iter_export_rows(path, file_format):
+        shard = inventory.shard_for_product(record['ProductID'], float(record['Price']))
+        buffers[shard].append(tuple(record[column] for column in columns))
+        if len(buffers[shard]) >= chunk_size:
+            flush(shard)
+        restored += 1
+    for shard in PRODUCT_SHARDS:
+        if buffers[shard]:
+            flush(shard)
+    return restored
+
+
+def _restore_central_file(inventory: InventorySystem, table: str, path: str, file_format: str,
+                          columns: List[str], chunk_size: int) -> int:
+    rows, restored = [], 0
+    for record in iter_export_rows(path, file_format):
+        rows.append(tuple(record[column] for column in columns))
+        if len(rows) >= chunk_size:
+            _write_rows(inventory, 'central', table, columns, rows)
+            restored += len(rows)
+            rows = []
+    if rows:
+        _write_rows(inventory, 'central', table, columns, rows)
+        restored += len(rows)
+    return restored
+
+
+def restore_catalog(inventory: InventorySystem, directory: str, workers: int = RESTORE_WORKERS,
+                    chunk_size: int = BULK_CHUNK_SIZE) -> Dict[str, int]:
+    """Load an export_catalog directory back, returning the rows restored per table.
+
+    Categories and suppliers are replicated to every shard from the first
+    shard's export. Products are routed by the current shard map, so an
+    export can be restored under another sharding strategy; files are
+    loaded by parallel workers in chunk_size-row upserts, and re-running a
+    failed restore is safe. Restore into an empty catalog: products already
+    present on another shard are not removed. Shard statistics are
+    reconciled at the end.
+    """
+    with open(os.path.join(directory, MANIFEST_NAME), 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    file_format = manifest['format']
+    _check_format(file_format)
+    restored = {}
+
+    def reference_rows(table: str) -> List[tuple]:
+        entry = next(entry for entry in manifest['tables'] if entry['table'] == table)
+        columns = REFERENCE_TABLES[table][1]
+        return [
+            tuple(record[column] for column in columns)
+            for name in entry['files']
+            for record in iter_export_rows(os.path.join(directory, name), file_format)
+        ]
+
+    try:
+        # Replicated reference data is small; products refer to it, so it goes first
+        restored['Categories'] = inventory.add_categories(reference_rows('Categories'))
+        restored['Suppliers'] = inventory.add_suppliers(reference_rows('Suppliers'))
+
+        tasks: List[Tuple[str, tuple]] = []
+        for entry in manifest['tables']:
+            for name in entry['files']:
+                path = os.path.join(directory, name)
+                if entry['table'] == 'Products':
+                    tasks.append(('Products', (_restore_products_file, inventory, path, file_format,
+                                               entry['columns'], chunk_size)))
+                elif entry['table'] in CENTRAL_EXPORT_TABLES:
+                    tasks.append((entry['table'], (_restore_central_file, inventory, entry['table'], path,
+                                                   file_format, entry['columns'], chunk_size)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [(table, executor.submit(*call)) for table, call in tasks]
+            for table, future in futures:
+                restored[table] = restored.get(table, 0) + future.result()
+    except Exception as e:
+        raise Exception(f"Failed to restore catalog after {sum(restored.values())} rows: {str(e)}")
+    finally:
+        inventory.directory_cache.clear()
+    inventory.reconcile_shard_stats()
+    return restored
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the catalog to compressed files, or restore such an export")
+    commands = parser.add_subparsers(dest='command', required=True)
+    export_parser = commands.add_parser('export', help="Stream every shard and the inventory logs to DIRECTORY")
+    export_parser.add_argument('directory')
+    export_parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv')
+    export_parser.add_argument('--no-snapshot', action='store_true',
+                               help="Do not read each database from a consistent snapshot")
+    export_parser.add_argument('--chunk-rows', type=int, default=EXPORT_CHUNK_ROWS)
+    restore_parser = commands.add_parser('restore', help="Load an export from DIRECTORY")
+    restore_parser.add_argument('directory')
+    restore_parser.add_argument('--workers', type=int, default=RESTORE_WORKERS)
+    restore_parser.add_argument('--chunk-size', type=int, default=BULK_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    inventory = InventorySystem()
+    try:
+        if args.command == 'export':
+            manifest = export_catalog(inventory, args.directory, args.format,
+                                      consistent_snapshot=not args.no_snapshot, chunk_rows=args.chunk_rows)
+            for entry in manifest['tables']:
+                print(f"{entry['database']}.{entry['table']}: {entry['rows']} rows in {len(entry['files'])} file(s)")
+        else:
+            for table, count in restore_catalog(inventory, args.directory, args.workers, args.chunk_size).items():
+                print(f"{table}: {count} rows")
+    finally:
+        inventory.close()
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,302 @@
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from backends import SQLiteBackend
+from main import InventorySystem, DB_CONFIG, PRODUCT_SHARDS, PRICE_RANGES, SHARDING_STRATEGY, POOL_SIZE
+
+# Schema file loaded by --load-schema
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'database.sql')
+
+# Price distributions the catalog generator can draw from
+PRICE_DISTRIBUTIONS = ('uniform', 'lognormal', 'banded')
+
+# Share of products per price band for the 'banded' distribution, in PRICE_RANGES order
+BANDED_WEIGHTS = [0.6, 0.3, 0.1]
+
+# Default operation mix: relative weight of each workload operation
+DEFAULT_MIX = {
+    'point_lookup': 50,
+    'range_scan': 10,
+    'list_page': 10,
+    'stock_delta': 25,
+    'reprice': 5,
+    'search': 0  # Opt in with e.g. --mix ...,search=10
+}
+
+# Products sampled from the catalog as targets for point lookups, stock deltas and repricing
+SAMPLE_SIZE = 10000
+
+
+def load_schema(path: str = SCHEMA_PATH):
+    """Create the central and shard databases by running database.sql against the configured server."""
+    config = {key: value for key, value in DB_CONFIG['central'].items() if key != 'database'}
+    with open(path, 'r', encoding='utf-8') as f:
+        script = f.read()
+    import mysql.connector  # Not needed for SQLite runs
+    conn = mysql.connector.connect(**config)
+    try:
+        with conn.cursor() as cur:
+            for statement in script.split(';'):
+                sql = "\n".join(line for line in statement.splitlines() if not line.strip().startswith('--')).strip()
+                if sql:
+                    cur.execute(sql)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def reset_data(inventory: InventorySystem):
+    """Delete every product, log row and directory entry so runs start from the same state."""
+    for shard in PRODUCT_SHARDS:
+        with inventory.pools[shard].connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM Products")
+                cur.execute("DELETE FROM ShardStats")
+            conn.commit()
+    with inventory.pools['central'].connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM InventoryLogs")
+            cur.execute("DELETE FROM InventoryLogDaily")
+            cur.execute("DELETE FROM ProductDirectory")
+        conn.commit()
+    inventory.directory_cache.clear()
+    # Rewrites the ShardStats baseline the deletes removed
+    inventory.reconcile_shard_stats()
+
+
+def random_price(rng: random.Random, distribution: str) -> float:
+    """Draw one product price from a named distribution."""
+    if distribution == 'uniform':
+        price = rng.uniform(1, 2000)
+    elif distribution == 'lognormal':
+        # Median around 33, with a long tail into the high_price band
+        price = min(rng.lognormvariate(3.5, 1.2), 99999)
+    elif distribution == 'banded':
+        low, high = rng.choices(list(PRICE_RANGES.values()), weights=BANDED_WEIGHTS)[0]
+        price = rng.uniform(max(low, 1), min(high, 5000))
+    else:
+        raise ValueError(f"Unknown price distribution: {distribution}")
+    return max(round(price, 2), 0.01)
+
+
+def generate_catalog(size: int, distribution: str = 'lognormal', seed: int = 0,
+                     categories: int = 20, suppliers: int = 50) -> Iterator[Dict]:
+    """Yield size reproducible synthetic products as add_products_bulk dicts."""
+    rng = random.Random(seed)
+    for i in range(size):
+        yield {
+            'name': f"Product {i}",
+            'description': f"Synthetic product {i}",
+            'price': random_price(rng, distribution),
+            'stock_quantity': rng.randint(0, 500),
+            'category_id': rng.randint(1, categories),
+            'supplier_id': rng.randint(1, suppliers)
+        }
+
+
+def load_catalog(inventory: InventorySystem, size: int, distribution: str = 'lognormal', seed: int = 0,
+                 categories: int = 20, suppliers: int = 50) -> Dict:
+    """Seed reference data and bulk-load a synthetic catalog, returning load timings."""
+    inventory.add_categories((i, f"Category {i}") for i in range(1, categories + 1))
+    inventory.add_suppliers((i, f"Supplier {i}", f"supplier{i}@example.com") for i in range(1, suppliers + 1))
+    started = time.perf_counter()
+    added = inventory.add_products_bulk(generate_catalog(size, distribution, seed, categories, suppliers))
+    elapsed = time.perf_counter() - started
+    return {'products': added, 'seconds': elapsed, 'rows_per_second': added / elapsed if elapsed else None}
+
+
+def sample_products(inventory: InventorySystem, size: int = SAMPLE_SIZE, seed: int = 0) -> List[Tuple[str, float]]:
+    """Reservoir-sample (ProductID, Price) pairs from the whole catalog."""
+    rng = random.Random(seed)
+    sample = []
+    for i, product in enumerate(inventory.iter_products()):
+        item = (product['ProductID'], float(product['Price']))
+        if i < size:
+            sample.append(item)
+        else:
+            j = rng.randint(0, i)
+            if j < size:
+                sample[j] = item
+    return sample
+
+
+def build_operations(inventory: InventorySystem, sample: List[Tuple[str, float]],
+                     distribution: str) -> Dict[str, Callable[[random.Random], None]]:
+    """Workload operations, each taking the worker's random generator."""
+    def point_lookup(rng):
+        inventory.get_product_by_id(rng.choice(sample)[0])
+
+    def range_scan(rng):
+        low = random_price(rng, distribution)
+        inventory.get_products_by_price_range(low, low * 1.05)
+
+    def list_page(rng):
+        inventory.list_products_page(50, (rng.choice(sample)[0],))
+
+    def stock_delta(rng):
+        inventory.apply_stock_deltas([(rng.choice(sample)[0], rng.randint(-3, 5)) for _ in range(10)])
+
+    def reprice(rng):
+        # Fresh prices from the catalog distribution, so some changes cross shards
+        inventory.reprice_products([(rng.choice(sample)[0], random_price(rng, distribution)) for _ in range(10)])
+
+    def search(rng):
+        # Synthetic names are "Product <n>": a number prefix matches a spread of names
+        inventory.search_products(f"product {rng.randint(1, 999)}")
+
+    return {
+        'point_lookup': point_lookup,
+        'range_scan': range_scan,
+        'list_page': list_page,
+        'stock_delta': stock_delta,
+        'reprice': reprice,
+        'search': search
+    }
+
+
+def _percentile(ordered: List[float], percent: float) -> Optional[float]:
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return None
+    return ordered[max(math.ceil(percent / 100 * len(ordered)) - 1, 0)]
+
+
+def summarize(latencies: Dict[str, List[float]], errors: Dict[str, int], elapsed: float,
+              last_errors: Optional[Dict[str, str]] = None) -> Dict:
+    """Per-operation counts, throughput and latency percentiles in milliseconds."""
+    report = {}
+    for name in sorted(set(latencies) | set(errors)):
+        ordered = sorted(latencies.get(name, []))
+        report[name] = {
+            'count': len(ordered),
+            'errors': errors.get(name, 0),
+            'throughput_ops_s': len(ordered) / elapsed if elapsed else None,
+            'mean_ms': sum(ordered) / len(ordered) * 1000 if ordered else None,
+            'p50_ms': _percentile(ordered, 50) * 1000 if ordered else None,
+            'p95_ms': _percentile(ordered, 95) * 1000 if ordered else None,
+            'p99_ms': _percentile(ordered, 99) * 1000 if ordered else None,
+            'max_ms': ordered[-1] * 1000 if ordered else None,
+            'last_error': (last_errors or {}).get(name)
+        }
+    return report
+
+
+def run_workload(operations: Dict[str, Callable], mix: Dict[str, int], concurrency: int,
+                 duration: float, seed: int = 0) -> Dict:
+    """Run the weighted operation mix on concurrency threads for duration seconds."""
+    names = [name for name in mix if mix[name] > 0]
+    weights = [mix[name] for name in names]
+    latencies = {name: [] for name in names}
+    errors, last_errors = {}, {}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(index: int):
+        rng = random.Random(seed * 1000 + index)
+        local_latencies = {name: [] for name in names}
+        local_errors = {}
+        while time.perf_counter() < deadline:
+            name = rng.choices(names, weights=weights)[0]
+            started = time.perf_counter()
+            try:
+                operations[name](rng)
+                local_latencies[name].append(time.perf_counter() - started)
+            except Exception as e:
+                local_errors[name] = local_errors.get(name, 0) + 1
+                last_errors[name] = str(e)
+        with lock:
+            for name, values in local_latencies.items():
+                latencies[name].extend(values)
+            for name, count in local_errors.items():
+                errors[name] = errors.get(name, 0) + count
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(worker, range(concurrency)))
+    elapsed = time.perf_counter() - started
+    total = sum(len(values) for values in latencies.values())
+    return {
+        'concurrency': concurrency,
+        'seconds': elapsed,
+        'operations_total': total,
+        'throughput_ops_s': total / elapsed if elapsed else None,
+        'operations': summarize(latencies, errors, elapsed, last_errors)
+    }
+
+
+def _parse_mix(text: str) -> Dict[str, int]:
+    mix = {}
+    for item in text.split(','):
+        name, _, weight = item.partition('=')
+        if name.strip() not in DEFAULT_MIX:
+            raise ValueError(f"Unknown operation in mix: {name}")
+        mix[name.strip()] = int(weight)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark InventorySystem operations and report latency percentiles as JSON")
+    parser.add_argument('--load-schema', action='store_true', help="Run database.sql against the configured server first")
+    parser.add_argument('--sqlite-dir', help="Benchmark the embedded SQLite backend with shard files in this directory")
+    parser.add_argument('--reset', action='store_true', help="Delete ALL products and logs before loading the catalog")
+    parser.add_argument('--catalog-size', type=int, default=0, help="Synthetic products to load (0 uses the existing catalog)")
+    parser.add_argument('--distribution', choices=PRICE_DISTRIBUTIONS, default='lognormal')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--concurrency', default='1,4,16', help="Comma-separated thread counts to run in turn")
+    parser.add_argument('--duration', type=float, default=30.0, help="Seconds per concurrency level")
+    parser.add_argument('--mix', default=','.join(f"{name}={weight}" for name, weight in DEFAULT_MIX.items()))
+    parser.add_argument('--output', help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    concurrency_levels = [int(level) for level in args.concurrency.split(',')]
+    mix = _parse_mix(args.mix)
+    if args.load_schema and not args.sqlite_dir:
+        load_schema()
+
+    # SQLite shard files are created from database.sql on first use
+    backend = SQLiteBackend(args.sqlite_dir, DB_CONFIG, PRODUCT_SHARDS) if args.sqlite_dir else None
+    inventory = InventorySystem(pool_size=max(POOL_SIZE, max(concurrency_levels)), backend=backend)
+    try:
+        report = {
+            'started_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'storage_backend': 'sqlite' if args.sqlite_dir else 'mysql',
+            'sharding_strategy': SHARDING_STRATEGY,
+            'distribution': args.distribution,
+            'seed': args.seed,
+            'mix': mix
+        }
+        if args.reset:
+            reset_data(inventory)
+        if args.catalog_size:
+            report['load'] = load_catalog(inventory, args.catalog_size, args.distribution, args.seed)
+        report['shard_counts'] = inventory.get_shard_counts()
+        sample = sample_products(inventory, seed=args.seed)
+        if not sample:
+            raise SystemExit("The catalog is empty; pass --catalog-size to generate one")
+        operations = build_operations(inventory, sample, args.distribution)
+        report['runs'] = [
+            run_workload(operations, mix, concurrency, args.duration, args.seed)
+            for concurrency in concurrency_levels
+        ]
+    finally:
+        inventory.close()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
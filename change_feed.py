@@ -0,0 +1,184 @@
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+from instrumentation import operation
+
+# InventoryLogs entries read per batch, seconds between reads while caught up, and seconds
+# the feed waits at a gap in the LogID sequence for the transaction that may still fill it
+FEED_BATCH_SIZE = 500
+FEED_POLL_INTERVAL = 0.5
+FEED_GAP_WAIT = 5.0
+
+# Seconds a gap the feed has moved past is still re-read for entries committed late; a
+# transaction that writes InventoryLogs and stays open longer than this can be missed
+FEED_GAP_EXPIRY = 600.0
+
+# Seconds one long poll of stream() waits for new entries before checking idle_timeout
+FEED_LONG_POLL = 5.0
+
+
+class ChangeFeed:
+    """Tails InventoryLogs in LogID order for one named consumer, resuming after its checkpoint.
+
+    Entries are read only when the consumer asks for the next batch, so a
+    slow consumer holds back its own feed and at most batch_size entries are
+    in memory at a time. commit() stores the position in FeedCheckpoints;
+    after a restart the entries since the last commit are delivered again.
+
+    LogIDs are handed out when rows are inserted, not when they commit, so a
+    gap in the sequence may still be filled by a transaction in flight. The
+    feed stops before a gap until it has stayed open for gap_wait seconds,
+    then moves on but keeps re-reading the gap for gap_expiry seconds (rolled
+    back inserts and compaction leave gaps that never fill). Entries that
+    commit into a gap late are delivered when they appear, out of LogID
+    order, and the checkpoint stays before the oldest open gap so a restart
+    re-reads it.
+    """
+
+    def __init__(self, inventory, consumer: str, batch_size: int = FEED_BATCH_SIZE,
+                 include_products: bool = True, gap_wait: float = FEED_GAP_WAIT,
+                 poll_interval: float = FEED_POLL_INTERVAL, start_after: int = 0,
+                 gap_expiry: float = FEED_GAP_EXPIRY):
+        self.inventory = inventory
+        self.consumer = consumer
+        self.batch_size = batch_size
+        self.include_products = include_products
+        self.gap_wait = gap_wait
+        self.poll_interval = poll_interval
+        self.gap_expiry = gap_expiry
+        self._gap_since = None
+        # (first LogID, last LogID, monotonic time first seen) of gaps behind position
+        self._gaps: List[Tuple[int, int, float]] = []
+        checkpoint = self._load_checkpoint()
+        # start_after only applies to a consumer without a checkpoint
+        self.committed = checkpoint if checkpoint is not None else start_after
+        self.position = self.committed
+
+    def _load_checkpoint(self) -> Optional[int]:
+        with operation('change_feed'), self.inventory.pools['central'].connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT LastLogID FROM FeedCheckpoints WHERE Consumer = %s", (self.consumer,))
+                row = cur.fetchone()
+        return int(row[0]) if row else None
+
+    def _contiguous(self, changes: List[Dict]) -> List[Dict]:
+        """The leading entries of a batch that do not follow a gap still young enough to be filled.
+
+        A gap the batch moves past is remembered so _fill_gaps keeps re-reading it.
+        """
+        accepted, expected = [], self.position + 1
+        for change in changes:
+            if change['LogID'] != expected:
+                if self._gap_since is None:
+                    self._gap_since = time.monotonic()
+                if time.monotonic() - self._gap_since < self.gap_wait:
+                    break
+                self._gaps.append((expected, change['LogID'] - 1, self._gap_since))
+            self._gap_since = None
+            accepted.append(change)
+            expected = change['LogID'] + 1
+        return accepted
+
+    def _fill_gaps(self) -> List[Dict]:
+        """Entries that have committed into gaps behind the position since the feed moved past them."""
+        now = time.monotonic()
+        gaps, filled = [], []
+        for low, high, since in self._gaps:
+            if now - since >= self.gap_expiry:
+                continue
+            changes = [
+                change for change in self.inventory.read_changes(low - 1, min(self.batch_size, high - low + 1),
+                                                                 include_products=False)
+                if change['LogID'] <= high
+            ]
+            for change in changes:
+                if change['LogID'] > low:
+                    gaps.append((low, change['LogID'] - 1, since))
+                low = change['LogID'] + 1
+            if low <= high:
+                gaps.append((low, high, since))
+            filled.extend(changes)
+        self._gaps = gaps
+        return filled
+
+    def checkpoint(self) -> int:
+        """The LogID every entry up to which has been delivered: the position, or just before the oldest open gap."""
+        return min([self.position] + [low - 1 for low, _, _ in self._gaps])
+
+    def poll(self, timeout: float = 0.0) -> List[Dict]:
+        """The next entries after the current position, waiting up to timeout seconds for some to arrive.
+
+        Each entry is an InventoryLogs row with the product's current row
+        under 'Product' (None once deleted) when include_products is set.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            changes = self._fill_gaps()
+            changes += self._contiguous(self.inventory.read_changes(self.position, self.batch_size, include_products=False))
+            if changes:
+                if self.include_products:
+                    products = self.inventory.get_products_by_ids(
+                        list({change['ProductID'] for change in changes if change['ChangeType'] != 'delete'})
+                    )
+                    for change in changes:
+                        change['Product'] = products.get(change['ProductID'])
+                self.position = max(self.position, changes[-1]['LogID'])
+                return changes
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return changes
+            time.sleep(min(self.poll_interval, remaining))
+
+    def commit(self, log_id: Optional[int] = None):
+        """Store log_id (by default checkpoint(): everything up to it delivered) as this consumer's checkpoint."""
+        log_id = self.checkpoint() if log_id is None else log_id
+        with operation('change_feed'), self.inventory.pools['central'].connection() as conn:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        """INSERT INTO FeedCheckpoints (Consumer, LastLogID) VALUES (%s, %s)
+                        ON DUPLICATE KEY UPDATE LastLogID = VALUES(LastLogID)""",
+                        (self.consumer, log_id)
+                    )
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                raise Exception(f"Failed to store change feed checkpoint: {str(e)}")
+        self.committed = log_id
+
+    def stream(self, idle_timeout: Optional[float] = None, auto_commit: bool = True) -> Iterator[Dict]:
+        """Yield entries as they arrive, long-polling while caught up.
+
+        With auto_commit the checkpoint is stored once the consumer has taken
+        every entry of a batch. Stops after idle_timeout seconds without new
+        entries; None keeps waiting.
+        """
+        idle_since = time.monotonic()
+        while True:
+            long_poll = FEED_LONG_POLL if idle_timeout is None else min(FEED_LONG_POLL, idle_timeout)
+            changes = self.poll(long_poll)
+            if not changes:
+                if idle_timeout is not None and time.monotonic() - idle_since >= idle_timeout:
+                    return
+                continue
+            for change in changes:
+                yield change
+            if auto_commit:
+                self.commit()
+            idle_since = time.monotonic()
+
+    def __iter__(self) -> Iterator[Dict]:
+        return self.stream()
+
+    def lag(self) -> Dict[str, int]:
+        """Delivered and committed positions, the newest LogID, how many LogIDs the feed is behind and its open gaps."""
+        with operation('change_feed'), self.inventory.pools['central'].connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT MAX(LogID) FROM InventoryLogs")
+                latest = cur.fetchone()[0] or 0
+        return {
+            'position': self.position,
+            'committed': self.committed,
+            'latest': latest,
+            'behind': max(latest - self.position, 0),
+            'open_gaps': len(self._gaps)
+        }
\ No newline at end of file
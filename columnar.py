@@ -0,0 +1,71 @@
+import numpy as np
+from typing import Dict, Iterable, List, Sequence
+
+# Rows converted to column arrays per fetchmany() round trip
+COLUMNAR_FETCH_SIZE = 10000
+
+# Array dtype of each known column; unlisted columns (names, descriptions) stay object arrays.
+# Integer columns that contain NULLs fall back to float64 with NaN.
+COLUMN_DTYPES = {
+    'Price': np.float64,
+    'StockQuantity': np.int32,
+    'CategoryID': np.int32,
+    'SupplierID': np.int32,
+    'DateAdded': 'datetime64[us]',
+    'LastUpdated': 'datetime64[us]',
+    'ProductCount': np.int64,
+    'TotalUnits': np.int64,
+    'StockValue': np.float64,
+    'MinPrice': np.float64,
+    'MaxPrice': np.float64,
+    'AvgPrice': np.float64,
+    'LowStockCount': np.int64
+}
+
+
+def _column_array(name: str, values: Sequence) -> np.ndarray:
+    dtype = COLUMN_DTYPES.get(name)
+    if dtype is None:
+        array = np.empty(len(values), dtype=object)
+        array[:] = values
+        return array
+    if np.issubdtype(np.dtype(dtype), np.integer) and any(value is None for value in values):
+        dtype = np.float64
+    # None becomes NaN / NaT and Decimal converts directly for float and datetime dtypes
+    return np.array(values, dtype=dtype)
+
+
+def columns_from_rows(names: Sequence[str], rows: List[tuple]) -> Dict[str, np.ndarray]:
+    """Turn tuple rows into one typed array per column."""
+    values = list(zip(*rows)) if rows else [()] * len(names)
+    return {name: _column_array(name, column) for name, column in zip(names, values)}
+
+
+def fetch_columns(cur, batch_size: int = COLUMNAR_FETCH_SIZE) -> Dict[str, np.ndarray]:
+    """Read an executed tuple cursor into column arrays, converting batch_size rows at a time."""
+    names = list(cur.column_names)
+    parts = []
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if not rows:
+            break
+        parts.append(columns_from_rows(names, rows))
+    return concat_columns(parts, names)
+
+
+def concat_columns(parts: Iterable[Dict[str, np.ndarray]], names: Sequence[str]) -> Dict[str, np.ndarray]:
+    """Concatenate column sets (e.g. one per shard) into a single set, in the order given."""
+    parts = list(parts)
+    if not parts:
+        return columns_from_rows(names, [])
+    if len(parts) == 1:
+        return parts[0]
+    return {name: np.concatenate([part[name] for part in parts]) for name in names}
+
+
+def format_columns(columns: Dict[str, np.ndarray], result_format: str):
+    """Return column arrays as they are ('numpy') or as a DataFrame ('dataframe')."""
+    if result_format == 'dataframe':
+        import pandas as pd  # Only needed when a DataFrame is asked for
+        return pd.DataFrame(columns, copy=False)
+    return columns
\ No newline at end of file
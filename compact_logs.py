@@ -0,0 +1,34 @@
+import argparse
+import time
+from main import InventorySystem, LOG_RETENTION_DAYS, LOG_COMPACTION_BATCH
+
+# Seconds between compaction runs when running continuously
+COMPACTION_INTERVAL = 86400.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Roll old InventoryLogs rows into daily per-product totals")
+    parser.add_argument('--retention-days', type=int, default=LOG_RETENTION_DAYS,
+                        help="Whole days of individual log rows to keep")
+    parser.add_argument('--batch-size', type=int, default=LOG_COMPACTION_BATCH)
+    parser.add_argument('--interval', type=float, default=0.0,
+                        help=f"Keep running, compacting every this many seconds (e.g. {COMPACTION_INTERVAL:g})")
+    args = parser.parse_args()
+
+    inventory = InventorySystem()
+    try:
+        while True:
+            started = time.monotonic()
+            result = inventory.compact_inventory_logs(args.retention_days, args.batch_size)
+            print(f"Rolled up {result['rolled_up']} log rows from before {result['cutoff']:%Y-%m-%d}")
+            for change in result['partitions']:
+                print(change)
+            if not args.interval:
+                break
+            time.sleep(max(args.interval - (time.monotonic() - started), 0))
+    finally:
+        inventory.close()
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -2,14 +2,82 @@
 CREATE DATABASE IF NOT EXISTS inventory_central;
 USE inventory_central;
 
+-- Detail log, partitioned by month of LogTimestamp (the partition column has to be part of
+-- the primary key). compact_logs.py rolls rows past the retention period into
+-- InventoryLogDaily, drops the emptied partitions and adds the coming months'.
 CREATE TABLE IF NOT EXISTS InventoryLogs (
-    LogID INT AUTO_INCREMENT PRIMARY KEY,
+    LogID INT AUTO_INCREMENT,
     ProductID CHAR(36) NOT NULL,
     ChangeType VARCHAR(50) NOT NULL,
     QuantityChanged INT NOT NULL,
-    LogTimestamp DATETIME DEFAULT NOW()
+    LogTimestamp DATETIME NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (LogID, LogTimestamp),
+    INDEX IDX_InventoryLogs_Product (ProductID, LogTimestamp),
+    INDEX IDX_InventoryLogs_Time (LogTimestamp)
+)
+PARTITION BY RANGE COLUMNS (LogTimestamp) (
+    PARTITION p_start VALUES LESS THAN ('2000-01-01'),
+    PARTITION p_future VALUES LESS THAN (MAXVALUE)
 );
 
+-- One row per product, day and change type for compacted InventoryLogs rows
+CREATE TABLE IF NOT EXISTS InventoryLogDaily (
+    ProductID CHAR(36) NOT NULL,
+    LogDate DATE NOT NULL,
+    ChangeType VARCHAR(50) NOT NULL,
+    Changes INT NOT NULL,
+    QuantityChanged BIGINT NOT NULL,
+    PRIMARY KEY (ProductID, LogDate, ChangeType),
+    INDEX IDX_InventoryLogDaily_Date (LogDate)
+);
+
+-- Routing directory: which product shard currently holds each ProductID
+CREATE TABLE IF NOT EXISTS ProductDirectory (
+    ProductID CHAR(36) PRIMARY KEY,
+    Shard VARCHAR(50) NOT NULL,
+    LastUpdated DATETIME DEFAULT NOW() ON UPDATE NOW()
+);
+
+-- Flushed position of each write-behind log spool (see log_spool.py)
+CREATE TABLE IF NOT EXISTS LogSpoolCheckpoints (
+    SpoolName VARCHAR(100) PRIMARY KEY,
+    Segment INT NOT NULL,
+    SegmentOffset BIGINT NOT NULL,
+    LastFlushed DATETIME DEFAULT NOW() ON UPDATE NOW()
+);
+
+-- The shard map every InventorySystem places products by (a ShardMap.to_spec() as JSON), in a
+-- single row with StateID 1. rebalance.py writes it, and while Rebalancing is set reads check every
+-- shard. Without a row, processes use SHARDING_STRATEGY from main.py.
+CREATE TABLE IF NOT EXISTS ShardMapState (
+    StateID TINYINT PRIMARY KEY,
+    ShardMap TEXT NOT NULL,
+    Rebalancing BOOLEAN NOT NULL DEFAULT FALSE,
+    LastUpdated DATETIME DEFAULT NOW() ON UPDATE NOW()
+);
+
+-- Last InventoryLogs LogID each change feed consumer has processed (see change_feed.py)
+CREATE TABLE IF NOT EXISTS FeedCheckpoints (
+    Consumer VARCHAR(100) PRIMARY KEY,
+    LastLogID INT NOT NULL,
+    UpdatedAt DATETIME DEFAULT NOW() ON UPDATE NOW()
+);
+
+-- Product shards. Every shard has the same tables; the CHK_Price_* constraints only
+-- apply to the price_range strategy (rebalance.py drops them when moving to hash sharding).
+-- Further shards are added by copying a shard block under a new database name and
+-- listing it in DB_CONFIG in main.py.
+-- Indexes added to this file reach existing databases through migrate.py; the
+-- FULLTEXT index serves InventorySystem.search_products (an FTS5 table on SQLite).
+-- ShardStats holds running totals of the shard's Products, kept up to date by every
+-- product write in main.py. Writers spread their deltas over a few Slot rows so they
+-- do not queue on one row; readers sum the slots. MinPrice/MaxPrice only ever widen
+-- between reconciles (InventorySystem.reconcile_shard_stats, reconcile_stats.py).
+-- Deltas only add up to the totals on top of a baseline, the slot a reconcile writes
+-- with LastReconciled set: until a shard has one, readers ignore its ShardStats. The
+-- INSERT after each ShardStats table seeds that baseline when the table is empty;
+-- migrate.py reconciles databases that gained ShardStats later.
+
 -- Low Price Shard
 CREATE DATABASE IF NOT EXISTS inventory_low;
 USE inventory_low;
@@ -38,9 +106,32 @@ CREATE TABLE IF NOT EXISTS Products (
     DateAdded DATETIME DEFAULT NOW(),
     LastUpdated DATETIME DEFAULT NOW(),
     FOREIGN KEY (CategoryID) REFERENCES Categories(CategoryID),
-    FOREIGN KEY (SupplierID) REFERENCES Suppliers(SupplierID)
+    FOREIGN KEY (SupplierID) REFERENCES Suppliers(SupplierID),
+    INDEX IDX_Products_Name (ProductName),
+    INDEX IDX_Products_Category (CategoryID, ProductName),
+    INDEX IDX_Products_Supplier (SupplierID, ProductName),
+    FULLTEXT INDEX FT_Products_Text (ProductName, Description)
+);
+
+CREATE TABLE IF NOT EXISTS ShardStats (
+    Slot INT PRIMARY KEY,
+    ProductCount BIGINT NOT NULL DEFAULT 0,
+    TotalUnits BIGINT NOT NULL DEFAULT 0,
+    StockValue DECIMAL(20,2) NOT NULL DEFAULT 0,
+    MinPrice DECIMAL(10,2),
+    MaxPrice DECIMAL(10,2),
+    LastReconciled DATETIME
 );
 
+INSERT INTO ShardStats (Slot, ProductCount, TotalUnits, StockValue, MinPrice, MaxPrice, LastReconciled)
+SELECT 0, ProductCount, TotalUnits, StockValue, MinPrice, MaxPrice, NOW()
+FROM (
+    SELECT COUNT(*) AS ProductCount, COALESCE(SUM(StockQuantity), 0) AS TotalUnits,
+           COALESCE(SUM(Price * StockQuantity), 0) AS StockValue, MIN(Price) AS MinPrice, MAX(Price) AS MaxPrice
+    FROM Products
+) AS Totals
+WHERE NOT EXISTS (SELECT 1 FROM ShardStats);
+
 -- Mid Price Shard
 CREATE DATABASE IF NOT EXISTS inventory_mid;
 USE inventory_mid;
@@ -69,9 +160,32 @@ CREATE TABLE IF NOT EXISTS Products (
     DateAdded DATETIME DEFAULT NOW(),
     LastUpdated DATETIME DEFAULT NOW(),
     FOREIGN KEY (CategoryID) REFERENCES Categories(CategoryID),
-    FOREIGN KEY (SupplierID) REFERENCES Suppliers(SupplierID)
+    FOREIGN KEY (SupplierID) REFERENCES Suppliers(SupplierID),
+    INDEX IDX_Products_Name (ProductName),
+    INDEX IDX_Products_Category (CategoryID, ProductName),
+    INDEX IDX_Products_Supplier (SupplierID, ProductName),
+    FULLTEXT INDEX FT_Products_Text (ProductName, Description)
 );
 
+CREATE TABLE IF NOT EXISTS ShardStats (
+    Slot INT PRIMARY KEY,
+    ProductCount BIGINT NOT NULL DEFAULT 0,
+    TotalUnits BIGINT NOT NULL DEFAULT 0,
+    StockValue DECIMAL(20,2) NOT NULL DEFAULT 0,
+    MinPrice DECIMAL(10,2),
+    MaxPrice DECIMAL(10,2),
+    LastReconciled DATETIME
+);
+
+INSERT INTO ShardStats (Slot, ProductCount, TotalUnits, StockValue, MinPrice, MaxPrice, LastReconciled)
+SELECT 0, ProductCount, TotalUnits, StockValue, MinPrice, MaxPrice, NOW()
+FROM (
+    SELECT COUNT(*) AS ProductCount, COALESCE(SUM(StockQuantity), 0) AS TotalUnits,
+           COALESCE(SUM(Price * StockQuantity), 0) AS StockValue, MIN(Price) AS MinPrice, MAX(Price) AS MaxPrice
+    FROM Products
+) AS Totals
+WHERE NOT EXISTS (SELECT 1 FROM ShardStats);
+
 -- High Price Shard
 CREATE DATABASE IF NOT EXISTS inventory_high;
 USE inventory_high;
@@ -100,6 +214,29 @@ CREATE TABLE IF NOT EXISTS Products (
     DateAdded DATETIME DEFAULT NOW(),
     LastUpdated DATETIME DEFAULT NOW(),
     FOREIGN KEY (CategoryID) REFERENCES Categories(CategoryID),
-    FOREIGN KEY (SupplierID) REFERENCES Suppliers(SupplierID)
+    FOREIGN KEY (SupplierID) REFERENCES Suppliers(SupplierID),
+    INDEX IDX_Products_Name (ProductName),
+    INDEX IDX_Products_Category (CategoryID, ProductName),
+    INDEX IDX_Products_Supplier (SupplierID, ProductName),
+    FULLTEXT INDEX FT_Products_Text (ProductName, Description)
 );
 
+CREATE TABLE IF NOT EXISTS ShardStats (
+    Slot INT PRIMARY KEY,
+    ProductCount BIGINT NOT NULL DEFAULT 0,
+    TotalUnits BIGINT NOT NULL DEFAULT 0,
+    StockValue DECIMAL(20,2) NOT NULL DEFAULT 0,
+    MinPrice DECIMAL(10,2),
+    MaxPrice DECIMAL(10,2),
+    LastReconciled DATETIME
+);
+
+INSERT INTO ShardStats (Slot, ProductCount, TotalUnits, StockValue, MinPrice, MaxPrice, LastReconciled)
+SELECT 0, ProductCount, TotalUnits, StockValue, MinPrice, MaxPrice, NOW()
+FROM (
+    SELECT COUNT(*) AS ProductCount, COALESCE(SUM(StockQuantity), 0) AS TotalUnits,
+           COALESCE(SUM(Price * StockQuantity), 0) AS StockValue, MIN(Price) AS MinPrice, MAX(Price) AS MaxPrice
+    FROM Products
+) AS Totals
+WHERE NOT EXISTS (SELECT 1 FROM ShardStats);
+
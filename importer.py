@@ -0,0 +1,63 @@
+import csv
+import io
+import json
+from typing import Dict, Iterator, Optional
+from main import InventorySystem, BULK_CHUNK_SIZE
+
+# Columns expected in an import file; they match the add_product arguments
+PRODUCT_FIELDS = ['name', 'description', 'price', 'stock_quantity', 'category_id', 'supplier_id']
+
+
+def _optional_int(value) -> Optional[int]:
+    return None if value in (None, '') else int(value)
+
+
+def _product_from_record(record: Dict, line_number: int) -> Dict:
+    """Convert one parsed CSV/JSONL record into add_products_bulk arguments."""
+    try:
+        return {
+            'name': record['name'],
+            'description': record.get('description') or None,
+            'price': float(record['price']),
+            'stock_quantity': _optional_int(record.get('stock_quantity')) or 0,
+            'category_id': _optional_int(record.get('category_id')),
+            'supplier_id': _optional_int(record.get('supplier_id'))
+        }
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"Invalid product on line {line_number}: {str(e)}")
+
+
+def _text_stream(stream):
+    """Wrap binary file objects (e.g. Streamlit uploads) so they are decoded lazily."""
+    if isinstance(stream, io.TextIOBase):
+        return stream
+    return io.TextIOWrapper(stream, encoding='utf-8', newline='')
+
+
+def iter_products_csv(stream) -> Iterator[Dict]:
+    """Yield products from a CSV file with a header row, one row at a time."""
+    reader = csv.DictReader(_text_stream(stream))
+    for record in reader:
+        yield _product_from_record(record, reader.line_num)
+
+
+def iter_products_jsonl(stream) -> Iterator[Dict]:
+    """Yield products from a JSON Lines file, one object per line."""
+    for line_number, line in enumerate(_text_stream(stream), start=1):
+        if line.strip():
+            yield _product_from_record(json.loads(line), line_number)
+
+
+def import_products(inventory: InventorySystem, stream, file_format: str = 'csv',
+                    chunk_size: int = BULK_CHUNK_SIZE, commit_every: int = 1) -> int:
+    """Stream a CSV or JSONL product file (path or file object) into the shards without loading it into memory."""
+    if isinstance(stream, str):
+        with open(stream, 'r', encoding='utf-8', newline='') as f:
+            return import_products(inventory, f, file_format, chunk_size, commit_every)
+    if file_format == 'csv':
+        products = iter_products_csv(stream)
+    elif file_format == 'jsonl':
+        products = iter_products_jsonl(stream)
+    else:
+        raise ValueError(f"Unsupported import format: {file_format}")
+    return inventory.add_products_bulk(products, chunk_size=chunk_size, commit_every=commit_every)
\ No newline at end of file
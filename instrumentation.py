@@ -0,0 +1,277 @@
+import bisect
+import contextvars
+import functools
+import inspect
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+# Upper bounds, in milliseconds, of the query latency histogram buckets (the last one is open-ended)
+LATENCY_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, float('inf')]
+
+# Queries at or above this many milliseconds go to the slow-query log
+SLOW_QUERY_MS = 200.0
+
+# Number of recent slow queries kept for display
+SLOW_LOG_SIZE = 200
+
+# Label used for queries issued outside any InventorySystem method
+UNATTRIBUTED = '-'
+
+slow_query_logger = logging.getLogger('inventory.slow_queries')
+
+_current_method = contextvars.ContextVar('inventory_method', default=None)
+
+
+@contextmanager
+def operation(name: str):
+    """Attribute the queries run inside the block to name, unless an outer operation already is."""
+    token = _current_method.set(name) if _current_method.get() is None else None
+    try:
+        yield
+    finally:
+        if token is not None:
+            _current_method.reset(token)
+
+
+def instrument_methods(cls):
+    """Class decorator: every public method attributes its queries to its own name."""
+    for name, value in list(vars(cls).items()):
+        if inspect.isfunction(value) and not name.startswith('_'):
+            setattr(cls, name, _attributed(value, name))
+    return cls
+
+
+def _attributed(method: Callable, name: str) -> Callable:
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        with operation(name):
+            return method(*args, **kwargs)
+    return wrapper
+
+
+class QueryStats:
+    """Running totals and a latency histogram for one (method, shard) pair."""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.rows = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS_MS)
+
+    def add(self, elapsed_ms: float, rows: int, error: bool):
+        self.count += 1
+        self.errors += error
+        self.rows += rows
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)] += 1
+
+    def percentile(self, percent: float) -> Optional[float]:
+        """Upper bound of the histogram bucket holding the given percentile (capped at the maximum seen)."""
+        if not self.count:
+            return None
+        rank = percent / 100 * self.count
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS_MS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max_ms)
+        return self.max_ms
+
+
+class QueryInstrumentation:
+    """Collects timings, row counts and errors of every query, keyed by (method, shard).
+
+    Queries slower than slow_query_ms are logged to the 'inventory.slow_queries'
+    logger and kept in a bounded in-memory list. Trace hooks are called with
+    one event dict per query (method, shard, statement, elapsed_ms, rows, error).
+    """
+
+    def __init__(self, slow_query_ms: float = SLOW_QUERY_MS, slow_log_size: int = SLOW_LOG_SIZE):
+        self.slow_query_ms = slow_query_ms
+        self._stats = {}
+        self._slow = deque(maxlen=slow_log_size)
+        self._hooks = []
+        self._lock = threading.Lock()
+
+    def add_trace_hook(self, hook: Callable[[Dict], None]):
+        self._hooks.append(hook)
+
+    def remove_trace_hook(self, hook: Callable[[Dict], None]):
+        self._hooks.remove(hook)
+
+    def record(self, shard: str, statement: str, elapsed_ms: float, rows: int, error: Optional[str] = None):
+        method = _current_method.get() or UNATTRIBUTED
+        with self._lock:
+            stats = self._stats.get((method, shard))
+            if stats is None:
+                stats = self._stats[(method, shard)] = QueryStats()
+            stats.add(elapsed_ms, rows, error is not None)
+        event = None
+        if elapsed_ms >= self.slow_query_ms:
+            event = self._event(method, shard, statement, elapsed_ms, rows, error)
+            self._slow.append(event)
+            slow_query_logger.warning("Slow query (%.1f ms) in %s on %s: %s", elapsed_ms, method, shard, event['statement'])
+        for hook in list(self._hooks):
+            try:
+                hook(event or self._event(method, shard, statement, elapsed_ms, rows, error))
+            except Exception:
+                # A broken tracing hook must never fail the query it observes
+                pass
+
+    @staticmethod
+    def _event(method: str, shard: str, statement: str, elapsed_ms: float, rows: int, error: Optional[str]) -> Dict:
+        return {
+            'time': time.time(),
+            'method': method,
+            'shard': shard,
+            'statement': " ".join(statement.split())[:500],
+            'elapsed_ms': elapsed_ms,
+            'rows': rows,
+            'error': error
+        }
+
+    def snapshot(self) -> List[Dict]:
+        """Per (method, shard) query counts, errors, rows and latency percentiles in milliseconds."""
+        with self._lock:
+            items = sorted(self._stats.items())
+            return [
+                {
+                    'Method': method,
+                    'Shard': shard,
+                    'Queries': stats.count,
+                    'Errors': stats.errors,
+                    'Rows': stats.rows,
+                    'TotalMs': stats.total_ms,
+                    'MeanMs': stats.total_ms / stats.count,
+                    'P50Ms': stats.percentile(50),
+                    'P95Ms': stats.percentile(95),
+                    'P99Ms': stats.percentile(99),
+                    'MaxMs': stats.max_ms
+                }
+                for (method, shard), stats in items
+            ]
+
+    def histograms(self) -> Dict[tuple, List[int]]:
+        """Raw latency bucket counts per (method, shard), aligned with LATENCY_BUCKETS_MS."""
+        with self._lock:
+            return {key: list(stats.buckets) for key, stats in self._stats.items()}
+
+    def slow_queries(self) -> List[Dict]:
+        """The most recent slow queries, newest first."""
+        return list(reversed(self._slow))
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self._slow.clear()
+
+
+class InstrumentedCursor:
+    """Cursor wrapper that times each statement, including the fetches that read its result."""
+
+    def __init__(self, cursor, shard: str, instrumentation: QueryInstrumentation):
+        self._cursor = cursor
+        self._shard = shard
+        self._instrumentation = instrumentation
+        self._statement = None
+        self._elapsed = 0.0
+        self._rows = 0
+        self._fetched = False
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def _finish(self):
+        if self._statement is not None:
+            rows = self._rows if self._fetched else max(self._cursor.rowcount, 0)
+            self._instrumentation.record(self._shard, self._statement, self._elapsed * 1000, rows)
+            self._statement = None
+
+    def _run(self, statement: str, call: Callable, *args):
+        self._finish()
+        started = time.perf_counter()
+        try:
+            result = call(*args)
+        except Exception as e:
+            self._instrumentation.record(self._shard, statement, (time.perf_counter() - started) * 1000, 0,
+                                         f"{type(e).__name__}: {str(e)}")
+            raise
+        self._statement, self._elapsed, self._rows, self._fetched = statement, time.perf_counter() - started, 0, False
+        return result
+
+    def _timed_fetch(self, call: Callable, *args):
+        started = time.perf_counter()
+        result = call(*args)
+        self._elapsed += time.perf_counter() - started
+        self._fetched = True
+        return result
+
+    def execute(self, statement: str, params=None):
+        return self._run(statement, self._cursor.execute, statement, params)
+
+    def executemany(self, statement: str, seq_params):
+        return self._run(statement, self._cursor.executemany, statement, seq_params)
+
+    def fetchone(self):
+        row = self._timed_fetch(self._cursor.fetchone)
+        self._rows += row is not None
+        return row
+
+    def fetchmany(self, size: int = 1):
+        rows = self._timed_fetch(self._cursor.fetchmany, size)
+        self._rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._timed_fetch(self._cursor.fetchall)
+        self._rows += len(rows)
+        return rows
+
+    def __iter__(self):
+        while True:
+            row = self.fetchone()
+            if row is None:
+                return
+            yield row
+
+    def close(self):
+        self._finish()
+        return self._cursor.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class InstrumentedConnection:
+    """Connection wrapper whose cursors report to a QueryInstrumentation."""
+
+    def __init__(self, conn, shard: str, instrumentation: QueryInstrumentation):
+        self._conn = conn
+        self._shard = shard
+        self._instrumentation = instrumentation
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        if name.startswith('_'):
+            super().__setattr__(name, value)
+        else:
+            setattr(self._conn, name, value)
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self._conn.cursor(*args, **kwargs), self._shard, self._instrumentation)
+
+
+# Process-wide metrics shared by every InventorySystem that is not given its own
+QUERY_METRICS = QueryInstrumentation()
\ No newline at end of file
@@ -0,0 +1,327 @@
+import hashlib
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+from instrumentation import operation
+
+# Records written to the central database per flush, seconds between time-triggered
+# flushes, and the size at which the spool rolls over to a new segment file
+SPOOL_BATCH_SIZE = 500
+SPOOL_FLUSH_INTERVAL = 1.0
+SPOOL_SEGMENT_BYTES = 64 * 1024 * 1024
+
+# Longest spool name LogSpoolCheckpoints.SpoolName can hold
+SPOOL_NAME_MAX = 100
+
+spool_logger = logging.getLogger('inventory.log_spool')
+
+
+def default_spool_name(directory: str) -> str:
+    """Checkpoint key of a spool directory: this host's name and the directory's absolute path."""
+    host, path = socket.gethostname(), os.path.abspath(directory)
+    name = f"{host}:{path}"
+    if len(name) > SPOOL_NAME_MAX:
+        name = f"{host[:SPOOL_NAME_MAX - 41]}:{hashlib.sha1(path.encode('utf-8')).hexdigest()}"
+    return name
+
+
+class LogSpool:
+    """Write-behind pipeline for central InventoryLogs rows and ProductDirectory changes.
+
+    Records are appended as JSON lines to local segment files and a background
+    thread copies them to the central database in multi-row batches, either
+    when batch_size records are waiting or every flush_interval seconds. The
+    flushed position is stored in LogSpoolCheckpoints in the same transaction
+    as the batch, so a restart replays exactly the records that were not yet
+    written.
+
+    The checkpoint is keyed by name, by default this host and the directory's
+    absolute path (see default_spool_name), so spools on different hosts
+    never share one; pass a name to keep the checkpoint across a move.
+    """
+
+    def __init__(self, directory: str, central_pool, name: Optional[str] = None,
+                 batch_size: int = SPOOL_BATCH_SIZE, flush_interval: float = SPOOL_FLUSH_INTERVAL,
+                 segment_bytes: int = SPOOL_SEGMENT_BYTES, fsync: bool = False):
+        self.directory = directory
+        self.central_pool = central_pool
+        self.name = name or default_spool_name(directory)
+        # Segment files keep the directory's name as their prefix unless the spool is named explicitly
+        self._prefix = name or os.path.basename(os.path.abspath(directory))
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._stop = threading.Event()
+        self._thread = None
+
+        self._flushed_records = 0
+        self._flushed_batches = 0
+        self._failed_flushes = 0
+        self._last_flush_at = None
+        self._last_error = None
+        # Set when the spool could not resume at its checkpoint; unlike last_error, flushes keep it
+        self._recovery_note = None
+
+        os.makedirs(directory, exist_ok=True)
+        self._read_segment, self._read_offset = self._load_checkpoint()
+        segments = self._segments()
+        for segment in segments:
+            if segment < self._read_segment:
+                os.remove(self._segment_path(segment))
+        self._segment = max(segments + [self._read_segment])
+        self._file = self._open_segment(self._segment, repair=True)
+        self._pending_records = self._count_pending()
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"{self._prefix}-{segment:08d}.jsonl")
+
+    def _segments(self) -> List[int]:
+        prefix, suffix = f"{self._prefix}-", ".jsonl"
+        return sorted(
+            int(filename[len(prefix):-len(suffix)])
+            for filename in os.listdir(self.directory)
+            if filename.startswith(prefix) and filename.endswith(suffix)
+        )
+
+    def _open_segment(self, segment: int, repair: bool = False):
+        path = self._segment_path(segment)
+        if repair and os.path.exists(path):
+            # Drop a half-written last line left behind by a crash
+            with open(path, 'rb+') as f:
+                data = f.read()
+                end = data.rfind(b'\n') + 1
+                if end != len(data):
+                    f.truncate(end)
+        return open(path, 'ab')
+
+    def _load_checkpoint(self) -> Tuple[int, int]:
+        with self.central_pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT Segment, SegmentOffset FROM LogSpoolCheckpoints WHERE SpoolName = %s",
+                    (self.name,)
+                )
+                row = cur.fetchone()
+        if row:
+            segment, offset = int(row[0]), int(row[1])
+            path = self._segment_path(segment)
+            if offset <= (os.path.getsize(path) if os.path.exists(path) else 0):
+                return segment, offset
+            # The files the checkpoint points into are gone (e.g. the directory was lost); resuming
+            # at its offset in newer files would skip or garble records, so start from their beginning
+            self._recovery_note = (f"{self.name}: checkpoint ({segment}, {offset}) is past the end of the "
+                                   f"spool files; replaying from the start")
+            spool_logger.warning("Log spool %s", self._recovery_note)
+        segments = self._segments()
+        return (segments[0] if segments else 1), 0
+
+    def _count_pending(self) -> int:
+        count = 0
+        segment, offset = self._read_segment, self._read_offset
+        while segment <= self._segment:
+            path = self._segment_path(segment)
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    f.seek(offset)
+                    count += sum(1 for _ in f)
+            segment, offset = segment + 1, 0
+        return count
+
+    def start(self):
+        """Start the background flusher thread."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f"log-spool-{self.name}", daemon=True)
+            self._thread.start()
+
+    def append(self, logs: Iterable[Tuple[str, str, int]], directory_changes: Iterable[Tuple[str, Optional[str]]] = ()):
+        """Durably spool log rows (ProductID, ChangeType, QuantityChanged) and directory changes (ProductID, shard or None)."""
+        now = time.time()
+        lines = [
+            json.dumps({'t': 'log', 'p': product_id, 'c': change_type, 'q': quantity, 'ts': now})
+            for product_id, change_type, quantity in logs
+        ]
+        lines += [
+            json.dumps({'t': 'dir', 'p': product_id, 's': shard, 'ts': now})
+            for product_id, shard in directory_changes
+        ]
+        if not lines:
+            return
+        data = ('\n'.join(lines) + '\n').encode('utf-8')
+        with self._lock:
+            self._file.write(data)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            if self._file.tell() >= self.segment_bytes:
+                self._file.close()
+                self._segment += 1
+                self._file = self._open_segment(self._segment)
+            self._pending_records += len(lines)
+            if self._pending_records >= self.batch_size:
+                self._wakeup.notify()
+
+    def _read_batch(self) -> Tuple[List[Dict], int, int]:
+        """Read up to batch_size complete records after the checkpoint, returning them and the new position."""
+        with self._lock:
+            writer_segment = self._segment
+        records = []
+        segment, offset = self._read_segment, self._read_offset
+        while len(records) < self.batch_size:
+            path = self._segment_path(segment)
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    f.seek(offset)
+                    while len(records) < self.batch_size:
+                        line = f.readline()
+                        if not line.endswith(b'\n'):
+                            break
+                        records.append(json.loads(line))
+                        offset += len(line)
+                    at_end = not f.read(1)
+            else:
+                at_end = True
+            if len(records) >= self.batch_size or segment >= writer_segment or not at_end:
+                break
+            segment, offset = segment + 1, 0
+        return records, segment, offset
+
+    @staticmethod
+    def _write_records(cur, records: List[Dict]):
+        logs = [
+            (r['p'], r['c'], r['q'], datetime.fromtimestamp(r['ts']).strftime('%Y-%m-%d %H:%M:%S'))
+            for r in records if r['t'] == 'log'
+        ]
+        if logs:
+            cur.executemany(
+                """INSERT INTO InventoryLogs (ProductID, ChangeType, QuantityChanged, LogTimestamp)
+                VALUES (%s, %s, %s, %s)""",
+                logs
+            )
+        # Directory changes are applied in order, so only each product's last change matters
+        latest = {}
+        for r in records:
+            if r['t'] == 'dir':
+                latest[r['p']] = r['s']
+        upserts = [(product_id, shard) for product_id, shard in latest.items() if shard is not None]
+        deletes = [(product_id,) for product_id, shard in latest.items() if shard is None]
+        if upserts:
+            cur.executemany(
+                """INSERT INTO ProductDirectory (ProductID, Shard) VALUES (%s, %s)
+                ON DUPLICATE KEY UPDATE Shard = VALUES(Shard)""",
+                upserts
+            )
+        if deletes:
+            cur.executemany("DELETE FROM ProductDirectory WHERE ProductID = %s", deletes)
+
+    def _flush_batch(self) -> Optional[int]:
+        """Copy one batch of spooled records to the central database.
+
+        Returns the number of records written, or None when there was nothing to flush.
+        """
+        with self._flush_lock:
+            records, segment, offset = self._read_batch()
+            if (segment, offset) == (self._read_segment, self._read_offset):
+                return None
+            with operation('log_spool_flush'), self.central_pool.connection() as conn:
+                try:
+                    with conn.cursor() as cur:
+                        self._write_records(cur, records)
+                        cur.execute(
+                            """INSERT INTO LogSpoolCheckpoints (SpoolName, Segment, SegmentOffset) VALUES (%s, %s, %s)
+                            ON DUPLICATE KEY UPDATE Segment = VALUES(Segment), SegmentOffset = VALUES(SegmentOffset)""",
+                            (self.name, segment, offset)
+                        )
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+            for finished in range(self._read_segment, segment):
+                if os.path.exists(self._segment_path(finished)):
+                    os.remove(self._segment_path(finished))
+            self._read_segment, self._read_offset = segment, offset
+            with self._lock:
+                self._pending_records -= len(records)
+                self._flushed_records += len(records)
+                self._flushed_batches += 1
+                self._last_flush_at = time.time()
+            return len(records)
+
+    def flush(self) -> int:
+        """Synchronously write every pending record to the central database."""
+        total = 0
+        while True:
+            written = self._flush_batch()
+            if written is None:
+                return total
+            total += written
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self._lock:
+                self._wakeup.wait_for(
+                    lambda: self._pending_records >= self.batch_size or self._stop.is_set(),
+                    timeout=self.flush_interval
+                )
+            try:
+                self.flush()
+                with self._lock:
+                    self._last_error = None
+            except Exception as e:
+                with self._lock:
+                    self._failed_flushes += 1
+                    self._last_error = str(e)
+                # Back off before retrying; the records stay in the spool until a flush succeeds
+                self._stop.wait(self.flush_interval)
+
+    def _oldest_pending_timestamp(self) -> Optional[float]:
+        path = self._segment_path(self._read_segment)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            f.seek(self._read_offset)
+            line = f.readline()
+        return json.loads(line)['ts'] if line.endswith(b'\n') else None
+
+    def metrics(self) -> Dict:
+        """Current spool backlog, flush lag in seconds and flush counters."""
+        with self._flush_lock:
+            oldest = self._oldest_pending_timestamp() if self._pending_records else None
+        with self._lock:
+            return {
+                'pending_records': self._pending_records,
+                'flush_lag_seconds': time.time() - oldest if oldest is not None else 0.0,
+                'flushed_records': self._flushed_records,
+                'flushed_batches': self._flushed_batches,
+                'failed_flushes': self._failed_flushes,
+                'last_flush_at': self._last_flush_at,
+                'last_error': self._last_error,
+                'recovery_note': self._recovery_note,
+                'segment': self._segment
+            }
+
+    def close(self):
+        """Stop the flusher, write what is still pending if possible and close the spool file."""
+        self._stop.set()
+        with self._lock:
+            self._wakeup.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        try:
+            self.flush()
+        except Exception as e:
+            # Anything left over is replayed the next time the spool is opened
+            with self._lock:
+                self._last_error = str(e)
+        with self._lock:
+            self._file.close()
\ No newline at end of file
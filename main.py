@@ -1,6 +1,24 @@
-import mysql.connector
-from typing import List, Dict, Optional
+from collections import OrderedDict
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager, nullcontext, ExitStack
+from datetime import datetime, timedelta
+from typing import Any, Callable, Iterable, Iterator, List, Dict, Optional, Tuple
+import contextvars
+import heapq
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
 import uuid
+from backends import StorageBackend, build_backend
+from change_feed import ChangeFeed, FEED_BATCH_SIZE
+from instrumentation import QueryInstrumentation, InstrumentedConnection, QUERY_METRICS, instrument_methods, operation
+from log_spool import LogSpool
+from sharding import ShardMap, build_shard_map, shard_map_from_spec
 
 # Configuration for MySQL databases (all within the same XAMPP MySQL instance)
 DB_CONFIG = {
@@ -16,11 +34,482 @@ PRICE_RANGES = {
     'high_price': (500, float('inf'))
 }
 
+# Every database other than central holds products; add a DB_CONFIG entry to add a shard
+PRODUCT_SHARDS = [shard for shard in DB_CONFIG if shard != 'central']
+
+# Where the databases in DB_CONFIG live: 'mysql' (the server in DB_CONFIG) or 'sqlite'
+# (embedded, one file per database under SQLITE_DIR, named after its 'database' entry)
+STORAGE_BACKEND = 'mysql'
+SQLITE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# How products are placed on PRODUCT_SHARDS: 'price_range' (PRICE_RANGES),
+# 'hash' or 'consistent_hash' (by ProductID, see sharding.py). Once rebalance.py has stored
+# a shard map in the central ShardMapState table, every process uses that one instead
+SHARDING_STRATEGY = 'price_range'
+
+# Seconds an InventorySystem keeps the shard map it read from ShardMapState, and seconds
+# before a failed read (e.g. no free central connection) is tried again
+SHARD_MAP_TTL = 5.0
+SHARD_MAP_RETRY = 0.5
+
+PRODUCT_COLUMNS = ['ProductID', 'ProductName', 'Description', 'Price', 'StockQuantity',
+                   'CategoryID', 'SupplierID', 'DateAdded', 'LastUpdated']
+
+PRODUCT_SELECT = """SELECT p.*, c.CategoryName, s.SupplierName
+    FROM Products p
+    LEFT JOIN Categories c ON p.CategoryID = c.CategoryID
+    LEFT JOIN Suppliers s ON p.SupplierID = s.SupplierID"""
+
+# Keyset pagination orders: the columns each listing order sorts on, ending with a unique tie-breaker
+LISTING_ORDERS = {
+    'ProductID': ('ProductID',),
+    'Price': ('Price', 'ProductID')
+}
+
+# Rows fetched per shard round trip when streaming product listings
+LISTING_BATCH_SIZE = 500
+
+# Full-text index searched by search_products and the Products columns it covers (see database.sql)
+SEARCH_INDEX = ('FT_Products_Text', ['ProductName', 'Description'])
+
+# search_products modes: 'keywords' matches words starting with each query term in the name or
+# description, ranked by relevance; 'name_prefix' matches names starting with the query, in name order
+SEARCH_MODES = ('keywords', 'name_prefix')
+
+# Results per search_products page
+SEARCH_PAGE_SIZE = 20
+
+# Deepest search result served; each shard returns at most this many candidates per page
+SEARCH_MAX_RESULTS = 1000
+
+# Rows per multi-row INSERT in add_products_bulk
+BULK_CHUNK_SIZE = 1000
+
+# Groupings supported by aggregate_products and the Products column each groups on (None: the shard itself)
+AGGREGATE_GROUPS = {
+    'category': 'CategoryID',
+    'supplier': 'SupplierID',
+    'shard': None
+}
+
+# Products with this many units or fewer count as low stock
+LOW_STOCK_THRESHOLD = 10
+
+# Days InventoryLogs keeps individual rows before compaction rolls them into InventoryLogDaily
+LOG_RETENTION_DAYS = 90
+
+# InventoryLogs rows rolled up and deleted per compaction transaction
+LOG_COMPACTION_BATCH = 5000
+
+# Monthly InventoryLogs partitions kept created ahead of the current month (MySQL)
+LOG_PARTITION_MONTHS_AHEAD = 3
+
+# Default row limit of the history and audit queries
+LOG_QUERY_LIMIT = 500
+
+# Folds InventoryLogs rows into InventoryLogDaily; {ids} is a placeholder list of LogIDs
+LOG_ROLLUP_UPSERT = """INSERT INTO InventoryLogDaily (ProductID, LogDate, ChangeType, Changes, QuantityChanged)
+SELECT ProductID, DATE(LogTimestamp), ChangeType, COUNT(*), SUM(QuantityChanged) FROM InventoryLogs
+WHERE LogTimestamp < %s AND LogID IN ({ids}) GROUP BY ProductID, DATE(LogTimestamp), ChangeType
+ON DUPLICATE KEY UPDATE Changes = Changes + VALUES(Changes), QuantityChanged = QuantityChanged + VALUES(QuantityChanged)"""
+
+# Result formats of the bulk read paths: dicts per row, or typed columns
+# ('numpy' arrays or a pandas 'dataframe', see columnar.py)
+RESULT_FORMATS = ('rows', 'numpy', 'dataframe')
+
+# Maximum number of ProductID -> shard entries kept in memory
+DIRECTORY_CACHE_SIZE = 100000
+
+class ShardDirectoryCache:
+    """In-process LRU cache in front of the central ProductDirectory table."""
+
+    def __init__(self, max_size: int = DIRECTORY_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, product_id: str) -> Optional[str]:
+        with self._lock:
+            shard = self._entries.get(product_id)
+            if shard is not None:
+                self._entries.move_to_end(product_id)
+            return shard
+
+    def put(self, product_id: str, shard: str):
+        with self._lock:
+            self._entries[product_id] = shard
+            self._entries.move_to_end(product_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, product_id: str):
+        with self._lock:
+            self._entries.pop(product_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Tables copied to every product shard: key column and all columns
+REFERENCE_TABLES = {
+    'Categories': ('CategoryID', ['CategoryID', 'CategoryName']),
+    'Suppliers': ('SupplierID', ['SupplierID', 'SupplierName', 'ContactInfo'])
+}
+
+# Seconds the replicated Categories/Suppliers tables are served from memory
+REFERENCE_CACHE_TTL = 300.0
+
+class ReferenceDataCache:
+    """TTL cache for the replicated reference tables (Categories, Suppliers).
+
+    Every table has a version number that invalidate() bumps. A load that was
+    started before an invalidation is returned to its caller but not cached,
+    so a concurrent write can never be hidden by an older read.
+    """
+
+    def __init__(self, ttl: float = REFERENCE_CACHE_TTL):
+        self.ttl = ttl
+        self._entries = {}
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, table: str, loader: Callable[[], List[Dict]]) -> List[Dict]:
+        with self._lock:
+            entry = self._entries.get(table)
+            version = self._versions.get(table, 0)
+            if entry is not None and time.monotonic() - entry['loaded_at'] < self.ttl:
+                return entry['rows']
+        rows = loader()
+        with self._lock:
+            if self._versions.get(table, 0) == version:
+                self._entries[table] = {'rows': rows, 'by_id': None, 'loaded_at': time.monotonic()}
+        return rows
+
+    def lookup(self, table: str, key: str, loader: Callable[[], List[Dict]]) -> Dict[Any, Dict]:
+        """Rows of a table keyed by their ID column, built once per cached load."""
+        rows = self.get(table, loader)
+        with self._lock:
+            entry = self._entries.get(table)
+            if entry is not None and entry['rows'] is rows:
+                if entry['by_id'] is None:
+                    entry['by_id'] = {row[key]: row for row in rows}
+                return entry['by_id']
+        return {row[key]: row for row in rows}
+
+    def invalidate(self, table: Optional[str] = None):
+        with self._lock:
+            tables = [table] if table is not None else list(self._entries)
+            for name in tables:
+                self._versions[name] = self._versions.get(name, 0) + 1
+                self._entries.pop(name, None)
+
+
+# ShardStats rows each shard's writers spread their deltas over, so concurrent
+# transactions rarely queue on the same row
+SHARD_STATS_SLOTS = 16
+
+# Adds deltas to one ShardStats slot; {table} may be qualified with another shard's database and
+# {source} is a VALUES list or SELECT of (Slot, ProductCount, TotalUnits, StockValue, MinPrice, MaxPrice)
+SHARD_STATS_UPSERT = """INSERT INTO {table} (Slot, ProductCount, TotalUnits, StockValue, MinPrice, MaxPrice) {source}
+ON DUPLICATE KEY UPDATE ProductCount = ProductCount + VALUES(ProductCount),
+    TotalUnits = TotalUnits + VALUES(TotalUnits), StockValue = StockValue + VALUES(StockValue),
+    MinPrice = LEAST(COALESCE(MinPrice, VALUES(MinPrice)), COALESCE(VALUES(MinPrice), MinPrice)),
+    MaxPrice = GREATEST(COALESCE(MaxPrice, VALUES(MaxPrice)), COALESCE(VALUES(MaxPrice), MaxPrice))"""
+
+# Connections kept per database, seconds a caller waits for a free one, and
+# seconds a connection may sit idle before it is pinged again on checkout
+POOL_SIZE = 8
+POOL_TIMEOUT = 30.0
+POOL_PING_INTERVAL = 30.0
+
+class ShardConnectionPool:
+    """Bounded, thread-safe pool of connections to one database in DB_CONFIG.
+
+    Connections are opened on demand up to size, health-checked when they have
+    been idle for a while, rolled back when returned and replaced when broken.
+    """
+
+    def __init__(self, shard: str, size: int = POOL_SIZE, timeout: float = POOL_TIMEOUT, min_size: int = 0,
+                 instrumentation: Optional[QueryInstrumentation] = None, backend: Optional[StorageBackend] = None):
+        self.shard = shard
+        self.size = size
+        self.timeout = timeout
+        self.instrumentation = instrumentation
+        self.backend = backend or build_backend('mysql', DB_CONFIG)
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._closed = False
+        for _ in range(min(min_size, size)):
+            self._idle.put((self._open(), time.monotonic()))
+
+    def _open(self):
+        conn = self.backend.connect(self.shard)
+        if self.instrumentation is not None:
+            conn = InstrumentedConnection(conn, self.shard, self.instrumentation)
+        return conn
+
+    @staticmethod
+    def _discard(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def borrow(self, timeout: Optional[float] = None):
+        """Check a connection out of the pool, opening or reconnecting one if needed.
+
+        Waits up to timeout seconds (the pool's timeout when None) for a free connection.
+        """
+        if self._closed:
+            raise Exception(f"Connection pool for {self.shard} is closed")
+        if not self._slots.acquire(timeout=self.timeout if timeout is None else timeout):
+            raise Exception(f"Timed out waiting for a {self.shard} connection")
+        try:
+            try:
+                conn, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                return self._open()
+            if time.monotonic() - last_used > POOL_PING_INTERVAL:
+                try:
+                    conn.ping(reconnect=True, attempts=2)
+                except Exception:
+                    self._discard(conn)
+                    return self._open()
+            return conn
+        except Exception:
+            self._slots.release()
+            raise
+
+    def give_back(self, conn, healthy: bool = True):
+        """Return a borrowed connection; unhealthy connections are closed instead of reused."""
+        try:
+            if healthy and not self._closed:
+                try:
+                    # End any open transaction so the next borrower starts clean
+                    if conn.in_transaction:
+                        conn.rollback()
+                except Exception:
+                    healthy = False
+            if healthy and not self._closed:
+                self._idle.put((conn, time.monotonic()))
+            else:
+                self._discard(conn)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self, statement_timeout: Optional[float] = None, timeout: Optional[float] = None):
+        """Borrow a connection whose statements the server aborts after statement_timeout seconds (None: no limit)."""
+        conn = self.borrow(timeout)
+        healthy = True
+        try:
+            # The limit is a session setting, so it is only changed when this borrower wants a different one
+            if getattr(conn, 'statement_timeout', None) != statement_timeout:
+                self.backend.set_statement_timeout(conn, statement_timeout)
+                conn.statement_timeout = statement_timeout
+            yield conn
+        except Exception:
+            try:
+                healthy = conn.is_connected()
+            except Exception:
+                healthy = False
+            raise
+        finally:
+            self.give_back(conn, healthy)
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+
+# Per-shard time budget, in seconds, for scatter-gather reads, counted from when the shard's task starts
+SCATTER_TIMEOUT = 10.0
+
+# Seconds between checks for shard tasks that are still queued behind busy workers
+SCATTER_QUEUE_POLL = 0.05
+
+class ScatterGatherExecutor:
+    """Send one query to several shards at once and gather the per-shard results.
+
+    Every task borrows its own connection from the shard's pool, so concurrent
+    shard queries never share a socket. The default worker count gives every
+    pooled connection of every shard a thread, so concurrent callers do not
+    queue behind each other.
+    """
+
+    def __init__(self, pools: Dict[str, ShardConnectionPool], max_workers: int = POOL_SIZE * len(PRODUCT_SHARDS),
+                 timeout: float = SCATTER_TIMEOUT):
+        self.pools = pools
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='scatter')
+
+    def _run_on_shard(self, shard: str, query: Callable, started: Dict[str, float], timeout: Optional[float], *args):
+        started[shard] = time.monotonic()
+        # The server aborts a statement that outlives the budget, so a task the caller gave up on frees its worker
+        with self.pools[shard].connection(statement_timeout=timeout) as conn:
+            return query(conn, shard, *args)
+
+    @staticmethod
+    def _wait(futures: Dict, started: Dict[str, float], timeout: Optional[float], stop_on_error: bool) -> Tuple[set, set]:
+        """Wait for the shard tasks, giving each one timeout seconds from the moment it started running.
+
+        Returns (done, not done); stops early at the first failure or timeout when stop_on_error.
+        """
+        done, pending, expired = set(), set(futures), set()
+        while pending:
+            now = time.monotonic()
+            for future in list(pending):
+                shard = futures[future]
+                if timeout is not None and shard in started and started[shard] + timeout <= now and not future.done():
+                    pending.discard(future)
+                    expired.add(future)
+            if not pending or (expired and stop_on_error):
+                break
+            wait_for = None
+            if timeout is not None:
+                deadlines = [started[futures[future]] + timeout for future in pending if futures[future] in started]
+                if len(deadlines) < len(pending):
+                    # Tasks still queued have no deadline yet; look again shortly to see whether they have started
+                    deadlines.append(now + SCATTER_QUEUE_POLL)
+                wait_for = max(min(deadlines) - now, 0)
+            finished, pending = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+            done |= finished
+            if stop_on_error and any(future.exception() is not None for future in finished):
+                break
+        return done, pending | expired
+
+    def run(self, shards: List[str], query: Callable, args: Optional[Dict[str, tuple]] = None,
+            timeout: Optional[float] = None, partial: bool = False,
+            conns: Optional[Dict] = None) -> Tuple[Dict[str, Any], Dict[str, str]]:
+        """Run query(conn, shard, *args[shard]) on every shard concurrently.
+
+        Returns (results, errors) keyed by shard. With partial=False the first
+        failing or timed-out shard raises; with partial=True its error is
+        reported in errors and the other shards' results are still returned.
+        Each shard's timeout counts from when its task starts running, and
+        the server is asked to abort the task's statements at the same limit.
+
+        conns optionally supplies already-borrowed connections (e.g. for a
+        multi-step transaction); those tasks are always awaited without a
+        timeout so the connections are idle again when run returns.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        args = args or {}
+        started = {}
+        # Each task runs in a copy of the caller's context so its queries are attributed to the caller's method
+        if conns is not None:
+            futures = {
+                self._executor.submit(contextvars.copy_context().run, query, conns[shard], shard,
+                                      *args.get(shard, ())): shard
+                for shard in shards
+            }
+            timeout, partial_wait = None, True
+        else:
+            futures = {
+                self._executor.submit(contextvars.copy_context().run, self._run_on_shard, shard, query,
+                                      started, timeout, *args.get(shard, ())): shard
+                for shard in shards
+            }
+            partial_wait = partial
+        done, pending = self._wait(futures, started, timeout, stop_on_error=not partial_wait)
+
+        results, errors = {}, {}
+        for future in done:
+            shard = futures[future]
+            if future.exception() is not None:
+                errors[shard] = str(future.exception())
+            else:
+                results[shard] = future.result()
+        if errors and not partial:
+            shard, message = next(iter(errors.items()))
+            for future in pending:
+                future.cancel()
+            raise Exception(f"Query failed on shard {shard}: {message}")
+
+        for future in pending:
+            future.cancel()
+            errors[futures[future]] = f"timed out after {timeout}s"
+        if errors and not partial:
+            shard, message = next(iter(errors.items()))
+            raise Exception(f"Query failed on shard {shard}: {message}")
+        return results, errors
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class CentralLogError(Exception):
+    """A product change was committed on its shard, but its log rows or directory changes could not be recorded."""
+
+
+@instrument_methods
 class InventorySystem:
-    def __init__(self):
-        self.connections = {}
-        for shard, config in DB_CONFIG.items():
-            self.connections[shard] = mysql.connector.connect(**config)
+    def __init__(self, pool_size: int = POOL_SIZE, scatter_workers: Optional[int] = None,
+                 log_spool_dir: Optional[str] = None, log_spool_name: Optional[str] = None,
+                 shard_map: Optional[ShardMap] = None,
+                 instrumentation: Optional[QueryInstrumentation] = None, backend: Optional[StorageBackend] = None,
+                 lazy_connections: bool = False):
+        self.backend = backend or build_backend(STORAGE_BACKEND, DB_CONFIG, SQLITE_DIR, PRODUCT_SHARDS)
+        # Every query is timed per (method, shard); metrics are process-wide unless given their own collector
+        self.instrumentation = instrumentation or QUERY_METRICS
+        # One connection per database is opened up front so a bad DB_CONFIG fails here;
+        # with lazy_connections each database is only connected to when it is first used
+        self.pools = {}
+        try:
+            for shard in DB_CONFIG:
+                self.pools[shard] = ShardConnectionPool(shard, size=pool_size, min_size=0 if lazy_connections else 1,
+                                                        instrumentation=self.instrumentation, backend=self.backend)
+        except Exception:
+            for pool in self.pools.values():
+                pool.close()
+            raise
+        # The shard map and rebalancing flag in ShardMapState override this one, see _shard_layout
+        self._default_shard_map = shard_map or build_shard_map(SHARDING_STRATEGY, PRODUCT_SHARDS, PRICE_RANGES)
+        self._layout = (self._default_shard_map, False)
+        self._layout_spec = None
+        self._layout_loaded_at = None
+        self._layout_lock = threading.Lock()
+        self.directory_cache = ShardDirectoryCache()
+        self.reference_cache = ReferenceDataCache()
+        # By default one scatter worker per pooled shard connection
+        self.scatter = ScatterGatherExecutor(self.pools, max_workers=scatter_workers or pool_size * len(PRODUCT_SHARDS))
+        self._local = threading.local()
+        # Optional write-behind pipeline: log rows and directory changes go to a local spool
+        # and reach the central database in background batches
+        self.log_spool = None
+        if log_spool_dir is not None:
+            self.log_spool = LogSpool(log_spool_dir, self.pools['central'], name=log_spool_name)
+            self.log_spool.start()
+        if not lazy_connections:
+            self._shard_layout()
+
+    @property
+    def last_shard_errors(self) -> Dict[str, str]:
+        """Shards that failed or timed out during this thread's most recent partial read."""
+        return getattr(self._local, 'shard_errors', {})
+
+    @contextmanager
+    def _connections(self, *shards: str):
+        """Borrow one pooled connection per named database for the duration of an operation.
+
+        Connections are taken in DB_CONFIG order, so operations holding several
+        never wait on each other in a cycle. That only holds while nothing borrows
+        from the same pools inside the block: lookups that need another central
+        or shard connection (_resolve_product_shards, _probe_product_shards,
+        _find_product) have to run before it or after it.
+        """
+        with ExitStack() as stack:
+            conns = {}
+            for shard in DB_CONFIG:
+                if shard in shards:
+                    conns[shard] = stack.enter_context(self.pools[shard].connection())
+            yield conns
 
     def get_shard_for_price(self, price: float) -> str:
         """Determine the appropriate shard based on price."""
@@ -29,245 +518,1688 @@ class InventorySystem:
                 return shard
         raise ValueError("Price out of defined ranges")
 
-    def add_category(self, category_id: int, category_name: str) -> bool:
-        """Add a category to all shards."""
+    @staticmethod
+    def _xa_prepare(conn, shard: str, xid: str, sql: str, rows: List[tuple], chunk_size: int) -> int:
+        """Phase one: write the rows inside an XA branch and prepare it."""
+        with conn.cursor() as cur:
+            cur.execute("XA START %s", (xid,))
+            for i in range(0, len(rows), chunk_size):
+                cur.executemany(sql, rows[i:i + chunk_size])
+            cur.execute("XA END %s", (xid,))
+            cur.execute("XA PREPARE %s", (xid,))
+        return len(rows)
+
+    @staticmethod
+    def _xa_commit(conn, shard: str, xid: str):
+        with conn.cursor() as cur:
+            cur.execute("XA COMMIT %s", (xid,))
+
+    @staticmethod
+    def _xa_rollback(conn, shard: str, xid: str):
+        # The branch may be active, idle or prepared depending on where phase one stopped
+        with conn.cursor() as cur:
+            try:
+                cur.execute("XA END %s", (xid,))
+            except Exception:
+                pass
+            cur.execute("XA ROLLBACK %s", (xid,))
+
+    def _replicate_reference_rows(self, table: str, rows: List[tuple], upsert: bool,
+                                  chunk_size: int = BULK_CHUNK_SIZE) -> int:
+        """Write rows of a replicated table to every product shard atomically.
+
+        All shards are written in parallel inside XA branches; only when every
+        branch has prepared are they committed, otherwise all are rolled back.
+        """
+        key, columns = REFERENCE_TABLES[table]
+        sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})"
+        if upsert:
+            sql += " ON DUPLICATE KEY UPDATE " + ", ".join(f"{c} = VALUES({c})" for c in columns if c != key)
+        xid = f"{table.lower()}-{uuid.uuid4().hex}"
+        args = {shard: (xid,) for shard in PRODUCT_SHARDS}
+
+        # On SQLite the branches hold every shard file until they commit, like a multi-shard move
+        with self.backend.cross_shard_write(), self._connections(*PRODUCT_SHARDS) as conns:
+            try:
+                prepare_args = {shard: (xid, sql, rows, chunk_size) for shard in PRODUCT_SHARDS}
+                _, errors = self.scatter.run(PRODUCT_SHARDS, self._xa_prepare, prepare_args, conns=conns, partial=True)
+                if errors:
+                    self.scatter.run(PRODUCT_SHARDS, self._xa_rollback, args, conns=conns, partial=True)
+                    shard, message = next(iter(errors.items()))
+                    raise Exception(f"{shard}: {message}")
+
+                _, errors = self.scatter.run(PRODUCT_SHARDS, self._xa_commit, args, conns=conns, partial=True)
+                if errors:
+                    # Prepared branches survive; they can be finished with XA COMMIT after XA RECOVER
+                    raise Exception(
+                        f"transaction {xid} prepared on all shards but commit failed on "
+                        f"{', '.join(sorted(errors))}; run repair_reference_data() or XA RECOVER"
+                    )
+                return len(rows)
+            finally:
+                self.reference_cache.invalidate(table)
+
+    def _shard_layout(self) -> Tuple[ShardMap, bool]:
+        """The active shard map and whether a rebalance is moving rows, re-read from ShardMapState every SHARD_MAP_TTL seconds."""
+        loaded_at = self._layout_loaded_at
+        if loaded_at is not None and time.monotonic() - loaded_at < SHARD_MAP_TTL:
+            return self._layout
+        # One thread refreshes; the others keep using the current layout meanwhile
+        if not self._layout_lock.acquire(blocking=False):
+            return self._layout
         try:
-            for shard in ['low_price', 'mid_price', 'high_price']:
-                conn = self.connections[shard]
+            # Callers may already hold central connections (e.g. add_products_bulk), so after the
+            # first read a refresh never waits for one: a busy pool just means trying again soon
+            with self.pools['central'].connection(timeout=0 if loaded_at is not None else None) as conn:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT ShardMap, Rebalancing FROM ShardMapState WHERE StateID = 1")
+                    row = cur.fetchone()
+            if row is None:
+                self._layout, self._layout_spec = (self._default_shard_map, False), None
+            elif row[0] == self._layout_spec:
+                self._layout = (self._layout[0], bool(row[1]))
+            else:
+                self._layout, self._layout_spec = (shard_map_from_spec(json.loads(row[0])), bool(row[1])), row[0]
+            self._layout_loaded_at = time.monotonic()
+        except Exception:
+            # Keep placing rows by the current layout rather than failing the caller
+            self._layout_loaded_at = time.monotonic() - SHARD_MAP_TTL + SHARD_MAP_RETRY
+        finally:
+            self._layout_lock.release()
+        return self._layout
+
+    @property
+    def shard_map(self) -> ShardMap:
+        """The shard map products are placed by."""
+        return self._shard_layout()[0]
+
+    @property
+    def rebalancing(self) -> bool:
+        """Set while rows are being moved between layouts: reads then cover every shard unpruned."""
+        return self._shard_layout()[1]
+
+    def set_shard_map(self, shard_map: ShardMap, rebalancing: bool = False):
+        """Store the shard map for every InventorySystem; other processes pick it up within SHARD_MAP_TTL seconds."""
+        spec = json.dumps(shard_map.to_spec())
+        with self.pools['central'].connection() as conn:
+            try:
                 with conn.cursor() as cur:
                     cur.execute(
-                        "INSERT INTO Categories (CategoryID, CategoryName) VALUES (%s, %s)",
-                        (category_id, category_name)
+                        """INSERT INTO ShardMapState (StateID, ShardMap, Rebalancing) VALUES (1, %s, %s)
+                        ON DUPLICATE KEY UPDATE ShardMap = VALUES(ShardMap), Rebalancing = VALUES(Rebalancing)""",
+                        (spec, rebalancing)
                     )
                 conn.commit()
+            except Exception as e:
+                conn.rollback()
+                raise Exception(f"Failed to store shard map: {str(e)}")
+        with self._layout_lock:
+            self._layout, self._layout_spec = (shard_map, rebalancing), spec
+            self._layout_loaded_at = time.monotonic()
+
+    def shard_for_product(self, product_id: str, price: float) -> str:
+        """Determine the shard a product belongs on under the active shard map."""
+        return self.shard_map.shard_for(product_id, price)
+
+    def _shards_for_price_range(self, min_price: float, max_price: float) -> Dict[str, Tuple[float, float]]:
+        """Shards to query for a price range, with the price bounds to use on each.
+
+        Outside a rebalance, shards whose ShardStats price bounds miss the
+        range are skipped too (e.g. under hash sharding, where the map rules
+        out none). The bounds are read fresh: every product write widens them
+        in its own transaction, so they cover all committed rows, whichever
+        process wrote them. Shards that fail to answer are not pruned.
+        """
+        shard_map, rebalancing = self._shard_layout()
+        if rebalancing:
+            return {shard: (min_price, max_price) for shard in PRODUCT_SHARDS}
+        shards = shard_map.shards_for_price_range(min_price, max_price)
+        results, _ = self.scatter.run(list(shards), self._select_shard_stats, partial=True)
+        stats = {shard: shard_stats for shard, shard_stats in results.items() if shard_stats is not None}
+        return {
+            shard: bounds for shard, bounds in shards.items()
+            if shard not in stats or (
+                stats[shard]['MinPrice'] is not None
+                and stats[shard]['MinPrice'] < max_price and stats[shard]['MaxPrice'] >= min_price
+            )
+        }
+
+    def add_category(self, category_id: int, category_name: str) -> bool:
+        """Add a category to all shards."""
+        try:
+            self._replicate_reference_rows('Categories', [(category_id, category_name)], upsert=False)
             return True
         except Exception as e:
-            for shard in ['low_price', 'mid_price', 'high_price']:
-                self.connections[shard].rollback()
             raise Exception(f"Failed to add category: {str(e)}")
 
     def add_supplier(self, supplier_id: int, supplier_name: str, contact_info: str) -> bool:
         """Add a supplier to all shards."""
         try:
-            for shard in ['low_price', 'mid_price', 'high_price']:
-                conn = self.connections[shard]
+            self._replicate_reference_rows('Suppliers', [(supplier_id, supplier_name, contact_info)], upsert=False)
+            return True
+        except Exception as e:
+            raise Exception(f"Failed to add supplier: {str(e)}")
+
+    def add_categories(self, categories: Iterable[Tuple[int, str]], chunk_size: int = BULK_CHUNK_SIZE) -> int:
+        """Insert or update many (CategoryID, CategoryName) rows on all shards in one distributed transaction."""
+        try:
+            return self._replicate_reference_rows('Categories', list(categories), upsert=True, chunk_size=chunk_size)
+        except Exception as e:
+            raise Exception(f"Failed to add categories: {str(e)}")
+
+    def add_suppliers(self, suppliers: Iterable[Tuple[int, str, str]], chunk_size: int = BULK_CHUNK_SIZE) -> int:
+        """Insert or update many (SupplierID, SupplierName, ContactInfo) rows on all shards in one distributed transaction."""
+        try:
+            return self._replicate_reference_rows('Suppliers', list(suppliers), upsert=True, chunk_size=chunk_size)
+        except Exception as e:
+            raise Exception(f"Failed to add suppliers: {str(e)}")
+
+    @staticmethod
+    def _checksum_reference_table(conn, shard: str, table: str) -> Tuple[int, int]:
+        """Row count and order-independent CRC of a replicated table on one shard."""
+        _, columns = REFERENCE_TABLES[table]
+        fields = ", ".join(f"{c}, ISNULL({c})" for c in columns)
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT COUNT(*), COALESCE(BIT_XOR(CRC32(CONCAT_WS('#', {fields}))), 0) FROM {table}")
+            count, checksum = cur.fetchone()
+            return int(count), int(checksum)
+
+    def verify_reference_data(self) -> Dict[str, Dict[str, Tuple[int, int]]]:
+        """Checksum Categories and Suppliers on every shard: {table: {shard: (row_count, checksum)}}."""
+        checksums = {}
+        for table in REFERENCE_TABLES:
+            args = {shard: (table,) for shard in PRODUCT_SHARDS}
+            checksums[table] = self._scatter_gather(PRODUCT_SHARDS, self._checksum_reference_table, args)
+        return checksums
+
+    @staticmethod
+    def _resync_reference_table(conn, shard: str, table: str, source_rows: List[tuple], chunk_size: int):
+        """Make one shard's copy of a replicated table identical to source_rows."""
+        key, columns = REFERENCE_TABLES[table]
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT {key} FROM {table}")
+            extra = {row[0] for row in cur.fetchall()} - {row[0] for row in source_rows}
+            upsert = (
+                f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})"
+                " ON DUPLICATE KEY UPDATE " + ", ".join(f"{c} = VALUES({c})" for c in columns if c != key)
+            )
+            for i in range(0, len(source_rows), chunk_size):
+                cur.executemany(upsert, source_rows[i:i + chunk_size])
+            if extra:
+                cur.executemany(f"DELETE FROM {table} WHERE {key} = %s", [(value,) for value in extra])
+        conn.commit()
+
+    def repair_reference_data(self, source_shard: Optional[str] = None,
+                              chunk_size: int = BULK_CHUNK_SIZE) -> Dict[str, List[str]]:
+        """Resync shards whose Categories/Suppliers checksums have drifted.
+
+        The source of truth is source_shard if given, otherwise the checksum
+        shared by most shards (ties go to the shard listed first in
+        PRODUCT_SHARDS). Returns the shards repaired per table.
+        """
+        repaired = {}
+        for table, checksums in self.verify_reference_data().items():
+            source = source_shard
+            if source is None:
+                votes = [sum(1 for other in checksums.values() if other == checksums[shard]) for shard in PRODUCT_SHARDS]
+                source = PRODUCT_SHARDS[votes.index(max(votes))]
+            drifted = [shard for shard in PRODUCT_SHARDS if checksums[shard] != checksums[source]]
+            if drifted:
+                _, columns = REFERENCE_TABLES[table]
+                with self.pools[source].connection() as conn:
+                    with conn.cursor() as cur:
+                        cur.execute(f"SELECT {', '.join(columns)} FROM {table}")
+                        source_rows = cur.fetchall()
+                args = {shard: (table, source_rows, chunk_size) for shard in drifted}
+                try:
+                    self._scatter_gather(drifted, self._resync_reference_table, args)
+                except Exception as e:
+                    raise Exception(f"Failed to repair {table}: {str(e)}")
+                finally:
+                    self.reference_cache.invalidate(table)
+            repaired[table] = drifted
+        return repaired
+
+    def _load_categories(self) -> List[Dict]:
+        with self.pools['low_price'].connection() as conn:  # Any shard will do since data is replicated
+            with conn.cursor(dictionary=True) as cur:
+                cur.execute("SELECT CategoryID, CategoryName FROM Categories ORDER BY CategoryID")
+                return cur.fetchall()
+
+    def _load_suppliers(self) -> List[Dict]:
+        with self.pools['low_price'].connection() as conn:  # Any shard will do since data is replicated
+            with conn.cursor(dictionary=True) as cur:
+                cur.execute("SELECT SupplierID, SupplierName FROM Suppliers ORDER BY SupplierID")
+                return cur.fetchall()
+
+    def get_all_categories(self, refresh: bool = False) -> List[Dict]:
+        """Retrieve all categories from one shard (since they are replicated), served from the reference cache."""
+        if refresh:
+            self.reference_cache.invalidate('Categories')
+        return list(self.reference_cache.get('Categories', self._load_categories))
+
+    def get_all_suppliers(self, refresh: bool = False) -> List[Dict]:
+        """Retrieve all suppliers from one shard (since they are replicated), served from the reference cache."""
+        if refresh:
+            self.reference_cache.invalidate('Suppliers')
+        return list(self.reference_cache.get('Suppliers', self._load_suppliers))
+
+    def get_category(self, category_id: int) -> Optional[Dict]:
+        """Look up a category by ID in the reference cache."""
+        return self.reference_cache.lookup('Categories', 'CategoryID', self._load_categories).get(category_id)
+
+    def get_supplier(self, supplier_id: int) -> Optional[Dict]:
+        """Look up a supplier by ID in the reference cache."""
+        return self.reference_cache.lookup('Suppliers', 'SupplierID', self._load_suppliers).get(supplier_id)
+
+    def _central_for_writes(self) -> Tuple[str, ...]:
+        """The central database is only borrowed by product writes when logs are not spooled."""
+        return () if self.log_spool is not None else ('central',)
+
+    @staticmethod
+    def _write_central_changes(central, logs: List[tuple], directory_changes: List[tuple] = ()):
+        """Stage InventoryLogs rows and ProductDirectory changes (shard None deletes) on a central transaction."""
+        with central.cursor() as cur_central:
+            if logs:
+                cur_central.executemany(
+                    """INSERT INTO InventoryLogs (ProductID, ChangeType, QuantityChanged)
+                    VALUES (%s, %s, %s)""",
+                    logs
+                )
+            upserts = [(product_id, shard) for product_id, shard in directory_changes if shard is not None]
+            deletes = [(product_id,) for product_id, shard in directory_changes if shard is None]
+            if upserts:
+                cur_central.executemany(
+                    """INSERT INTO ProductDirectory (ProductID, Shard) VALUES (%s, %s)
+                    ON DUPLICATE KEY UPDATE Shard = VALUES(Shard)""",
+                    upserts
+                )
+            if deletes:
+                cur_central.executemany("DELETE FROM ProductDirectory WHERE ProductID = %s", deletes)
+
+    def _stage_central_changes(self, conns: Dict, logs: List[tuple], directory_changes: List[tuple] = ()):
+        """Write central changes into the open central transaction, if this write borrowed one."""
+        if 'central' in conns:
+            self._write_central_changes(conns['central'], logs, directory_changes)
+
+    def _publish_central_changes(self, conns: Dict, logs: List[tuple], directory_changes: List[tuple] = (),
+                                 committed: str = "The change was committed"):
+        """After the shard commit: commit the central transaction, or hand the changes to the log spool.
+
+        The product change itself is already committed, so a failure here
+        raises CentralLogError, worded with committed, not a failed write.
+        """
+        try:
+            if 'central' in conns:
+                conns['central'].commit()
+            else:
+                self.log_spool.append(logs, directory_changes)
+        except Exception as e:
+            if 'central' in conns:
+                try:
+                    conns['central'].rollback()
+                except Exception:
+                    pass
+            raise CentralLogError(f"{committed}, but logging it failed: {str(e)}")
+
+    @staticmethod
+    def _adjust_shard_stats(cur, count: int, units: int, value: float, prices: Iterable[float] = (),
+                            database: Optional[str] = None):
+        """Add deltas to a random ShardStats slot inside the caller's transaction.
+
+        database names another shard reachable from the same connection; prices
+        are the prices written, which can only widen MinPrice/MaxPrice.
+        """
+        prices = [float(price) for price in prices]
+        cur.execute(
+            SHARD_STATS_UPSERT.format(table=f"{database}.ShardStats" if database else "ShardStats",
+                                      source="VALUES (%s, %s, %s, %s, %s, %s)"),
+            (random.randrange(SHARD_STATS_SLOTS), count, units, round(value, 2),
+             min(prices) if prices else None, max(prices) if prices else None)
+        )
+
+    def add_product(self, name: str, description: str, price: float, stock_quantity: int, category_id: int, supplier_id: int) -> str:
+        """Add a new product to the appropriate shard."""
+        product_id = str(uuid.uuid4())
+        shard = self.shard_for_product(product_id, price)
+        logs = [(product_id, 'stock_in', stock_quantity)]
+        directory_changes = [(product_id, shard)]
+        with self._connections(shard, *self._central_for_writes()) as conns:
+            conn = conns[shard]
+            try:
                 with conn.cursor() as cur:
                     cur.execute(
-                        "INSERT INTO Suppliers (SupplierID, SupplierName, ContactInfo) VALUES (%s, %s, %s)",
-                        (supplier_id, supplier_name, contact_info)
+                        """INSERT INTO Products (ProductID, ProductName, Description, Price, StockQuantity, CategoryID, SupplierID)
+                        VALUES (%s, %s, %s, %s, %s, %s, %s)""",
+                        (product_id, name, description, price, stock_quantity, category_id, supplier_id)
                     )
+                    self._adjust_shard_stats(cur, 1, stock_quantity, float(price) * stock_quantity, [price])
+                self._stage_central_changes(conns, logs, directory_changes)
                 conn.commit()
-            return True
-        except Exception as e:
-            for shard in ['low_price', 'mid_price', 'high_price']:
-                self.connections[shard].rollback()
-            raise Exception(f"Failed to add supplier: {str(e)}")
+            except Exception as e:
+                for conn in conns.values():
+                    conn.rollback()
+                raise Exception(f"Failed to add product: {str(e)}")
+            self.directory_cache.put(product_id, shard)
+            self._publish_central_changes(conns, logs, directory_changes, f"Product {product_id} was added")
+            return product_id
+
+    def add_products_bulk(self, products: Iterable[Dict], chunk_size: int = BULK_CHUNK_SIZE, commit_every: int = 1) -> int:
+        """Add many products, grouped by shard and written as multi-row inserts.
+
+        Each product is a dict of add_product arguments (name, description, price,
+        stock_quantity, category_id, supplier_id). Rows are buffered per target shard and
+        written chunk_size at a time together with their stock_in log rows; all
+        databases are committed after every commit_every chunks. The iterable is
+        consumed lazily. Returns the number of products added.
+        """
+        if chunk_size < 1 or commit_every < 1:
+            raise Exception("Failed to add products: chunk_size and commit_every must be at least 1")
+        buffers = {shard: [] for shard in PRODUCT_SHARDS}
+        logs, directory_changes = [], []
+        added = chunks = 0
+        # Open shard transactions are held across chunks, so on SQLite this is a multi-shard write
+        with self.backend.cross_shard_write(), self._connections(*self._central_for_writes(), *PRODUCT_SHARDS) as conns:
+            def insert_chunk(shard: str):
+                rows = buffers[shard]
+                with conns[shard].cursor() as cur:
+                    cur.executemany(
+                        """INSERT INTO Products (ProductID, ProductName, Description, Price, StockQuantity, CategoryID, SupplierID)
+                        VALUES (%s, %s, %s, %s, %s, %s, %s)""",
+                        rows
+                    )
+                    prices = [row[3] for row in rows]
+                    self._adjust_shard_stats(cur, len(rows), sum(row[4] or 0 for row in rows),
+                                             sum(float(row[3]) * (row[4] or 0) for row in rows),
+                                             [min(prices), max(prices)])
+                chunk_logs = [(row[0], 'stock_in', row[4]) for row in rows]
+                chunk_directory = [(row[0], shard) for row in rows]
+                self._stage_central_changes(conns, chunk_logs, chunk_directory)
+                logs.extend(chunk_logs)
+                directory_changes.extend(chunk_directory)
+                buffers[shard] = []
+
+            def commit():
+                nonlocal added
+                for shard in PRODUCT_SHARDS:
+                    conns[shard].commit()
+                added += len(logs)
+                committed_logs, committed_directory = list(logs), list(directory_changes)
+                logs.clear()
+                directory_changes.clear()
+                self._publish_central_changes(conns, committed_logs, committed_directory, f"{added} products were added")
+
+            try:
+                for product in products:
+                    product_id = str(uuid.uuid4())
+                    shard = self.shard_for_product(product_id, product['price'])
+                    buffers[shard].append((
+                        product_id, product['name'], product.get('description'), product['price'],
+                        product.get('stock_quantity', 0), product.get('category_id'), product.get('supplier_id')
+                    ))
+                    if len(buffers[shard]) >= chunk_size:
+                        insert_chunk(shard)
+                        chunks += 1
+                        if chunks % commit_every == 0:
+                            commit()
 
-    def get_all_categories(self) -> List[Dict]:
-        """Retrieve all categories from one shard (since they are replicated)."""
-        conn = self.connections['low_price']  # Any shard will do since data is replicated
+                for shard in PRODUCT_SHARDS:
+                    if buffers[shard]:
+                        insert_chunk(shard)
+                commit()
+                return added
+            except CentralLogError:
+                raise
+            except Exception as e:
+                for conn in conns.values():
+                    conn.rollback()
+                raise Exception(f"Failed to add products in bulk after {added} committed rows: {str(e)}")
+
+    @staticmethod
+    def _select_product(conn, shard: str, product_id: str) -> Optional[Dict]:
+        """Read a single product (with category and supplier names) from one shard."""
         with conn.cursor(dictionary=True) as cur:
-            cur.execute("SELECT CategoryID, CategoryName FROM Categories ORDER BY CategoryID")
-            return cur.fetchall()
+            cur.execute(PRODUCT_SELECT + " WHERE p.ProductID = %s", (product_id,))
+            return cur.fetchone()
 
-    def get_all_suppliers(self) -> List[Dict]:
-        """Retrieve all suppliers from one shard (since they are replicated)."""
-        conn = self.connections['low_price']  # Any shard will do since data is replicated
+    @staticmethod
+    def _select_products(conn, shard: str, where: str = "", params: tuple = ()) -> List[Dict]:
+        """Read every product on one shard matching an optional WHERE clause."""
         with conn.cursor(dictionary=True) as cur:
-            cur.execute("SELECT SupplierID, SupplierName FROM Suppliers ORDER BY SupplierID")
+            cur.execute(PRODUCT_SELECT + (f" WHERE {where}" if where else ""), params)
             return cur.fetchall()
 
-    def add_product(self, name: str, description: str, price: float, stock_quantity: int, category_id: int, supplier_id: int) -> str:
-        """Add a new product to the appropriate shard."""
-        product_id = str(uuid.uuid4())
-        shard = self.get_shard_for_price(price)
-        conn = self.connections[shard]
+    @staticmethod
+    def _select_product_columns(conn, shard: str, where: str = "", params: tuple = ()):
+        """Like _select_products, but read through a tuple cursor straight into typed column arrays."""
+        from columnar import fetch_columns  # numpy is only needed for columnar results
+        with conn.cursor() as cur:
+            cur.execute(PRODUCT_SELECT + (f" WHERE {where}" if where else ""), params)
+            return fetch_columns(cur)
+
+    def _gather_product_columns(self, shards: List[str], args: Optional[Dict[str, tuple]],
+                                partial: bool, result_format: str):
+        """Scatter a columnar product read and concatenate the shards' arrays in shard order."""
+        from columnar import concat_columns, format_columns
+        results = self._scatter_gather(shards, self._select_product_columns, args, partial=partial)
+        parts = [results[shard] for shard in shards if shard in results]
+        names = list(parts[0]) if parts else PRODUCT_COLUMNS + ['CategoryName', 'SupplierName']
+        return format_columns(concat_columns(parts, names), result_format)
+
+    @staticmethod
+    def _select_shard_stats(conn, shard: str) -> Optional[Dict]:
+        """Sum a shard's ShardStats slots; None until a reconcile has given them a baseline.
+
+        Slots written before any reconcile only hold deltas since then (e.g. on
+        a database that gained ShardStats through migrate.py), so their sums
+        are not the shard's totals.
+        """
+        with conn.cursor() as cur:
+            cur.execute(
+                """SELECT COUNT(*), COALESCE(SUM(ProductCount), 0), COALESCE(SUM(TotalUnits), 0),
+                COALESCE(SUM(StockValue), 0), MIN(MinPrice), MAX(MaxPrice), MAX(LastReconciled)
+                FROM ShardStats"""
+            )
+            slots, count, units, value, min_price, max_price, reconciled = cur.fetchone()
+        if not slots or reconciled is None:
+            return None
+        return {
+            'ProductCount': int(count),
+            'TotalUnits': int(units),
+            'StockValue': round(float(value), 2),
+            'MinPrice': None if min_price is None else float(min_price),
+            'MaxPrice': None if max_price is None else float(max_price),
+            'LastReconciled': reconciled
+        }
+
+    def _count_products(self, conn, shard: str) -> int:
+        """Product count from ShardStats, or a COUNT(*) scan on a shard whose statistics have no baseline yet."""
+        stats = self._select_shard_stats(conn, shard)
+        if stats is not None:
+            return stats['ProductCount']
+        with conn.cursor() as cur:
+            cur.execute("SELECT COUNT(*) FROM Products")
+            return cur.fetchone()[0]
+
+    @staticmethod
+    def _reconcile_shard(conn, shard: str) -> Dict:
+        """Recompute one shard's ShardStats from its Products and return the drift corrected."""
         try:
             with conn.cursor() as cur:
+                # Holding the slots makes concurrent writers apply their deltas after this transaction,
+                # so the scan below (which cannot see their uncommitted rows) and the totals agree
+                cur.execute("SELECT ProductCount, TotalUnits, StockValue FROM ShardStats FOR UPDATE")
+                slots = cur.fetchall()
                 cur.execute(
-                    """INSERT INTO Products (ProductID, ProductName, Description, Price, StockQuantity, CategoryID, SupplierID)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s)""",
-                    (product_id, name, description, price, stock_quantity, category_id, supplier_id)
+                    """SELECT COUNT(*), COALESCE(SUM(StockQuantity), 0), COALESCE(SUM(Price * StockQuantity), 0),
+                    MIN(Price), MAX(Price) FROM Products"""
+                )
+                count, units, value, min_price, max_price = cur.fetchone()
+                cur.execute("DELETE FROM ShardStats")
+                cur.execute(
+                    """INSERT INTO ShardStats (Slot, ProductCount, TotalUnits, StockValue, MinPrice, MaxPrice, LastReconciled)
+                    VALUES (0, %s, %s, %s, %s, %s, NOW())""",
+                    (count, units, value, min_price, max_price)
                 )
-                with self.connections['central'].cursor() as cur_central:
-                    cur_central.execute(
-                        """INSERT INTO InventoryLogs (ProductID, ChangeType, QuantityChanged)
-                        VALUES (%s, %s, %s)""",
-                        (product_id, 'stock_in', stock_quantity)
-                    )
             conn.commit()
-            self.connections['central'].commit()
-            return product_id
-        except Exception as e:
+        except Exception:
             conn.rollback()
-            self.connections['central'].rollback()
-            raise Exception(f"Failed to add product: {str(e)}")
+            raise
+        return {
+            'ProductCount': int(count) - sum(int(slot[0]) for slot in slots),
+            'TotalUnits': int(units) - sum(int(slot[1]) for slot in slots),
+            'StockValue': round(float(value) - sum(float(slot[2]) for slot in slots), 2) or 0.0
+        }
+
+    @staticmethod
+    def _select_directory_shard(conn, database: str, product_id: str) -> Optional[str]:
+        """Read a ProductID's shard from the ProductDirectory of the central database."""
+        with conn.cursor() as cur:
+            cur.execute("SELECT Shard FROM ProductDirectory WHERE ProductID = %s", (product_id,))
+            row = cur.fetchone()
+        return row[0] if row and row[0] in PRODUCT_SHARDS else None
+
+    def _lookup_product_shard(self, product_id: str) -> Optional[str]:
+        """Resolve a ProductID to its shard via the LRU cache, then the central directory."""
+        shard = self.directory_cache.get(product_id)
+        if shard is not None:
+            return shard
+        with self.pools['central'].connection() as conn:
+            shard = self._select_directory_shard(conn, 'central', product_id)
+        if shard is not None:
+            self.directory_cache.put(product_id, shard)
+        return shard
+
+    def _record_product_shard(self, product_id: str, shard: Optional[str]):
+        """Repair the directory entry for a product; a shard of None removes it."""
+        with self.pools['central'].connection() as conn:
+            try:
+                with conn.cursor() as cur:
+                    if shard is None:
+                        cur.execute("DELETE FROM ProductDirectory WHERE ProductID = %s", (product_id,))
+                    else:
+                        cur.execute(
+                            """INSERT INTO ProductDirectory (ProductID, Shard) VALUES (%s, %s)
+                            ON DUPLICATE KEY UPDATE Shard = VALUES(Shard)""",
+                            (product_id, shard)
+                        )
+                conn.commit()
+            except Exception:
+                # The directory is only a routing hint; a failed repair just means another probe later
+                conn.rollback()
+        if shard is None:
+            self.directory_cache.invalidate(product_id)
+        else:
+            self.directory_cache.put(product_id, shard)
+
+    def _probe_product(self, product_id: str, skip_shard: Optional[str] = None) -> Tuple[Optional[Dict], Optional[str]]:
+        """Query every product shard in parallel for a ProductID."""
+        shards = [shard for shard in PRODUCT_SHARDS if shard != skip_shard]
+        args = {shard: (product_id,) for shard in shards}
+        results, _ = self.scatter.run(shards, self._select_product, args)
+        for shard in shards:
+            if results.get(shard):
+                return results[shard], shard
+        return None, None
+
+    @staticmethod
+    def _select_existing_ids(conn, shard: str, product_ids: List[str]) -> List[str]:
+        placeholders = ", ".join(["%s"] * len(product_ids))
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT ProductID FROM Products WHERE ProductID IN ({placeholders})", tuple(product_ids))
+            return [row[0] for row in cur.fetchall()]
+
+    def _probe_product_shards(self, product_ids: List[str]) -> Dict[str, str]:
+        """Find the shards of many ProductIDs by asking every shard in parallel, repairing the directory."""
+        found = {}
+        for i in range(0, len(product_ids), BULK_CHUNK_SIZE):
+            chunk = product_ids[i:i + BULK_CHUNK_SIZE]
+            results, _ = self.scatter.run(PRODUCT_SHARDS, self._select_existing_ids, {shard: (chunk,) for shard in PRODUCT_SHARDS})
+            for shard, ids in results.items():
+                found.update((product_id, shard) for product_id in ids)
+        if found:
+            with self.pools['central'].connection() as conn:
+                try:
+                    self._write_central_changes(conn, [], list(found.items()))
+                    conn.commit()
+                except Exception:
+                    # Routing hints only; the next miss probes again
+                    conn.rollback()
+            for product_id, shard in found.items():
+                self.directory_cache.put(product_id, shard)
+        return found
+
+    def _resolve_product_shards(self, product_ids: List[str]) -> Dict[str, str]:
+        """Map many ProductIDs to shards: LRU cache, then one batched directory read, then a parallel probe."""
+        resolved = {}
+        missing = []
+        for product_id in product_ids:
+            shard = self.directory_cache.get(product_id)
+            if shard is not None:
+                resolved[product_id] = shard
+            else:
+                missing.append(product_id)
+        if missing:
+            with self.pools['central'].connection() as conn:
+                with conn.cursor() as cur:
+                    for i in range(0, len(missing), BULK_CHUNK_SIZE):
+                        chunk = missing[i:i + BULK_CHUNK_SIZE]
+                        cur.execute(
+                            f"SELECT ProductID, Shard FROM ProductDirectory WHERE ProductID IN ({', '.join(['%s'] * len(chunk))})",
+                            tuple(chunk)
+                        )
+                        for product_id, shard in cur.fetchall():
+                            if shard in PRODUCT_SHARDS:
+                                resolved[product_id] = shard
+                                self.directory_cache.put(product_id, shard)
+            unresolved = [product_id for product_id in missing if product_id not in resolved]
+            if unresolved:
+                resolved.update(self._probe_product_shards(unresolved))
+        return resolved
+
+    def _find_product(self, product_id: str) -> Tuple[Optional[Dict], Optional[str]]:
+        """Retrieve a product and the shard it currently lives on."""
+        shard = self._lookup_product_shard(product_id)
+        if shard is not None:
+            with self.pools[shard].connection() as conn:
+                result = self._select_product(conn, shard, product_id)
+            if result:
+                return result, shard
+            self.directory_cache.invalidate(product_id)
+
+        # Directory miss or stale entry: probe the remaining shards and repair the entry
+        result, found_shard = self._probe_product(product_id, skip_shard=shard)
+        if found_shard != shard:
+            self._record_product_shard(product_id, found_shard)
+        return result, found_shard
 
     def get_product_by_id(self, product_id: str) -> Optional[Dict]:
         """Retrieve a product by its globally unique ID."""
-        for shard, conn in self.connections.items():
-            if shard == 'central':
-                continue
-            with conn.cursor(dictionary=True) as cur:
-                cur.execute(
-                    """SELECT p.*, c.CategoryName, s.SupplierName
-                    FROM Products p
-                    LEFT JOIN Categories c ON p.CategoryID = c.CategoryID
-                    LEFT JOIN Suppliers s ON p.SupplierID = s.SupplierID
-                    WHERE p.ProductID = %s""",
-                    (product_id,)
-                )
-                result = cur.fetchone()
-                if result:
-                    return result
-        return None
-
-    def get_products_by_price_range(self, min_price: float, max_price: float) -> List[Dict]:
-        """Retrieve products within a specified price range."""
-        target_shards = []
-        for shard, (shard_min, shard_max) in PRICE_RANGES.items():
-            if min_price < shard_max and max_price > shard_min:
-                target_shards.append(shard)
-
-        results = []
-        for shard in target_shards:
-            conn = self.connections[shard]
-            with conn.cursor(dictionary=True) as cur:
-                cur.execute(
-                    """SELECT p.*, c.CategoryName, s.SupplierName
-                    FROM Products p
-                    LEFT JOIN Categories c ON p.CategoryID = c.CategoryID
-                    LEFT JOIN Suppliers s ON p.SupplierID = s.SupplierID
-                    WHERE p.Price >= %s AND p.Price < %s""",
-                    (max(min_price, PRICE_RANGES[shard][0]), min(max_price, PRICE_RANGES[shard][1]))
-                )
-                results.extend(cur.fetchall())
-        return results
+        return self._find_product(product_id)[0]
 
-    def list_all_products(self) -> List[Dict]:
-        """Retrieve all products from all shards."""
-        results = []
-        for shard in ['low_price', 'mid_price', 'high_price']:
-            conn = self.connections[shard]
-            with conn.cursor(dictionary=True) as cur:
-                cur.execute(
-                    """SELECT p.*, c.CategoryName, s.SupplierName
-                    FROM Products p
-                    LEFT JOIN Categories c ON p.CategoryID = c.CategoryID
-                    LEFT JOIN Suppliers s ON p.SupplierID = s.SupplierID"""
-                )
-                results.extend(cur.fetchall())
+    @staticmethod
+    def _check_result_format(result_format: str):
+        if result_format not in RESULT_FORMATS:
+            raise ValueError(f"Unsupported result format: {result_format}")
+
+    def _scatter_gather(self, shards: List[str], query: Callable, args: Optional[Dict[str, tuple]] = None,
+                        partial: bool = False) -> Dict[str, Any]:
+        """Run a read on several shards concurrently, recording failed shards when partial."""
+        results, errors = self.scatter.run(shards, query, args, partial=partial)
+        self._local.shard_errors = errors
         return results
 
+    def rebuild_product_directory(self) -> int:
+        """Repopulate the central ProductDirectory from the product shards."""
+        with self._connections('central', *PRODUCT_SHARDS) as conns:
+            central = conns['central']
+            total = 0
+            try:
+                for shard in PRODUCT_SHARDS:
+                    with conns[shard].cursor() as cur:
+                        cur.execute("SELECT ProductID FROM Products")
+                        rows = [(product_id, shard) for (product_id,) in cur.fetchall()]
+                    if rows:
+                        with central.cursor() as cur_central:
+                            cur_central.executemany(
+                                """INSERT INTO ProductDirectory (ProductID, Shard) VALUES (%s, %s)
+                                ON DUPLICATE KEY UPDATE Shard = VALUES(Shard)""",
+                                rows
+                            )
+                    total += len(rows)
+                central.commit()
+                self.directory_cache.clear()
+                return total
+            except Exception as e:
+                central.rollback()
+                raise Exception(f"Failed to rebuild product directory: {str(e)}")
+
+    def get_products_by_ids(self, product_ids: List[str]) -> Dict[str, Dict]:
+        """Read many products by ID with one query per shard; missing products are left out."""
+        routes = self._resolve_product_shards(list(dict.fromkeys(product_ids)))
+        products = {}
+        for i in range(0, len(routes), BULK_CHUNK_SIZE):
+            by_shard = {}
+            for product_id, shard in islice(routes.items(), i, i + BULK_CHUNK_SIZE):
+                by_shard.setdefault(shard, []).append(product_id)
+            args = {shard: (f"p.ProductID IN ({', '.join(['%s'] * len(ids))})", tuple(ids)) for shard, ids in by_shard.items()}
+            results, _ = self.scatter.run(list(by_shard), self._select_products, args)
+            products.update((product['ProductID'], product) for rows in results.values() for product in rows)
+        for product_id in routes:
+            if product_id not in products:
+                # Moved since the directory was read; a point lookup follows it to its new shard
+                product, _ = self._find_product(product_id)
+                if product is not None:
+                    products[product_id] = product
+        return products
+
+    def get_products_by_price_range(self, min_price: float, max_price: float, partial: bool = False,
+                                    result_format: str = 'rows'):
+        """Retrieve products within a specified price range.
+
+        result_format 'numpy' returns a dict of typed column arrays and
+        'dataframe' a pandas DataFrame, built per shard without per-row dicts.
+        """
+        args = {
+            shard: ("p.Price >= %s AND p.Price < %s", bounds)
+            for shard, bounds in self._shards_for_price_range(min_price, max_price).items()
+        }
+        if result_format != 'rows':
+            self._check_result_format(result_format)
+            return self._gather_product_columns(list(args), args, partial, result_format)
+
+        results = self._scatter_gather(list(args), self._select_products, args, partial=partial)
+        return [row for shard in args if shard in results for row in results[shard]]
+
+    def list_all_products(self, partial: bool = False, result_format: str = 'rows'):
+        """Retrieve all products from all shards, as dicts or columnar (see get_products_by_price_range)."""
+        if result_format != 'rows':
+            self._check_result_format(result_format)
+            return self._gather_product_columns(PRODUCT_SHARDS, None, partial, result_format)
+        results = self._scatter_gather(PRODUCT_SHARDS, self._select_products, partial=partial)
+        return [row for shard in PRODUCT_SHARDS if shard in results for row in results[shard]]
+
+    @staticmethod
+    def _select_products_after(conn, shard: str, order_by: str, after: Optional[tuple], limit: int) -> List[Dict]:
+        """Read the next keyset page of products on one shard, in listing order."""
+        columns = LISTING_ORDERS[order_by]
+        where, params = "", ()
+        if after is not None:
+            # (a, b) > (x, y) expanded so MySQL can use the index range on the leading column
+            clauses = []
+            for i, column in enumerate(columns):
+                equal = [f"p.{prev} = %s" for prev in columns[:i]]
+                clauses.append("(" + " AND ".join(equal + [f"p.{column} > %s"]) + ")")
+                params += tuple(after[:i + 1])
+            where = " WHERE " + " OR ".join(clauses)
+        order = ", ".join(f"p.{column}" for column in columns)
+        # Default mysql.connector cursors are unbuffered: rows are read off the socket as they are consumed
+        with conn.cursor(dictionary=True) as cur:
+            cur.execute(f"{PRODUCT_SELECT}{where} ORDER BY {order} LIMIT %s", params + (limit,))
+            return [row for row in cur]
+
+    def _stream_shard(self, shard: str, order_by: str, after: Optional[tuple], batch_size: int,
+                      first_batch: List[Dict]) -> Iterator[Dict]:
+        """Yield one shard's products in listing order, fetching a keyset batch at a time."""
+        columns = LISTING_ORDERS[order_by]
+        batch = first_batch
+        while batch:
+            yield from batch
+            if len(batch) < batch_size:
+                return
+            after = tuple(batch[-1][column] for column in columns)
+            # The connection is only held while a batch is read, not while the consumer works
+            with operation('iter_products'), self.pools[shard].connection() as conn:
+                batch = self._select_products_after(conn, shard, order_by, after, batch_size)
+
+    def iter_products(self, order_by: str = 'ProductID', after: Optional[tuple] = None,
+                      batch_size: int = LISTING_BATCH_SIZE) -> Iterator[Dict]:
+        """Stream every product across all shards in one global order.
+
+        Each shard is read in keyset batches of batch_size rows and the sorted
+        per-shard streams are merged with a heap, so memory stays bounded by
+        the number of shards times batch_size. after is an exclusive key tuple
+        for the columns in LISTING_ORDERS[order_by] to resume from.
+        """
+        if order_by not in LISTING_ORDERS:
+            raise ValueError(f"Unsupported listing order: {order_by}")
+        columns = LISTING_ORDERS[order_by]
+        shards = PRODUCT_SHARDS
+        if order_by == 'Price' and after is not None:
+            # With price-based placement, shards entirely below the resume point can be skipped
+            shards = list(self._shards_for_price_range(after[0], float('inf')))
+
+        # The first batch of every shard is fetched concurrently; later batches on demand
+        args = {shard: (order_by, after, batch_size) for shard in shards}
+        first_batches = self._scatter_gather(shards, self._select_products_after, args)
+        streams = [
+            self._stream_shard(shard, order_by, after, batch_size, first_batches[shard])
+            for shard in shards
+        ]
+        return heapq.merge(*streams, key=lambda row: tuple(row[column] for column in columns))
+
+    def list_products_page(self, page_size: int = 50, after: Optional[tuple] = None,
+                           order_by: str = 'ProductID') -> Tuple[List[Dict], Optional[tuple]]:
+        """Return one page of products in global order and the key to pass as after for the next page."""
+        page = list(islice(self.iter_products(order_by, after, batch_size=page_size), page_size))
+        if len(page) < page_size:
+            return page, None
+        return page, tuple(page[-1][column] for column in LISTING_ORDERS[order_by])
+
+    def _search_shard(self, conn, shard: str, query: str, mode: str, category_id: Optional[int],
+                      supplier_id: Optional[int], limit: int) -> List[Dict]:
+        """Read one shard's best limit search matches, in ranking order."""
+        join, relevance, conditions, params = "", "0", [], ()
+        order = "p.ProductName, p.ProductID"
+        terms = re.findall(r"\w+", query)
+        if mode == 'keywords' and terms:
+            index, columns = SEARCH_INDEX
+            join, relevance, condition, params = self.backend.fulltext_match('p', index, columns, terms)
+            conditions.append(condition)
+            order = "Relevance DESC, " + order
+        elif mode == 'name_prefix' and query:
+            # '!' escapes LIKE wildcards the same way on every backend; a leading literal keeps the index usable
+            conditions.append("p.ProductName LIKE %s ESCAPE '!'")
+            params += (re.sub(r"([!%_])", r"!\1", query) + '%',)
+        if category_id is not None:
+            conditions.append("p.CategoryID = %s")
+            params += (category_id,)
+        if supplier_id is not None:
+            conditions.append("p.SupplierID = %s")
+            params += (supplier_id,)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        with conn.cursor(dictionary=True) as cur:
+            cur.execute(
+                f"""SELECT p.*, c.CategoryName, s.SupplierName, {relevance} AS Relevance
+                FROM Products p {join}
+                LEFT JOIN Categories c ON p.CategoryID = c.CategoryID
+                LEFT JOIN Suppliers s ON p.SupplierID = s.SupplierID{where}
+                ORDER BY {order} LIMIT %s""",
+                params + (limit,)
+            )
+            return cur.fetchall()
+
+    def search_products(self, query: str = "", category_id: Optional[int] = None, supplier_id: Optional[int] = None,
+                        mode: str = 'keywords', page: int = 1, page_size: int = SEARCH_PAGE_SIZE,
+                        partial: bool = False) -> Dict:
+        """Search products on every shard, ranked and paginated.
+
+        In 'keywords' mode every word of query must start a word of the
+        product's name or description (each shard's full-text index), best
+        matches first; 'name_prefix' matches names starting with query, in
+        name order. An empty query lists the products matching the category
+        and supplier filters by name. Relevance is scored by each shard's own
+        index, so it is comparable within but only approximately across
+        shards. Returns {'results', 'page', 'page_size', 'has_more'}.
+        """
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode: {mode}; expected one of {', '.join(SEARCH_MODES)}")
+        if page < 1 or page_size < 1:
+            raise ValueError("page and page_size must be at least 1")
+        offset = (page - 1) * page_size
+        if offset + page_size > SEARCH_MAX_RESULTS:
+            raise ValueError(f"Only the first {SEARCH_MAX_RESULTS} search results can be paged through; refine the query")
+        # One row past the page tells whether another page exists
+        limit = offset + page_size + 1
+        args = {shard: (query.strip(), mode, category_id, supplier_id, limit) for shard in PRODUCT_SHARDS}
+        results = self._scatter_gather(PRODUCT_SHARDS, self._search_shard, args, partial=partial)
+        ranked = heapq.nsmallest(
+            limit, (row for shard in PRODUCT_SHARDS if shard in results for row in results[shard]),
+            key=lambda row: (-float(row['Relevance']), row['ProductName'], row['ProductID'])
+        )
+        rows = ranked[offset:]
+        return {'results': rows[:page_size], 'page': page, 'page_size': page_size, 'has_more': len(rows) > page_size}
+
     def update_product_price(self, product_id: str, new_price: float) -> bool:
-        """Update a product's price, handling shard migration if necessary."""
-        current_product = self.get_product_by_id(product_id)
+        """Update a product's price, handling shard migration if necessary.
+
+        The row is locked and re-read on its shard first, so the copy made by a
+        migration and the ShardStats deltas use its current stock and price.
+        """
+        current_product, current_shard = self._find_product(product_id)
         if not current_product:
             return False
 
-        current_shard = self.get_shard_for_price(current_product['Price'])
-        new_shard = self.get_shard_for_price(new_price)
+        new_shard = self.shard_for_product(product_id, new_price)
+        logs = [(product_id, 'price_update', 0)]
+        directory_changes = [(product_id, new_shard)] if current_shard != new_shard else []
 
-        try:
-            if current_shard != new_shard:
-                with self.connections[new_shard].cursor() as cur_new:
-                    cur_new.execute(
-                        """INSERT INTO Products (ProductID, ProductName, Description, Price, StockQuantity, CategoryID, SupplierID)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s)""",
-                        (product_id, current_product['ProductName'], current_product['Description'],
-                         new_price, current_product['StockQuantity'], current_product['CategoryID'],
-                         current_product['SupplierID'])
+        with self._connections(current_shard, new_shard, *self._central_for_writes()) as conns:
+            try:
+                with self.backend.cross_shard_write() if current_shard != new_shard else nullcontext():
+                    with conns[current_shard].cursor(dictionary=True) as cur_old:
+                        cur_old.execute(
+                            """SELECT ProductName, Description, Price, StockQuantity, CategoryID, SupplierID
+                            FROM Products WHERE ProductID = %s FOR UPDATE""",
+                            (product_id,)
+                        )
+                        row = cur_old.fetchone()
+                    moved = row is None
+                    if moved:
+                        conns[current_shard].rollback()
+                    elif current_shard != new_shard:
+                        stock = row['StockQuantity']
+                        with conns[new_shard].cursor() as cur_new:
+                            cur_new.execute(
+                                """INSERT INTO Products (ProductID, ProductName, Description, Price, StockQuantity, CategoryID, SupplierID)
+                                VALUES (%s, %s, %s, %s, %s, %s, %s)""",
+                                (product_id, row['ProductName'], row['Description'], new_price, stock,
+                                 row['CategoryID'], row['SupplierID'])
+                            )
+                            self._adjust_shard_stats(cur_new, 1, stock, float(new_price) * stock, [new_price])
+                        with conns[current_shard].cursor() as cur_old:
+                            cur_old.execute("DELETE FROM Products WHERE ProductID = %s", (product_id,))
+                            self._adjust_shard_stats(cur_old, -1, -stock, -float(row['Price']) * stock)
+                        self._stage_central_changes(conns, logs, directory_changes)
+                        conns[new_shard].commit()
+                        conns[current_shard].commit()
+                    else:
+                        stock = row['StockQuantity']
+                        with conns[current_shard].cursor() as cur:
+                            cur.execute(
+                                "UPDATE Products SET Price = %s, LastUpdated = NOW() WHERE ProductID = %s",
+                                (new_price, product_id)
+                            )
+                            self._adjust_shard_stats(cur, 0, 0, (float(new_price) - float(row['Price'])) * stock, [new_price])
+                        self._stage_central_changes(conns, logs)
+                        conns[current_shard].commit()
+            except Exception as e:
+                for conn in conns.values():
+                    conn.rollback()
+                raise Exception(f"Failed to update price: {str(e)}")
+            if not moved:
+                self.directory_cache.put(product_id, new_shard)
+                self._publish_central_changes(conns, logs, directory_changes, f"Price of product {product_id} was updated")
+                return True
+
+        # The row left that shard (a price change, move or delete) since the lookup: look it up again
+        self.directory_cache.invalidate(product_id)
+        return self.update_product_price(product_id, new_price)
+
+    def _shards_share_instance(self) -> bool:
+        """Whether every product shard lives on the same server (or SQLite directory), so one connection can reach them all."""
+        return self.backend.shares_instance(PRODUCT_SHARDS)
+
+    def _reprice_shard(self, conn, shard: str, product_ids: List[str],
+                       new_price: Callable[[str, float], float]) -> Tuple[Dict[str, Tuple[float, str]], List[str]]:
+        """Reprice products on one shard with set-based statements in a single transaction.
+
+        The rows are locked and read, their new prices and target shards are
+        loaded into a temporary table, and then one UPDATE ... JOIN reprices
+        the rows that stay while INSERT ... SELECT into the other shard's
+        database plus DELETE ... JOIN move the rest. Returns
+        ({ProductID: (new price, shard)}, missing ids); the caller commits.
+        """
+        placeholders = ", ".join(["%s"] * len(product_ids))
+        with conn.cursor() as cur:
+            cur.execute(
+                f"SELECT ProductID, Price, StockQuantity FROM Products WHERE ProductID IN ({placeholders}) FOR UPDATE",
+                tuple(product_ids)
+            )
+            changes, current = {}, {}
+            for product_id, price, stock in cur.fetchall():
+                current[product_id] = (float(price), stock)
+                price = new_price(product_id, float(price))
+                changes[product_id] = (price, self.shard_for_product(product_id, price))
+            if changes:
+                cur.execute(
+                    """CREATE TEMPORARY TABLE IF NOT EXISTS RepriceBatch (
+                        ProductID CHAR(36) PRIMARY KEY,
+                        NewPrice DECIMAL(10,2) NOT NULL,
+                        Shard VARCHAR(64) NOT NULL
+                    )"""
+                )
+                cur.execute("DELETE FROM RepriceBatch")
+                cur.executemany(
+                    "INSERT INTO RepriceBatch (ProductID, NewPrice, Shard) VALUES (%s, %s, %s)",
+                    [(product_id, price, target) for product_id, (price, target) in changes.items()]
+                )
+                cur.execute(
+                    """UPDATE Products p JOIN RepriceBatch r ON p.ProductID = r.ProductID
+                    SET p.Price = r.NewPrice, p.LastUpdated = NOW() WHERE r.Shard = %s""",
+                    (shard,)
+                )
+                targets = {target for _, target in changes.values()} - {shard}
+                for target in sorted(targets):
+                    cur.execute(
+                        f"""INSERT INTO {self.backend.database_name(target)}.Products ({', '.join(PRODUCT_COLUMNS)})
+                        SELECT p.ProductID, p.ProductName, p.Description, r.NewPrice, p.StockQuantity,
+                               p.CategoryID, p.SupplierID, p.DateAdded, NOW()
+                        FROM Products p JOIN RepriceBatch r ON p.ProductID = r.ProductID
+                        WHERE r.Shard = %s""",
+                        (target,)
                     )
-                with self.connections[current_shard].cursor() as cur_old:
-                    cur_old.execute("DELETE FROM Products WHERE ProductID = %s", (product_id,))
-                self.connections[new_shard].commit()
-                self.connections[current_shard].commit()
-            else:
-                with self.connections[current_shard].cursor() as cur:
+                if targets:
                     cur.execute(
-                        "UPDATE Products SET Price = %s, LastUpdated = NOW() WHERE ProductID = %s",
-                        (new_price, product_id)
+                        "DELETE p FROM Products p JOIN RepriceBatch r ON p.ProductID = r.ProductID WHERE r.Shard <> %s",
+                        (shard,)
                     )
-                self.connections[current_shard].commit()
+                self._adjust_reprice_stats(cur, shard, changes, current)
+        missing = [product_id for product_id in product_ids if product_id not in changes]
+        return changes, missing
 
-            with self.connections['central'].cursor() as cur_central:
-                cur_central.execute(
-                    """INSERT INTO InventoryLogs (ProductID, ChangeType, QuantityChanged)
-                    VALUES (%s, %s, %s)""",
-                    (product_id, 'price_update', 0)
+    def _adjust_reprice_stats(self, cur, shard: str, changes: Dict[str, Tuple[float, str]],
+                              current: Dict[str, Tuple[float, int]]):
+        """Apply a reprice chunk's ShardStats deltas to its shard and to the shards it moved rows to."""
+        count = units = 0
+        value = 0.0
+        kept, moved = [], {}
+        for product_id, (price, target) in changes.items():
+            old_price, stock = current[product_id]
+            if target == shard:
+                value += (price - old_price) * stock
+                kept.append(price)
+            else:
+                count, units, value = count - 1, units - stock, value - old_price * stock
+                moved.setdefault(target, []).append((price, stock))
+        self._adjust_shard_stats(cur, count, units, value, kept)
+        for target, rows in sorted(moved.items()):
+            self._adjust_shard_stats(cur, len(rows), sum(stock for _, stock in rows),
+                                     sum(price * stock for price, stock in rows), [price for price, _ in rows],
+                                     database=self.backend.database_name(target))
+
+    def _reprice_routed(self, product_ids: List[str], routes: Dict[str, str],
+                        new_price: Callable[[str, float], float], chunk_size: int, totals: Dict):
+        """Reprice routed products chunk by chunk, committing each chunk with its log rows and directory changes.
+
+        Each chunk borrows its shard's connection (which reaches every product
+        shard) and central for as long as its transaction lasts; stale routes are
+        probed once no connection is held.
+        """
+        pending = product_ids
+        for attempt in range(2):
+            by_shard = {}
+            for product_id in pending:
+                if product_id in routes:
+                    by_shard.setdefault(routes[product_id], []).append(product_id)
+            unrouted = [product_id for product_id in pending if product_id not in routes]
+            missing = []
+            for shard, product_ids in by_shard.items():
+                for i in range(0, len(product_ids), chunk_size):
+                    with self._connections(shard, *self._central_for_writes()) as conns:
+                        try:
+                            with self.backend.cross_shard_write(conns[shard]):
+                                changes, not_here = self._reprice_shard(conns[shard], shard, product_ids[i:i + chunk_size], new_price)
+                                logs = [(product_id, 'price_update', 0) for product_id in changes]
+                                directory_changes = [(product_id, target) for product_id, (_, target) in changes.items() if target != shard]
+                                self._stage_central_changes(conns, logs, directory_changes)
+                                conns[shard].commit()
+                        except Exception:
+                            for conn in conns.values():
+                                conn.rollback()
+                            raise
+                        for product_id, target in directory_changes:
+                            self.directory_cache.put(product_id, target)
+                            totals['moved'][(shard, target)] = totals['moved'].get((shard, target), 0) + 1
+                        totals['updated'] += len(changes)
+                        missing.extend(not_here)
+                        self._publish_central_changes(conns, logs, directory_changes,
+                                                      f"{totals['updated']} product prices were updated")
+            if not missing or attempt:
+                totals['not_found'].extend(unrouted + missing)
+                return
+            # Stale routes: look the products up on every shard and retry once
+            totals['not_found'].extend(unrouted)
+            for product_id in missing:
+                self.directory_cache.invalidate(product_id)
+            routes = self._probe_product_shards(missing)
+            pending = missing
+
+    def reprice_products(self, prices: Iterable[Tuple[str, float]], chunk_size: int = BULK_CHUNK_SIZE) -> Dict:
+        """Set many product prices at once, moving products whose new price belongs on another shard.
+
+        Pairs are (ProductID, new price); the iterable is consumed chunk_size
+        pairs at a time, and the last price given for a product wins. Each
+        shard chunk is one transaction of set-based statements (see
+        _reprice_shard), which needs all product shards on one MySQL
+        instance. Returns the number of products updated, the moves per
+        (source, target) shard and the ProductIDs that were not found.
+        """
+        if not self._shards_share_instance():
+            raise Exception("Failed to reprice products: set-based repricing needs every product shard on one MySQL instance")
+        totals = {'updated': 0, 'moved': {}, 'not_found': []}
+        prices = iter(prices)
+        try:
+            while True:
+                chunk = dict(islice(prices, chunk_size))
+                if not chunk:
+                    return totals
+                self._reprice_routed(
+                    list(chunk), self._resolve_product_shards(list(chunk)),
+                    lambda product_id, price: round(float(chunk[product_id]), 2), chunk_size, totals
                 )
-            self.connections['central'].commit()
-            return True
+        except CentralLogError:
+            raise
         except Exception as e:
-            for shard in [current_shard, new_shard, 'central']:
-                if shard in self.connections:
-                    self.connections[shard].rollback()
-            raise Exception(f"Failed to update price: {str(e)}")
-
-    def update_stock_quantity(self, product_id: str, quantity_change: int) -> bool:
-        """Update stock quantity for a product."""
-        product = self.get_product_by_id(product_id)
-        if not product:
-            return False
+            raise Exception(f"Failed to reprice products after {totals['updated']} committed rows: {str(e)}")
 
-        shard = self.get_shard_for_price(product['Price'])
+    @staticmethod
+    def _select_product_ids(conn, shard: str, where: str, params: tuple) -> List[str]:
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT ProductID FROM Products WHERE {where}", params)
+            return [row[0] for row in cur.fetchall()]
+
+    def reprice_products_by_rule(self, multiplier: float, supplier_id: Optional[int] = None,
+                                 category_id: Optional[int] = None, chunk_size: int = BULK_CHUNK_SIZE) -> Dict:
+        """Multiply the price of every product of a supplier and/or category, e.g. 1.1 for a 10% rise.
+
+        Matching ProductIDs are collected from all shards first, so a product
+        that moves shard during the run is repriced exactly once. New prices
+        are rounded to cents. Returns the same summary as reprice_products.
+        """
+        if multiplier <= 0:
+            raise ValueError("Price multiplier must be positive")
+        if not self._shards_share_instance():
+            raise Exception("Failed to reprice products: set-based repricing needs every product shard on one MySQL instance")
+        conditions, params = [], []
+        if supplier_id is not None:
+            conditions.append("SupplierID = %s")
+            params.append(supplier_id)
+        if category_id is not None:
+            conditions.append("CategoryID = %s")
+            params.append(category_id)
+        where = " AND ".join(conditions) or "1 = 1"
+        args = {shard: (where, tuple(params)) for shard in PRODUCT_SHARDS}
+        routes = {
+            product_id: shard
+            for shard, product_ids in self._scatter_gather(PRODUCT_SHARDS, self._select_product_ids, args).items()
+            for product_id in product_ids
+        }
+
+        totals = {'updated': 0, 'moved': {}, 'not_found': []}
         try:
-            with self.connections[shard].cursor() as cur:
+            self._reprice_routed(list(routes), routes, lambda product_id, price: round(price * multiplier, 2),
+                                 chunk_size, totals)
+            return totals
+        except CentralLogError:
+            raise
+        except Exception as e:
+            raise Exception(f"Failed to reprice products after {totals['updated']} committed rows: {str(e)}")
+
+    def update_stock_quantity(self, product_id: str, quantity_change: int, shard: Optional[str] = None) -> bool:
+        """Update stock quantity for a product.
+
+        A known shard skips the product lookup; if the product is not on that
+        shard the update falls back to the normal lookup.
+        """
+        hinted = shard is not None
+        if not hinted:
+            product, shard = self._find_product(product_id)
+            if not product:
+                return False
+
+        logs = [(product_id, 'stock_update', quantity_change)]
+        with self._connections(shard, *self._central_for_writes()) as conns:
+            conn = conns[shard]
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        "UPDATE Products SET StockQuantity = StockQuantity + %s, LastUpdated = NOW() WHERE ProductID = %s",
+                        (quantity_change, product_id)
+                    )
+                    moved = cur.rowcount == 0
+                    if not moved:
+                        # The price comes from the row this transaction has just locked
+                        cur.execute(
+                            SHARD_STATS_UPSERT.format(
+                                table="ShardStats",
+                                source="SELECT %s, 0, %s, %s * Price, NULL, NULL FROM Products WHERE ProductID = %s"
+                            ),
+                            (random.randrange(SHARD_STATS_SLOTS), quantity_change, quantity_change, product_id)
+                        )
+                if moved:
+                    conn.rollback()
+                else:
+                    self._stage_central_changes(conns, logs)
+                    conn.commit()
+            except Exception as e:
+                for conn in conns.values():
+                    conn.rollback()
+                raise Exception(f"Failed to update stock: {str(e)}")
+            if not moved:
+                self._publish_central_changes(conns, logs, committed=f"Stock of product {product_id} was updated")
+                return True
+
+        # The row was not on that shard (stale hint, or moved by a price change or rebalance since the lookup)
+        self.directory_cache.invalidate(product_id)
+        if hinted:
+            return self.update_stock_quantity(product_id, quantity_change)
+        product, current_shard = self._find_product(product_id)
+        if product and current_shard != shard:
+            return self.update_stock_quantity(product_id, quantity_change, shard=current_shard)
+        return False
+
+    def _apply_shard_deltas(self, conn, shard: str, deltas: Dict[str, int]) -> Tuple[Dict[str, int], Dict[str, int], List[str]]:
+        """Apply merged stock deltas to one shard in a single transaction.
+
+        The rows are locked and read first so deltas that would break the
+        CHK_Stock constraint are rejected individually instead of failing the
+        whole batch. Returns (updated new stock, rejected current stock, missing ids).
+        """
+        product_ids = list(deltas)
+        placeholders = ", ".join(["%s"] * len(product_ids))
+        with conn.cursor() as cur:
+            cur.execute(
+                f"SELECT ProductID, StockQuantity, Price FROM Products WHERE ProductID IN ({placeholders}) FOR UPDATE",
+                tuple(product_ids)
+            )
+            prices = {}
+            current = {}
+            for product_id, stock, price in cur.fetchall():
+                current[product_id], prices[product_id] = stock, float(price)
+            updated, rejected = {}, {}
+            for product_id, stock in current.items():
+                if stock + deltas[product_id] < 0:
+                    rejected[product_id] = stock
+                else:
+                    updated[product_id] = stock + deltas[product_id]
+            if updated:
+                cases = " ".join(["WHEN %s THEN %s"] * len(updated))
+                params = tuple(value for product_id in updated for value in (product_id, deltas[product_id]))
                 cur.execute(
-                    "UPDATE Products SET StockQuantity = StockQuantity + %s, LastUpdated = NOW() WHERE ProductID = %s",
-                    (quantity_change, product_id)
+                    f"""UPDATE Products SET StockQuantity = StockQuantity + CASE ProductID {cases} END, LastUpdated = NOW()
+                    WHERE ProductID IN ({', '.join(['%s'] * len(updated))})""",
+                    params + tuple(updated)
                 )
-            with self.connections['central'].cursor() as cur_central:
-                cur_central.execute(
-                    """INSERT INTO InventoryLogs (ProductID, ChangeType, QuantityChanged)
-                    VALUES (%s, %s, %s)""",
-                    (product_id, 'stock_update', quantity_change)
+                self._adjust_shard_stats(
+                    cur, 0, sum(deltas[product_id] for product_id in updated),
+                    sum(deltas[product_id] * prices[product_id] for product_id in updated)
                 )
-            self.connections[shard].commit()
-            self.connections['central'].commit()
-            return True
-        except Exception as e:
-            self.connections[shard].rollback()
-            self.connections['central'].rollback()
-            raise Exception(f"Failed to update stock: {str(e)}")
+        missing = [product_id for product_id in product_ids if product_id not in current]
+        return updated, rejected, missing
+
+    def apply_stock_deltas(self, deltas: Iterable[Tuple[str, int]], shard_hints: Optional[Dict[str, str]] = None,
+                           chunk_size: int = BULK_CHUNK_SIZE) -> List[Dict]:
+        """Apply many stock changes with one batched UPDATE per shard chunk.
+
+        Deltas for the same ProductID are summed first. Shards come from
+        shard_hints, the routing directory or a parallel probe, with one retry
+        for products that were not on the shard they were routed to. Each shard
+        commits independently and all log rows are written in one batch.
+        Returns one result per product with a Status of 'updated',
+        'rejected' (the change would make stock negative), 'not_found' or 'error'.
+        """
+        merged = {}
+        for product_id, quantity_change in deltas:
+            merged[product_id] = merged.get(product_id, 0) + quantity_change
+        results = {
+            product_id: {'ProductID': product_id, 'QuantityChanged': change, 'Shard': None,
+                         'Status': 'not_found', 'StockQuantity': None, 'Error': None}
+            for product_id, change in merged.items()
+        }
+
+        routes = {product_id: shard for product_id, shard in (shard_hints or {}).items()
+                  if product_id in merged and shard in PRODUCT_SHARDS}
+        routes.update(self._resolve_product_shards([product_id for product_id in merged if product_id not in routes]))
+        pending = list(merged)
+        logs = []
+        for attempt in range(2):
+            by_shard = {}
+            for product_id in pending:
+                if product_id in routes:
+                    by_shard.setdefault(routes[product_id], []).append(product_id)
+            missing = []
+            for shard, product_ids in by_shard.items():
+                for i in range(0, len(product_ids), chunk_size):
+                    chunk = {product_id: merged[product_id] for product_id in product_ids[i:i + chunk_size]}
+                    try:
+                        with self.pools[shard].connection() as conn:
+                            try:
+                                updated, rejected, not_here = self._apply_shard_deltas(conn, shard, chunk)
+                                conn.commit()
+                            except Exception:
+                                conn.rollback()
+                                raise
+                    except Exception as e:
+                        for product_id in chunk:
+                            results[product_id].update(Shard=shard, Status='error', Error=str(e))
+                        continue
+                    for product_id, stock in updated.items():
+                        results[product_id].update(Shard=shard, Status='updated', StockQuantity=stock)
+                        logs.append((product_id, 'stock_update', merged[product_id]))
+                    for product_id, stock in rejected.items():
+                        results[product_id].update(
+                            Shard=shard, Status='rejected', StockQuantity=stock,
+                            Error=f"CHK_Stock constraint: stock {stock} cannot change by {merged[product_id]}"
+                        )
+                    missing.extend(not_here)
+            if not missing or attempt:
+                break
+            # Stale routes: look the products up on every shard (no connection is held here) and retry once
+            for product_id in missing:
+                self.directory_cache.invalidate(product_id)
+            routes = self._probe_product_shards(missing)
+            pending = missing
+
+        if logs:
+            # Central is only borrowed once the shard connections are back in their pools;
+            # a failure unwinds through the pool, which rolls the central transaction back
+            with ExitStack() as stack:
+                try:
+                    conns = stack.enter_context(self._connections(*self._central_for_writes()))
+                    self._stage_central_changes(conns, logs)
+                except Exception as e:
+                    raise CentralLogError(f"Stock deltas were applied, but logging them failed: {str(e)}")
+                self._publish_central_changes(conns, logs, committed="Stock deltas were applied")
+        return list(results.values())
 
     def delete_product(self, product_id: str) -> bool:
         """Delete a product from its shard."""
-        product = self.get_product_by_id(product_id)
+        product, shard = self._find_product(product_id)
         if not product:
             return False
 
-        shard = self.get_shard_for_price(product['Price'])
+        logs = [(product_id, 'delete', 0)]
+        directory_changes = [(product_id, None)]
+        with self._connections(shard, *self._central_for_writes()) as conns:
+            conn = conns[shard]
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT Price, StockQuantity FROM Products WHERE ProductID = %s FOR UPDATE", (product_id,))
+                    row = cur.fetchone()
+                    cur.execute("DELETE FROM Products WHERE ProductID = %s", (product_id,))
+                    if row is not None:
+                        self._adjust_shard_stats(cur, -1, -row[1], -float(row[0]) * row[1])
+                self._stage_central_changes(conns, logs, directory_changes)
+                conn.commit()
+            except Exception as e:
+                for conn in conns.values():
+                    conn.rollback()
+                raise Exception(f"Failed to delete product: {str(e)}")
+            self.directory_cache.invalidate(product_id)
+            self._publish_central_changes(conns, logs, directory_changes, f"Product {product_id} was deleted")
+            return True
+
+    def move_products(self, source: str, target: str, product_ids: List[str]) -> int:
+        """Move products from one shard to another, keeping the routing directory current.
+
+        The rows are locked on the source, only those the active shard map
+        assigns to target are copied (with all columns) and deleted from the
+        source, and the two shards commit back to back. If the source commit
+        fails after the target's, the copies are removed from the target again,
+        so a failed move never leaves a product on both. Returns the number of
+        rows moved.
+        """
+        placeholders = ", ".join(["%s"] * len(product_ids))
+        columns = ", ".join(PRODUCT_COLUMNS)
+        upsert = (
+            f"INSERT INTO Products ({columns}) VALUES ({', '.join(['%s'] * len(PRODUCT_COLUMNS))})"
+            " ON DUPLICATE KEY UPDATE " + ", ".join(f"{c} = VALUES({c})" for c in PRODUCT_COLUMNS[1:])
+        )
+        price_index = PRODUCT_COLUMNS.index('Price')
+        stock_index = PRODUCT_COLUMNS.index('StockQuantity')
+        with self._connections(source, target, *self._central_for_writes()) as conns:
+            with self.backend.cross_shard_write():
+                target_committed = False
+                try:
+                    with conns[source].cursor() as cur:
+                        cur.execute(f"SELECT {columns} FROM Products WHERE ProductID IN ({placeholders}) FOR UPDATE",
+                                    tuple(product_ids))
+                        # Re-check placement under the lock; the price may have changed since the caller looked
+                        rows = [row for row in cur.fetchall() if self.shard_for_product(row[0], row[price_index]) == target]
+                    if not rows:
+                        conns[source].rollback()
+                        return 0
+                    units = sum(row[stock_index] for row in rows)
+                    value = sum(float(row[price_index]) * row[stock_index] for row in rows)
+                    with conns[source].cursor() as cur:
+                        cur.execute(
+                            f"DELETE FROM Products WHERE ProductID IN ({', '.join(['%s'] * len(rows))})",
+                            tuple(row[0] for row in rows)
+                        )
+                        self._adjust_shard_stats(cur, -len(rows), -units, -value)
+                    with conns[target].cursor() as cur:
+                        cur.executemany(upsert, rows)
+                        self._adjust_shard_stats(cur, len(rows), units, value, [row[price_index] for row in rows])
+                    directory_changes = [(row[0], target) for row in rows]
+                    self._stage_central_changes(conns, [], directory_changes)
+                    conns[target].commit()
+                    target_committed = True
+                    conns[source].commit()
+                except Exception as e:
+                    for conn in conns.values():
+                        conn.rollback()
+                    if target_committed:
+                        try:
+                            self._remove_moved_rows(conns[target], [row[0] for row in rows], units, value)
+                        except Exception as undo_error:
+                            raise Exception(
+                                f"Failed to move products from {source} to {target}: {str(e)}; removing the copies "
+                                f"from {target} also failed ({str(undo_error)}), so these products are on both shards: "
+                                f"{', '.join(row[0] for row in rows)}"
+                            )
+                    raise Exception(f"Failed to move products from {source} to {target}: {str(e)}")
+            for product_id, shard in directory_changes:
+                self.directory_cache.put(product_id, shard)
+            self._publish_central_changes(conns, [], directory_changes,
+                                          f"{len(rows)} products were moved from {source} to {target}")
+            return len(rows)
+
+    def _remove_moved_rows(self, conn, product_ids: List[str], units: int, value: float):
+        """Undo the committed target half of a failed move: delete the copies and their ShardStats deltas."""
         try:
-            with self.connections[shard].cursor() as cur:
-                cur.execute("DELETE FROM Products WHERE ProductID = %s", (product_id,))
-            with self.connections['central'].cursor() as cur_central:
-                cur_central.execute(
-                    """INSERT INTO InventoryLogs (ProductID, ChangeType, QuantityChanged)
-                    VALUES (%s, %s, %s)""",
-                    (product_id, 'delete', 0)
+            with conn.cursor() as cur:
+                cur.execute(
+                    f"DELETE FROM Products WHERE ProductID IN ({', '.join(['%s'] * len(product_ids))})",
+                    tuple(product_ids)
                 )
-            self.connections[shard].commit()
-            self.connections['central'].commit()
-            return True
-        except Exception as e:
-            self.connections[shard].rollback()
-            self.connections['central'].rollback()
-            raise Exception(f"Failed to delete product: {str(e)}")
-
-    def get_shard_counts(self) -> Dict[str, int]:
-        """Get the total number of products in each shard."""
-        counts = {}
-        for shard in ['low_price', 'mid_price', 'high_price']:
-            with self.connections[shard].cursor() as cur:
-                cur.execute("SELECT COUNT(*) FROM Products")
-                counts[shard] = cur.fetchone()[0]
-        return counts
-
-    def __del__(self):
-        """Close all database connections."""
-        for conn in self.connections.values():
-            conn.close()
+                self._adjust_shard_stats(cur, -len(product_ids), -units, -value)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    @staticmethod
+    def _aggregate_shard(conn, shard: str, group_by: str, low_stock_threshold: int,
+                         where: str = "", params: tuple = ()) -> List[tuple]:
+        """Compute partial aggregates per group on one shard."""
+        group_column = AGGREGATE_GROUPS[group_by]
+        group_expr = f"p.{group_column}" if group_column else "NULL"
+        with conn.cursor() as cur:
+            cur.execute(
+                f"""SELECT {group_expr} AS GroupKey, COUNT(*), SUM(p.StockQuantity), SUM(p.Price * p.StockQuantity),
+                    MIN(p.Price), MAX(p.Price), SUM(p.Price), SUM(p.StockQuantity <= %s)
+                FROM Products p {f'WHERE {where}' if where else ''}
+                GROUP BY GroupKey""",
+                (low_stock_threshold,) + params
+            )
+            return cur.fetchall()
+
+    def aggregate_products(self, group_by: str = 'category', low_stock_threshold: int = LOW_STOCK_THRESHOLD,
+                           min_price: Optional[float] = None, max_price: Optional[float] = None,
+                           partial: bool = False, result_format: str = 'rows'):
+        """Inventory totals per category, supplier or shard, computed on the shards.
+
+        Each shard returns one partial row per group (product count, units,
+        stock value, min/max/sum of prices and products at or below
+        low_stock_threshold), which are merged here, so only aggregate rows
+        leave the database. An optional price range prunes shards like
+        get_products_by_price_range. Rows are sorted by stock value, highest
+        first; result_format 'numpy' or 'dataframe' returns them as columns.
+        """
+        if group_by not in AGGREGATE_GROUPS:
+            raise ValueError(f"Unsupported aggregate grouping: {group_by}")
+        self._check_result_format(result_format)
+        if min_price is None and max_price is None:
+            args = {shard: (group_by, low_stock_threshold) for shard in PRODUCT_SHARDS}
+        else:
+            shards = self._shards_for_price_range(
+                min_price if min_price is not None else 0, max_price if max_price is not None else float('inf')
+            )
+            args = {}
+            for shard, (low, high) in shards.items():
+                where, params = "p.Price >= %s", (low,)
+                if high != float('inf'):
+                    where, params = where + " AND p.Price < %s", params + (high,)
+                args[shard] = (group_by, low_stock_threshold, where, params)
+        results = self._scatter_gather(list(args), self._aggregate_shard, args, partial=partial)
+
+        merged = {}
+        for shard, rows in results.items():
+            for key, count, units, value, low, high, price_sum, low_stock in rows:
+                key = shard if group_by == 'shard' else key
+                if key not in merged:
+                    merged[key] = [0, 0, 0, low, high, 0, 0]
+                totals = merged[key]
+                totals[0] += count
+                totals[1] += units or 0
+                totals[2] += value or 0
+                totals[3] = min(totals[3], low)
+                totals[4] = max(totals[4], high)
+                totals[5] += price_sum or 0
+                totals[6] += low_stock or 0
+
+        names = {
+            'category': lambda key: (self.get_category(key) or {}).get('CategoryName'),
+            'supplier': lambda key: (self.get_supplier(key) or {}).get('SupplierName')
+        }
+        aggregates = []
+        for key, (count, units, value, low, high, price_sum, low_stock) in merged.items():
+            row = {AGGREGATE_GROUPS[group_by] or 'Shard': key}
+            if group_by in names:
+                row['Name'] = names[group_by](key) if key is not None else None
+            row.update({
+                'ProductCount': count,
+                'TotalUnits': int(units),
+                'StockValue': value,
+                'MinPrice': low,
+                'MaxPrice': high,
+                'AvgPrice': price_sum / count,
+                'LowStockCount': int(low_stock)
+            })
+            aggregates.append(row)
+        aggregates.sort(key=lambda row: row['StockValue'], reverse=True)
+        if result_format != 'rows':
+            from columnar import columns_from_rows, format_columns
+            columns = [AGGREGATE_GROUPS[group_by] or 'Shard'] + (['Name'] if group_by in names else []) + [
+                'ProductCount', 'TotalUnits', 'StockValue', 'MinPrice', 'MaxPrice', 'AvgPrice', 'LowStockCount'
+            ]
+            return format_columns(columns_from_rows(columns, [tuple(row.values()) for row in aggregates]), result_format)
+        return aggregates
+
+    def get_shard_counts(self, partial: bool = False) -> Dict[str, int]:
+        """Get the total number of products in each shard (from ShardStats, without scanning Products)."""
+        results = self._scatter_gather(PRODUCT_SHARDS, self._count_products, partial=partial)
+        return {shard: results[shard] for shard in PRODUCT_SHARDS if shard in results}
+
+    def get_shard_stats(self, partial: bool = False) -> Dict[str, Optional[Dict]]:
+        """Product count, total units, stock value and price bounds of each shard, read from ShardStats.
+
+        MinPrice/MaxPrice may be wider than the prices actually present until
+        the next reconcile_shard_stats(); shards whose statistics have never
+        been reconciled map to None.
+        """
+        results = self._scatter_gather(PRODUCT_SHARDS, self._select_shard_stats, partial=partial)
+        return {shard: results[shard] for shard in PRODUCT_SHARDS if shard in results}
+
+    def reconcile_shard_stats(self, partial: bool = False) -> Dict[str, Dict]:
+        """Recompute every shard's ShardStats from its Products, returning the drift corrected per shard.
+
+        Drift comes from writes made outside InventorySystem (or with an older
+        version of it). Each shard is scanned in one transaction that holds its
+        statistics rows, so product writes on that shard wait until its scan
+        ends; reconcile_stats.py runs this periodically.
+        """
+        with self._connections(*PRODUCT_SHARDS) as conns:
+            results, errors = self.scatter.run(PRODUCT_SHARDS, self._reconcile_shard, conns=conns, partial=partial)
+        self._local.shard_errors = errors
+        return {shard: results[shard] for shard in PRODUCT_SHARDS if shard in results}
+
+    def get_product_history(self, product_id: str, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                            limit: int = LOG_QUERY_LIMIT) -> Dict[str, List[Dict]]:
+        """Inventory changes of one product, newest first, with since <= time < until.
+
+        'events' are the individual InventoryLogs rows and 'daily' the
+        per-day, per-change-type totals of days already compacted. With a log
+        spool, changes appear once they have been flushed.
+        """
+        events_where, daily_where = ["ProductID = %s"], ["ProductID = %s"]
+        events_params, daily_params = [product_id], [product_id]
+        if since is not None:
+            events_where.append("LogTimestamp >= %s")
+            events_params.append(since)
+            daily_where.append("LogDate >= %s")
+            daily_params.append(since.date())
+        if until is not None:
+            events_where.append("LogTimestamp < %s")
+            events_params.append(until)
+            daily_where.append("LogDate < %s")
+            daily_params.append(until.date())
+        with self.pools['central'].connection() as conn:
+            with conn.cursor(dictionary=True) as cur:
+                cur.execute(
+                    f"""SELECT LogID, ProductID, ChangeType, QuantityChanged, LogTimestamp FROM InventoryLogs
+                    WHERE {' AND '.join(events_where)} ORDER BY LogTimestamp DESC, LogID DESC LIMIT %s""",
+                    (*events_params, limit)
+                )
+                events = cur.fetchall()
+                cur.execute(
+                    f"""SELECT ProductID, LogDate, ChangeType, Changes, QuantityChanged FROM InventoryLogDaily
+                    WHERE {' AND '.join(daily_where)} ORDER BY LogDate DESC, ChangeType LIMIT %s""",
+                    (*daily_params, limit)
+                )
+                daily = cur.fetchall()
+        return {'events': events, 'daily': daily}
+
+    def audit_inventory_logs(self, since: datetime, until: datetime, change_type: Optional[str] = None,
+                             product_id: Optional[str] = None, after: Optional[Tuple[datetime, int]] = None,
+                             limit: int = LOG_QUERY_LIMIT) -> List[Dict]:
+        """InventoryLogs rows with since <= LogTimestamp < until, oldest first.
+
+        Pass the (LogTimestamp, LogID) of the last row returned as after to
+        fetch the next page. Rows older than the compaction retention only
+        survive as daily totals (see get_product_history).
+        """
+        where, params = ["LogTimestamp >= %s", "LogTimestamp < %s"], [since, until]
+        if change_type is not None:
+            where.append("ChangeType = %s")
+            params.append(change_type)
+        if product_id is not None:
+            where.append("ProductID = %s")
+            params.append(product_id)
+        if after is not None:
+            where.append("(LogTimestamp > %s OR (LogTimestamp = %s AND LogID > %s))")
+            params.extend((after[0], after[0], after[1]))
+        with self.pools['central'].connection() as conn:
+            with conn.cursor(dictionary=True) as cur:
+                cur.execute(
+                    f"""SELECT LogID, ProductID, ChangeType, QuantityChanged, LogTimestamp FROM InventoryLogs
+                    WHERE {' AND '.join(where)} ORDER BY LogTimestamp, LogID LIMIT %s""",
+                    (*params, limit)
+                )
+                return cur.fetchall()
+
+    def read_changes(self, after_log_id: int = 0, limit: int = FEED_BATCH_SIZE,
+                     include_products: bool = True) -> List[Dict]:
+        """Up to limit InventoryLogs rows with LogID > after_log_id, in LogID order.
+
+        With include_products each row carries the product's current row under
+        'Product' (None once deleted), read in one query per shard. For a
+        tailing consumer with checkpoints use change_feed().
+        """
+        with self.pools['central'].connection() as conn:
+            with conn.cursor(dictionary=True) as cur:
+                cur.execute(
+                    """SELECT LogID, ProductID, ChangeType, QuantityChanged, LogTimestamp FROM InventoryLogs
+                    WHERE LogID > %s ORDER BY LogID LIMIT %s""",
+                    (after_log_id, limit)
+                )
+                changes = cur.fetchall()
+        if include_products and changes:
+            products = self.get_products_by_ids(
+                [change['ProductID'] for change in changes if change['ChangeType'] != 'delete']
+            )
+            for change in changes:
+                change['Product'] = products.get(change['ProductID'])
+        return changes
+
+    def change_feed(self, consumer: str, **options) -> ChangeFeed:
+        """A ChangeFeed over InventoryLogs that resumes from consumer's stored checkpoint (see change_feed.py)."""
+        return ChangeFeed(self, consumer, **options)
+
+    def compact_inventory_logs(self, retention_days: int = LOG_RETENTION_DAYS, batch_size: int = LOG_COMPACTION_BATCH,
+                               months_ahead: int = LOG_PARTITION_MONTHS_AHEAD) -> Dict:
+        """Roll InventoryLogs rows from before the last retention_days whole days into InventoryLogDaily.
+
+        Rows are summed into the daily totals and deleted batch by batch, each
+        batch in its own transaction, so writers are never blocked for long and
+        late rows (e.g. from a log spool) are added on a later run. Emptied
+        monthly partitions are then dropped and upcoming ones created.
+        compact_logs.py runs this periodically.
+        """
+        cutoff = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=retention_days)
+        rolled_up = 0
+        with self.pools['central'].connection() as conn:
+            try:
+                while True:
+                    with conn.cursor() as cur:
+                        cur.execute(
+                            "SELECT LogID FROM InventoryLogs WHERE LogTimestamp < %s ORDER BY LogTimestamp LIMIT %s",
+                            (cutoff, batch_size)
+                        )
+                        log_ids = [log_id for (log_id,) in cur.fetchall()]
+                        if not log_ids:
+                            break
+                        placeholders = ", ".join(["%s"] * len(log_ids))
+                        cur.execute(LOG_ROLLUP_UPSERT.format(ids=placeholders), (cutoff, *log_ids))
+                        # The timestamp bound lets MySQL prune the delete to the old partitions
+                        cur.execute(
+                            f"DELETE FROM InventoryLogs WHERE LogTimestamp < %s AND LogID IN ({placeholders})",
+                            (cutoff, *log_ids)
+                        )
+                    conn.commit()
+                    rolled_up += len(log_ids)
+                partitions = self.backend.rotate_partitions(conn, 'InventoryLogs', cutoff, months_ahead)
+            except Exception as e:
+                conn.rollback()
+                raise Exception(f"Failed to compact inventory logs after {rolled_up} rows: {str(e)}")
+        return {'cutoff': cutoff, 'rolled_up': rolled_up, 'partitions': partitions}
+
+    def get_query_metrics(self) -> List[Dict]:
+        """Query counts, rows, errors and latency percentiles per (method, shard)."""
+        return self.instrumentation.snapshot()
+
+    def get_slow_queries(self) -> List[Dict]:
+        """Recent queries slower than the instrumentation's slow_query_ms, newest first."""
+        return self.instrumentation.slow_queries()
+
+    def get_log_spool_metrics(self) -> Optional[Dict]:
+        """Backlog and flush-lag metrics of the write-behind log spool, or None when it is disabled."""
+        return self.log_spool.metrics() if self.log_spool is not None else None
+
+    def close(self):
+        """Stop the scatter-gather workers and log spool, then close all pooled database connections."""
+        self.scatter.shutdown()
+        if self.log_spool is not None:
+            self.log_spool.close()
+        for pool in self.pools.values():
+            pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
 
 def main():
     inventory = InventorySystem()
@@ -321,6 +2253,8 @@ def main():
 
     except Exception as e:
         print(f"Error: {str(e)}")
+    finally:
+        inventory.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
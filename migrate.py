@@ -0,0 +1,31 @@
+import argparse
+from main import InventorySystem, DB_CONFIG, PRODUCT_SHARDS, STORAGE_BACKEND, SQLITE_DIR
+from backends import SCHEMA_PATH, build_backend
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Add the tables, indexes and partitioning of database.sql that existing databases are missing"
+    )
+    parser.add_argument('--schema', default=SCHEMA_PATH, help="Schema file to migrate to")
+    args = parser.parse_args()
+
+    backend = build_backend(STORAGE_BACKEND, DB_CONFIG, SQLITE_DIR, PRODUCT_SHARDS)
+    changes = backend.migrate(args.schema)
+    # Readers ignore ShardStats until a reconcile gives them a baseline, e.g. on a table created just now
+    inventory = InventorySystem(backend=backend)
+    try:
+        stats = inventory.get_shard_stats()
+        unreconciled = [shard for shard in PRODUCT_SHARDS if stats.get(shard) is None]
+        if unreconciled:
+            inventory.reconcile_shard_stats()
+            changes.append(f"reconciled ShardStats on {', '.join(unreconciled)}")
+    finally:
+        inventory.close()
+    for change in changes:
+        print(change)
+    print(f"Done: {len(changes)} change(s).")
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,127 @@
+import argparse
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from main import InventorySystem, PRODUCT_SHARDS, PRICE_RANGES, SHARD_MAP_TTL, SHARD_MAP_RETRY
+from sharding import ShardMap, build_shard_map
+
+# Products scanned and moved per batch while rebalancing
+REBALANCE_BATCH_SIZE = 500
+
+# Seconds between storing the target map and moving the first row, so every process has re-read it
+REBALANCE_SETTLE_TIME = SHARD_MAP_TTL + 2 * SHARD_MAP_RETRY
+
+
+class ShardRebalancer:
+    """Move products onto the shards a new shard map assigns them, while the system stays online.
+
+    run() first stores the target map in ShardMapState with Rebalancing set and
+    waits until every InventorySystem has re-read it, so new products land on
+    their final shard and range queries stop pruning shards in all processes.
+    It then scans each shard in ProductID order and moves misplaced rows in
+    batches with move_products, which updates the routing directory as it goes,
+    so point lookups keep finding rows mid-move. If a pass fails, the state stays
+    Rebalancing (reads stay correct, only unpruned) until run() is repeated.
+    """
+
+    def __init__(self, inventory: InventorySystem, target_map: ShardMap,
+                 batch_size: int = REBALANCE_BATCH_SIZE, pause: float = 0.0):
+        self.inventory = inventory
+        self.target_map = target_map
+        self.batch_size = batch_size
+        self.pause = pause
+
+    def _scan(self, shard: str) -> Iterator[List[Tuple[str, float]]]:
+        """Yield (ProductID, Price) batches from a shard in ProductID order."""
+        after = ''
+        while True:
+            with self.inventory.pools[shard].connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        "SELECT ProductID, Price FROM Products WHERE ProductID > %s ORDER BY ProductID LIMIT %s",
+                        (after, self.batch_size)
+                    )
+                    rows = cur.fetchall()
+            if not rows:
+                return
+            yield rows
+            after = rows[-1][0]
+
+    def plan(self) -> Dict[Tuple[str, str], int]:
+        """Count the products that would move, per (source, target) shard pair."""
+        moves = {}
+        for shard in PRODUCT_SHARDS:
+            for rows in self._scan(shard):
+                for product_id, price in rows:
+                    target = self.target_map.shard_for(product_id, float(price))
+                    if target != shard:
+                        moves[(shard, target)] = moves.get((shard, target), 0) + 1
+        return moves
+
+    def prepare(self):
+        """Make every shard able to hold any product under the target map."""
+        if not self.target_map.price_based:
+            # The per-shard CHK_Price_* constraints would reject rows placed by hash
+            for shard in PRODUCT_SHARDS:
+                with self.inventory.pools[shard].connection() as conn:
+                    self.inventory.backend.drop_check_constraints(conn, 'Products', 'CHK_Price_')
+        # Moved rows keep their CategoryID/SupplierID, so reference data must match everywhere
+        self.inventory.repair_reference_data()
+
+    def _run_pass(self, moved: Dict[Tuple[str, str], int],
+                  progress: Optional[Callable[[Dict[Tuple[str, str], int]], None]]) -> int:
+        total = 0
+        for shard in PRODUCT_SHARDS:
+            for rows in self._scan(shard):
+                targets = {}
+                for product_id, price in rows:
+                    target = self.target_map.shard_for(product_id, float(price))
+                    if target != shard:
+                        targets.setdefault(target, []).append(product_id)
+                for target, product_ids in targets.items():
+                    count = self.inventory.move_products(shard, target, product_ids)
+                    moved[(shard, target)] = moved.get((shard, target), 0) + count
+                    total += count
+                if targets:
+                    if progress:
+                        progress(moved)
+                    if self.pause:
+                        time.sleep(self.pause)
+        return total
+
+    def run(self, progress: Optional[Callable[[Dict[Tuple[str, str], int]], None]] = None) -> Dict[Tuple[str, str], int]:
+        """Rebalance every shard onto the target map and return the products moved per (source, target)."""
+        self.prepare()
+        self.inventory.set_shard_map(self.target_map, rebalancing=True)
+        time.sleep(REBALANCE_SETTLE_TIME)
+        moved = {}
+        # Rows whose price changed during a pass may need another one
+        while self._run_pass(moved, progress):
+            pass
+        # Only resume range pruning once every row is where the new map expects it
+        self.inventory.set_shard_map(self.target_map, rebalancing=False)
+        return moved
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move products onto a new sharding strategy")
+    parser.add_argument('strategy', choices=['price_range', 'hash', 'consistent_hash'])
+    parser.add_argument('--batch-size', type=int, default=REBALANCE_BATCH_SIZE)
+    parser.add_argument('--pause', type=float, default=0.0, help="Seconds to sleep between batches")
+    parser.add_argument('--dry-run', action='store_true', help="Only report how many products would move")
+    args = parser.parse_args()
+
+    inventory = InventorySystem()
+    try:
+        target_map = build_shard_map(args.strategy, PRODUCT_SHARDS, PRICE_RANGES)
+        rebalancer = ShardRebalancer(inventory, target_map, batch_size=args.batch_size, pause=args.pause)
+        moves = rebalancer.plan() if args.dry_run else rebalancer.run()
+        for (source, target), count in sorted(moves.items()):
+            print(f"{source} -> {target}: {count}")
+        if not args.dry_run:
+            print(f"Done. Every process now places products by '{args.strategy}' (stored in ShardMapState).")
+    finally:
+        inventory.close()
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
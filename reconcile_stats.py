@@ -0,0 +1,33 @@
+import argparse
+import time
+from main import InventorySystem
+
+# Seconds between reconcile runs when running continuously
+RECONCILE_INTERVAL = 3600.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recompute the per-shard ShardStats totals from the Products tables")
+    parser.add_argument('--interval', type=float, default=0.0,
+                        help=f"Keep running, reconciling every this many seconds (e.g. {RECONCILE_INTERVAL:g})")
+    args = parser.parse_args()
+
+    inventory = InventorySystem()
+    try:
+        while True:
+            started = time.monotonic()
+            drift = inventory.reconcile_shard_stats(partial=True)
+            for shard, corrected in drift.items():
+                print(f"{shard}: products {corrected['ProductCount']:+d}, units {corrected['TotalUnits']:+d}, "
+                      f"value {corrected['StockValue']:+.2f}")
+            for shard, error in inventory.last_shard_errors.items():
+                print(f"{shard}: failed: {error}")
+            if not args.interval:
+                break
+            time.sleep(max(args.interval - (time.monotonic() - started), 0))
+    finally:
+        inventory.close()
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
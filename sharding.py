@@ -0,0 +1,112 @@
+import bisect
+import hashlib
+from typing import Dict, List, Optional, Tuple
+
+# Virtual nodes per shard on the consistent-hash ring
+HASH_RING_VNODES = 64
+
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode('utf-8')).digest()[:8], 'big')
+
+
+class ShardMap:
+    """Decides which product shard a row belongs on."""
+
+    strategy = None
+    # True when the placement depends on Price, i.e. a price move can move the row
+    price_based = False
+
+    def __init__(self, shards: List[str]):
+        if not shards:
+            raise ValueError("A shard map needs at least one shard")
+        self.shards = list(shards)
+
+    def shard_for(self, product_id: str, price: float) -> str:
+        raise NotImplementedError
+
+    def shards_for_price_range(self, min_price: float, max_price: float) -> Dict[str, Tuple[float, float]]:
+        """Shards that can hold prices in [min_price, max_price), with the bounds to query on each."""
+        return {shard: (min_price, max_price) for shard in self.shards}
+
+    def to_spec(self) -> Dict:
+        return {'strategy': self.strategy, 'shards': self.shards}
+
+
+class PriceRangeShardMap(ShardMap):
+    """The original layout: each shard holds one half-open price band."""
+
+    strategy = 'price_range'
+    price_based = True
+
+    def __init__(self, price_ranges: Dict[str, Tuple[float, float]]):
+        super().__init__(list(price_ranges))
+        self.price_ranges = dict(price_ranges)
+
+    def shard_for(self, product_id: str, price: float) -> str:
+        for shard, (min_price, max_price) in self.price_ranges.items():
+            if min_price <= price < max_price:
+                return shard
+        raise ValueError("Price out of defined ranges")
+
+    def shards_for_price_range(self, min_price: float, max_price: float) -> Dict[str, Tuple[float, float]]:
+        return {
+            shard: (max(min_price, shard_min), min(max_price, shard_max))
+            for shard, (shard_min, shard_max) in self.price_ranges.items()
+            if min_price < shard_max and max_price > shard_min
+        }
+
+    def to_spec(self) -> Dict:
+        return {'strategy': self.strategy, 'price_ranges': self.price_ranges}
+
+
+class HashShardMap(ShardMap):
+    """Spread ProductIDs evenly over N shards by hash modulo N."""
+
+    strategy = 'hash'
+
+    def shard_for(self, product_id: str, price: float) -> str:
+        return self.shards[_hash64(product_id) % len(self.shards)]
+
+
+class ConsistentHashShardMap(ShardMap):
+    """Hash ProductIDs onto a ring of virtual nodes, so adding a shard only moves about 1/N of the rows."""
+
+    strategy = 'consistent_hash'
+
+    def __init__(self, shards: List[str], vnodes: int = HASH_RING_VNODES):
+        super().__init__(shards)
+        self.vnodes = vnodes
+        ring = sorted((_hash64(f"{shard}#{i}"), shard) for shard in self.shards for i in range(vnodes))
+        self._points = [point for point, _ in ring]
+        self._owners = [shard for _, shard in ring]
+
+    def shard_for(self, product_id: str, price: float) -> str:
+        index = bisect.bisect(self._points, _hash64(product_id)) % len(self._points)
+        return self._owners[index]
+
+    def to_spec(self) -> Dict:
+        return {'strategy': self.strategy, 'shards': self.shards, 'vnodes': self.vnodes}
+
+
+def build_shard_map(strategy: str, shards: List[str],
+                    price_ranges: Optional[Dict[str, Tuple[float, float]]] = None) -> ShardMap:
+    """Create a shard map by strategy name: 'price_range', 'hash' or 'consistent_hash'."""
+    if strategy == 'price_range':
+        return PriceRangeShardMap(price_ranges)
+    if strategy == 'hash':
+        return HashShardMap(shards)
+    if strategy == 'consistent_hash':
+        return ConsistentHashShardMap(shards)
+    raise ValueError(f"Unknown sharding strategy: {strategy}")
+
+def shard_map_from_spec(spec: Dict) -> ShardMap:
+    """Rebuild a shard map from its to_spec() description (e.g. the one stored in ShardMapState)."""
+    strategy = spec['strategy']
+    if strategy == 'price_range':
+        return PriceRangeShardMap({shard: tuple(bounds) for shard, bounds in spec['price_ranges'].items()})
+    if strategy == 'hash':
+        return HashShardMap(spec['shards'])
+    if strategy == 'consistent_hash':
+        return ConsistentHashShardMap(spec['shards'], spec.get('vnodes', HASH_RING_VNODES))
+    raise ValueError(f"Unknown sharding strategy: {strategy}")
\ No newline at end of file
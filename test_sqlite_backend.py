@@ -0,0 +1,346 @@
+import asyncio
+import shutil
+from contextlib import contextmanager
+import threading
+import time
+import uuid
+
+import pytest
+
+import async_inventory
+from async_inventory import AsyncInventorySystem
+from backends import SQLiteBackend
+from main import InventorySystem, DB_CONFIG, PRODUCT_SHARDS
+from rebalance import ShardRebalancer
+from sharding import build_shard_map
+
+
+def make_inventory(directory, pool_size: int = 2) -> InventorySystem:
+    return InventorySystem(backend=SQLiteBackend(str(directory), DB_CONFIG, PRODUCT_SHARDS), pool_size=pool_size)
+
+
+@pytest.fixture
+def inventory(tmp_path):
+    inventory = make_inventory(tmp_path)
+    inventory.add_category(1, 'Tools')
+    inventory.add_supplier(1, 'Acme', 'acme@example.com')
+    yield inventory
+    inventory.close()
+
+
+def add(inventory: InventorySystem, price: float, stock: int = 10) -> str:
+    return inventory.add_product(f"Product {price}", "Test product", price, stock, 1, 1)
+
+
+def test_add_and_find(inventory):
+    cheap, pricey = add(inventory, 10.0), add(inventory, 900.0)
+    assert inventory.get_product_by_id(cheap)['ProductName'] == "Product 10.0"
+    assert inventory.get_product_by_id(str(uuid.uuid4())) is None
+    assert [p['ProductID'] for p in inventory.get_products_by_price_range(500, 1000)] == [pricey]
+    assert set(inventory.get_products_by_ids([cheap, pricey])) == {cheap, pricey}
+    assert inventory.get_shard_counts() == {'low_price': 1, 'mid_price': 0, 'high_price': 1}
+
+
+def test_update_price_within_and_across_shards(inventory):
+    product_id = add(inventory, 10.0)
+    assert inventory.update_product_price(product_id, 20.0)
+    assert float(inventory.get_product_by_id(product_id)['Price']) == 20.0
+    assert inventory.update_product_price(product_id, 600.0)
+    assert float(inventory.get_product_by_id(product_id)['Price']) == 600.0
+    assert inventory.get_shard_counts() == {'low_price': 0, 'mid_price': 0, 'high_price': 1}
+    assert not inventory.update_product_price(str(uuid.uuid4()), 5.0)
+
+
+def test_update_price_uses_locked_row(inventory):
+    product_id = add(inventory, 10.0, stock=10)
+    find_product = inventory._find_product
+
+    def find_then_race(pid):
+        # Another writer changes the stock after the lookup has read the row
+        product, shard = find_product(pid)
+        inventory.update_stock_quantity(pid, 5, shard=shard)
+        return product, shard
+
+    inventory._find_product = find_then_race
+    assert inventory.update_product_price(product_id, 600.0)
+    assert inventory.update_product_price(product_id, 700.0)
+    inventory._find_product = find_product
+
+    assert inventory.get_product_by_id(product_id)['StockQuantity'] == 20
+    stats = inventory.get_shard_stats()
+    assert stats['low_price']['TotalUnits'] == 0 and stats['low_price']['StockValue'] == 0
+    assert stats['high_price']['TotalUnits'] == 20 and stats['high_price']['StockValue'] == 14000
+
+
+def test_reprice_moves_products(inventory):
+    ids = [add(inventory, 10.0 + i) for i in range(5)]
+    unknown = str(uuid.uuid4())
+    result = inventory.reprice_products([(ids[0], 11.0), (ids[1], 100.0), (ids[2], 700.0), (unknown, 1.0)])
+    assert result['updated'] == 3
+    assert result['moved'] == {('low_price', 'mid_price'): 1, ('low_price', 'high_price'): 1}
+    assert result['not_found'] == [unknown]
+    assert float(inventory.get_product_by_id(ids[2])['Price']) == 700.0
+
+    result = inventory.reprice_products_by_rule(2.0, supplier_id=1)
+    assert result['updated'] == 5
+    assert inventory.get_shard_counts() == {'low_price': 3, 'mid_price': 1, 'high_price': 1}
+
+
+def test_stock_deltas(inventory):
+    product_id, other_id = add(inventory, 10.0, stock=5), add(inventory, 80.0, stock=1)
+    unknown = str(uuid.uuid4())
+    results = {r['ProductID']: r for r in inventory.apply_stock_deltas(
+        [(product_id, 3), (product_id, -1), (other_id, -2), (unknown, 1)]
+    )}
+    assert results[product_id]['Status'] == 'updated' and results[product_id]['StockQuantity'] == 7
+    assert results[other_id]['Status'] == 'rejected' and results[other_id]['StockQuantity'] == 1
+    assert results[unknown]['Status'] == 'not_found'
+
+    # A stale hint is retried on the shard that actually holds the product
+    results = inventory.apply_stock_deltas([(product_id, 1)], shard_hints={product_id: 'high_price'})
+    assert results[0]['Status'] == 'updated' and results[0]['Shard'] == 'low_price'
+
+
+def test_update_stock_and_delete(inventory):
+    product_id = add(inventory, 60.0, stock=4)
+    assert inventory.update_stock_quantity(product_id, 6)
+    assert inventory.get_product_by_id(product_id)['StockQuantity'] == 10
+    with pytest.raises(Exception):
+        inventory.update_stock_quantity(product_id, -20)
+    assert inventory.delete_product(product_id)
+    assert inventory.get_product_by_id(product_id) is None
+    assert not inventory.delete_product(product_id)
+    assert not inventory.update_stock_quantity(product_id, 1)
+
+
+def test_failed_move_leaves_no_duplicate(inventory):
+    ids = [add(inventory, 10.0 + i) for i in range(20)]
+    target_map = build_shard_map('hash', PRODUCT_SHARDS)
+    ShardRebalancer(inventory, target_map).prepare()
+    inventory.set_shard_map(target_map, rebalancing=True)
+    target = next(shard for shard in PRODUCT_SHARDS if shard != 'low_price')
+    moving = [product_id for product_id in ids if target_map.shard_for(product_id, 0) == target]
+    assert moving
+
+    class FailingCommit:
+        def __init__(self, conn):
+            self._conn = conn
+
+        def __getattr__(self, name):
+            return getattr(self._conn, name)
+
+        def commit(self):
+            raise Exception("injected source commit failure")
+
+    # The source shard's commit fails after the target's has gone through
+    pool = inventory.pools['low_price']
+    connection = pool.connection
+
+    @contextmanager
+    def failing_connection(*args, **kwargs):
+        with connection(*args, **kwargs) as conn:
+            yield FailingCommit(conn)
+
+    pool.connection = failing_connection
+    with pytest.raises(Exception, match="Failed to move products"):
+        inventory.move_products('low_price', target, moving)
+    pool.connection = connection
+
+    assert inventory.get_shard_counts() == {'low_price': len(ids), 'mid_price': 0, 'high_price': 0}
+    assert sorted(p['ProductID'] for p in inventory.get_products_by_price_range(0, 1000)) == sorted(ids)
+    drift = inventory.reconcile_shard_stats()
+    assert all(not any(shard_drift.values()) for shard_drift in drift.values())
+
+    assert inventory.move_products('low_price', target, moving) == len(moving)
+    assert inventory.get_shard_counts()[target] == len(moving)
+
+
+def test_single_connection_pool(tmp_path):
+    inventory = make_inventory(tmp_path, pool_size=1)
+    try:
+        inventory.add_category(1, 'Tools')
+        inventory.add_supplier(1, 'Acme', 'acme@example.com')
+        ids = [add(inventory, 10.0 + i) for i in range(4)]
+        inventory.directory_cache.clear()
+        assert inventory.reprice_products([(product_id, 100.0) for product_id in ids])['updated'] == 4
+        assert inventory.reprice_products_by_rule(10.0, category_id=1)['updated'] == 4
+        results = inventory.apply_stock_deltas([(product_id, 1) for product_id in ids],
+                                               shard_hints={product_id: 'low_price' for product_id in ids})
+        assert {r['Status'] for r in results} == {'updated'}
+    finally:
+        inventory.close()
+
+
+def test_concurrent_reprice_and_stock_deltas(inventory):
+    ids = [add(inventory, 10.0 + i, stock=100) for i in range(300)]
+    errors = []
+    applied = {product_id: 0 for product_id in ids}
+
+    def reprice(worker: int):
+        try:
+            for round_ in range(10):
+                prices = [(product_id, float(5 + (worker * 131 + round_ * 37 + i * 53) % 900))
+                          for i, product_id in enumerate(ids[worker::2])]
+                inventory.reprice_products(prices, chunk_size=50)
+        except Exception as e:
+            errors.append(e)
+
+    def deltas():
+        try:
+            for _ in range(20):
+                for result in inventory.apply_stock_deltas([(product_id, 1) for product_id in ids]):
+                    # A product moved again after its one retry can come back not_found; nothing may fail
+                    if result['Status'] == 'updated':
+                        applied[result['ProductID']] += 1
+                    elif result['Status'] != 'not_found':
+                        errors.append(result['Error'])
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=reprice, args=(worker,)) for worker in range(2)]
+    threads += [threading.Thread(target=deltas) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert {product_id: inventory.get_product_by_id(product_id)['StockQuantity'] - 100 for product_id in ids} == applied
+    assert sum(applied.values()) > len(ids)
+    assert sum(inventory.get_shard_counts().values()) == len(ids)
+
+
+def test_range_pruning_sees_other_processes_writes(tmp_path, inventory):
+    add(inventory, 10.0)
+    assert len(inventory.get_products_by_price_range(0, 1000)) == 1
+
+    # A second process adds a product priced outside the bounds the first has seen
+    other = make_inventory(tmp_path)
+    try:
+        product_id = add(other, 900.0)
+    finally:
+        other.close()
+    assert [p['ProductID'] for p in inventory.get_products_by_price_range(500, 1000)] == [product_id]
+    assert len(inventory.get_products_by_price_range(0, 1000)) == 2
+
+
+def test_new_database_has_shard_stats_baseline(inventory):
+    stats = inventory.get_shard_stats()
+    assert all(stats[shard]['LastReconciled'] is not None for shard in PRODUCT_SHARDS)
+    add(inventory, 10.0, stock=3)
+    assert inventory.get_shard_stats()['low_price']['ProductCount'] == 1
+
+
+def test_shard_stats_without_baseline_are_ignored(inventory):
+    ids = [add(inventory, 10.0 + i) for i in range(3)]
+    # As on a database that gained ShardStats through migrate.py: no reconciled baseline
+    with inventory.pools['low_price'].connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM ShardStats")
+        conn.commit()
+    assert inventory.update_stock_quantity(ids[0], 1)
+
+    assert inventory.get_shard_stats()['low_price'] is None
+    assert inventory.get_shard_counts()['low_price'] == 3
+    assert len(inventory.get_products_by_price_range(0, 50)) == 3
+
+    inventory.reconcile_shard_stats()
+    assert inventory.get_shard_stats()['low_price']['ProductCount'] == 3
+    assert len(inventory.get_products_by_price_range(0, 50)) == 3
+
+
+def test_lost_spool_keeps_recovery_note(tmp_path):
+    spool_dir = tmp_path / 'spool'
+    inventory = InventorySystem(backend=SQLiteBackend(str(tmp_path / 'db'), DB_CONFIG, PRODUCT_SHARDS),
+                                log_spool_dir=str(spool_dir), log_spool_name='test-spool')
+    inventory.add_category(1, 'Tools')
+    inventory.add_supplier(1, 'Acme', 'acme@example.com')
+    add(inventory, 10.0)
+    inventory.close()
+    shutil.rmtree(spool_dir)
+
+    inventory = InventorySystem(backend=SQLiteBackend(str(tmp_path / 'db'), DB_CONFIG, PRODUCT_SHARDS),
+                                log_spool_dir=str(spool_dir), log_spool_name='test-spool')
+    try:
+        add(inventory, 20.0)
+        # The background flusher clears last_error after a good batch; the recovery note has to stay
+        deadline = time.monotonic() + 10
+        while inventory.get_log_spool_metrics()['pending_records'] and time.monotonic() < deadline:
+            time.sleep(0.05)
+        metrics = inventory.get_log_spool_metrics()
+        assert metrics['pending_records'] == 0 and metrics['last_error'] is None
+        assert 'replaying from the start' in metrics['recovery_note']
+    finally:
+        inventory.close()
+
+
+def test_change_feed_delivers_entries_committed_into_gaps(inventory):
+    def log(log_id: int):
+        # An InventoryLogs row whose LogID was handed out earlier, as by a transaction that commits late
+        with inventory.pools['central'].connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "INSERT INTO InventoryLogs (LogID, ProductID, ChangeType, QuantityChanged) VALUES (%s, %s, %s, %s)",
+                    (log_id, str(uuid.uuid4()), 'stock_in', 1)
+                )
+            conn.commit()
+
+    log(2)
+    feed = inventory.change_feed('test-feed', include_products=False, gap_wait=60)
+    # A new consumer waits at a gap too
+    assert feed.poll() == []
+    feed.gap_wait = 0
+    assert [change['LogID'] for change in feed.poll()] == [2]
+    log(4)
+    assert [change['LogID'] for change in feed.poll()] == [4]
+    assert feed.checkpoint() == 0 and feed.lag()['open_gaps'] == 2
+
+    log(3)
+    log(1)
+    assert sorted(change['LogID'] for change in feed.poll()) == [1, 3]
+    assert feed.checkpoint() == 4 and feed.lag()['open_gaps'] == 0
+    feed.commit()
+    assert inventory.change_feed('test-feed').position == 4
+
+
+def test_async_lookup_resolves_directory_misses_per_shard(inventory):
+    product_id = add(inventory, 60.0)
+    inventory.directory_cache.clear()
+
+    async def lookups():
+        service = AsyncInventorySystem(inventory)
+        # The directory read and the probe take connection slots; no operation slot is ever free
+        service._operation_slots = asyncio.Semaphore(0)
+        found = await service.get_product_by_id(product_id, timeout=2)
+        inventory._record_product_shard(product_id, 'high_price')
+        stale = await service.get_product_by_id(product_id, timeout=2)
+        return found, stale, await service.get_product_by_id(str(uuid.uuid4()), timeout=2)
+
+    found, stale, missing = asyncio.run(lookups())
+    assert found['ProductID'] == product_id and stale['ProductID'] == product_id and missing is None
+    assert inventory._lookup_product_shard(product_id) == 'mid_price'
+
+
+def test_async_shard_timeout_starts_once_a_slot_is_free(inventory, monkeypatch):
+    add(inventory, 10.0)
+    monkeypatch.setattr(async_inventory, 'SCATTER_TIMEOUT', 0.5)
+
+    async def queued_read():
+        service = AsyncInventorySystem(inventory)
+        # Every low_price slot is busy for longer than the shard timeout
+        slots, size = service._slots['low_price'], inventory.pools['low_price'].size
+        for _ in range(size):
+            await slots.acquire()
+
+        async def free_slots():
+            await asyncio.sleep(1.0)
+            for _ in range(size):
+                slots.release()
+
+        releaser = asyncio.ensure_future(free_slots())
+        products = await service.list_all_products(timeout=5)
+        await releaser
+        return products, service.last_shard_errors
+
+    products, errors = asyncio.run(queued_read())
+    assert len(products) == 1 and errors == {}
\ No newline at end of file